@@ -1,16 +1,81 @@
-from flask import Flask, request, jsonify
+import time
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from data.query_data import query_rag
+from data.query_data import BATCH_MAX_QUESTIONS, query_rag, query_rag_batch, stream_rag, get_rag_engine
+from api.sse import format_sse
+from api.chat_history import get_chat_store, page_params
+from api.worker import report_startup, startup_stats
+from data.telemetry import render_prometheus, setup_telemetry
 
 app = Flask(__name__)
 CORS(app)
 
+rag_engine = None
+chat_store = None
+
+def start():
+    """
+    Set up telemetry and build and warm the clients so requests never pay for it.
+
+    Runs once per process: from __main__ for the development server, and in
+    every worker after the fork under the api.serve launcher, since neither
+    threads nor connections survive a fork.
+    """
+    global rag_engine, chat_store
+    if rag_engine is not None:
+        return
+    start_time = time.perf_counter()
+    setup_telemetry("stacks-ai-api")
+    engine = get_rag_engine()
+    built = time.perf_counter()
+    warm_up = engine.warm_up()
+    chat_store = get_chat_store()
+    rag_engine = engine
+    report_startup(engine=built - start_time, warm_up=warm_up)
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Reports whether the shared RAG engine can reach its vector store.
+    """
+    status = rag_engine.health_check()
+    status["chat_history"] = chat_store.stats()
+    # Chats that cannot be written are only held in this process's memory
+    status["ok"] = status["ok"] and status["chat_history"]["ok"]
+    status["worker"] = startup_stats()
+    return jsonify(status), 200 if status["ok"] else 503
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return jsonify({"alive": True})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: the engine is warmed up and can reach its vector store.
+    """
+    if rag_engine is None:
+        return jsonify({"ready": False, "error": "starting"}), 503
+    status = rag_engine.readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Exposes per-stage latency and LLM token histograms in the Prometheus text format.
+    """
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/ask', methods=['POST', 'OPTIONS'])
 def ask():
     """
     Handles chat queries and CORS preflight requests for a session.
     
-    For OPTIONS requests, returns CORS headers for preflight checks. For POST requests, validates that the JSON payload includes a user ID, session ID (under "chat_id"), and question. It then retrieves the session's chat history, generates a response using available history with retrieval augmented generation, stores the new chat entry, and returns a JSON object with the original question, generated response, and sources.
+    For OPTIONS requests, returns CORS headers for preflight checks. For POST requests, validates that the JSON payload includes a user ID, session ID (under "chat_id"), and question; an optional "bypass_cache" flag skips the response cache and an optional "retrieval_mode" ("vector", "keyword", "hybrid" or "multi") overrides how context is retrieved. It then looks up the session's contract history in the server-side store, generates a response using available history with retrieval augmented generation, queues the new chat entry for saving, and returns a JSON object with the original question, generated response, and sources.
     """
     if request.method == 'OPTIONS':
         # Handle preflight request
@@ -23,17 +88,21 @@ def ask():
     user_id = data.get("user_id")
     session_id = data.get("chat_id")
     question = data.get("question")
-    chat_history = data.get("history")
+    bypass_cache = bool(data.get("bypass_cache", False))
+    retrieval_mode = data.get("retrieval_mode")
 
     if not user_id or not session_id or not question:
         return jsonify({"error": "User ID, session ID, and question are required"}), 400
 
-    contract_history = [chat["response"] for chat in chat_history]
+    contract_history = chat_store.contract_history(user_id, session_id)
 
-    response_text, sources, _ = query_rag(question, contract_history)
+    response_text, sources, is_contract = query_rag(
+        question, contract_history, engine=rag_engine, use_cache=not bypass_cache,
+        retrieval_mode=retrieval_mode,
+    )
 
     # Save the new chat to the history for this session
-    # save_chat(user_id, session_id, question, response_text)
+    chat_store.save_chat(user_id, session_id, question, response_text, is_contract)
 
     return jsonify({
         "question": question,
@@ -41,15 +110,87 @@ def ask():
         "sources": sources
     })
 
-# @app.route('/history/<user_id>/<session_id>', methods=['GET'])
-# def session_history(user_id, session_id):
-#     chat_history = get_session_chat_history(user_id, session_id)
-#     return jsonify(chat_history)
+@app.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    """
+    Answers many questions in one request, for evaluation runs and bulk generation.
+
+    Expects a JSON payload with a "questions" list (at most BATCH_MAX_QUESTIONS) and the optional
+    "bypass_cache" and "retrieval_mode" of /ask. Questions are answered independently, without
+    session history, and are not saved to chat history. Returns {"results": [...]} in question
+    order, each with "question", "response", "sources", "is_contract", "usage" and "error"; a
+    failed question carries its error message without failing the others.
+    """
+    data = request.json or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+        return jsonify({"error": "A non-empty list of questions is required"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions are accepted per batch"}), 400
 
-# @app.route('/history/<user_id>', methods=['GET'])
-# def history(user_id):
-#     chat_history = get_chat_history(user_id)
-#     return jsonify(chat_history)
+    results = query_rag_batch(
+        questions, engine=rag_engine, use_cache=not bool(data.get("bypass_cache", False)),
+        retrieval_mode=data.get("retrieval_mode"),
+    )
+    return jsonify({"results": results})
+
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    """
+    Streams the answer to a chat query as Server-Sent Events.
+
+    Takes the same JSON payload as /ask. Emits a "sources" event as soon as retrieval
+    finishes, a "token" event for every piece of generated text and a final "done"
+    event carrying the full response, sources and is_contract. Errors raised while
+    generating are reported as an "error" event since the status line has already
+    been sent.
+    """
+    data = request.json
+    user_id = data.get("user_id")
+    session_id = data.get("chat_id")
+    question = data.get("question")
+    bypass_cache = bool(data.get("bypass_cache", False))
+    retrieval_mode = data.get("retrieval_mode")
+
+    if not user_id or not session_id or not question:
+        return jsonify({"error": "User ID, session ID, and question are required"}), 400
+
+    contract_history = chat_store.contract_history(user_id, session_id)
+
+    def generate():
+        try:
+            for event, payload in stream_rag(
+                question, contract_history, engine=rag_engine, use_cache=not bypass_cache,
+                retrieval_mode=retrieval_mode,
+            ):
+                if event == "done":
+                    chat_store.save_chat(user_id, session_id, question, payload["response"], payload["is_contract"])
+                yield format_sse(event, payload)
+        except ValueError as e:
+            yield format_sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/history/<user_id>/<session_id>', methods=['GET'])
+def session_history(user_id, session_id):
+    """
+    Returns one page of a session's chats, newest first. Accepts "limit" and "offset" query parameters.
+    """
+    limit, offset = page_params(request.args)
+    return jsonify(chat_store.get_session_chat_history(user_id, session_id, limit, offset))
+
+@app.route('/history/<user_id>', methods=['GET'])
+def history(user_id):
+    """
+    Returns one page of a user's sessions, most recently active first. Accepts "limit" and "offset" query parameters.
+    """
+    limit, offset = page_params(request.args)
+    return jsonify(chat_store.get_chat_history(user_id, limit, offset))
 
 if __name__ == '__main__':
+    start()
     app.run(debug=True)
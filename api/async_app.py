@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from pydantic import BaseModel
+
+from data.query_data import BATCH_MAX_QUESTIONS, astream_rag, get_rag_engine, query_rag_batch
+from api.concurrency import ConcurrencyLimiter, Overloaded, REQUEST_TIMEOUT
+from api.sse import format_sse
+from api.chat_history import get_chat_store, page_params
+from api.worker import report_startup, startup_stats
+from data.telemetry import in_context, render_prometheus, setup_telemetry
+
+
+SEARCH_THREADS = int(os.environ.get("ASK_SEARCH_THREADS", "8"))
+# Batches run apart from interactive requests, a few at a time
+BATCH_THREADS = int(os.environ.get("ASK_BATCH_THREADS", "2"))
+BATCH_MAX_QUEUED = int(os.environ.get("ASK_BATCH_MAX_QUEUED", "8"))
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="retrieval")
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_THREADS, thread_name_prefix="batch")
+limiter = ConcurrencyLimiter()
+batch_limiter = ConcurrencyLimiter(max_in_flight=BATCH_THREADS, max_queued=BATCH_MAX_QUEUED)
+rag_engine = None
+chat_store = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Builds and warms the shared RAG engine before the server accepts requests.
+    """
+    global rag_engine, chat_store
+    start = time.perf_counter()
+    # Here rather than at import, so a launcher that imports the app before
+    # forking does not start exporter threads the workers would not inherit
+    setup_telemetry("stacks-ai-api")
+    loop = asyncio.get_running_loop()
+    engine = await loop.run_in_executor(search_executor, get_rag_engine)
+    built = time.perf_counter()
+    warm_up = await loop.run_in_executor(search_executor, engine.warm_up)
+    chat_store = await loop.run_in_executor(search_executor, get_chat_store)
+    rag_engine = engine
+    report_startup(engine=built - start, warm_up=warm_up)
+    yield
+    chat_store.close()
+    search_executor.shutdown(wait=False)
+    batch_executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+FastAPIInstrumentor.instrument_app(app, excluded_urls="health,metrics")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["POST", "GET", "OPTIONS"],
+    allow_headers=["Content-Type"],
+)
+
+
+class AskRequest(BaseModel):
+    user_id: str
+    chat_id: str
+    question: str
+    bypass_cache: bool = False
+    retrieval_mode: Optional[Literal["vector", "keyword", "hybrid", "multi"]] = None
+
+
+class AskBatchRequest(BaseModel):
+    questions: List[str]
+    bypass_cache: bool = False
+    retrieval_mode: Optional[Literal["vector", "keyword", "hybrid", "multi"]] = None
+
+
+def overloaded_response(error: Overloaded):
+    return JSONResponse(
+        {"error": str(error)}, status_code=error.status_code, headers={"Retry-After": "1"}
+    )
+
+
+@app.get("/health")
+async def health():
+    """
+    Reports the engine's health together with the limiter's queue state.
+    """
+    status = rag_engine.health_check()
+    status["limiter"] = limiter.stats()
+    status["batch_limiter"] = batch_limiter.stats()
+    status["chat_history"] = chat_store.stats()
+    # Chats that cannot be written are only held in this process's memory
+    status["ok"] = status["ok"] and status["chat_history"]["ok"]
+    status["worker"] = startup_stats()
+    return JSONResponse(status, status_code=200 if status["ok"] else 503)
+
+
+@app.get("/health/live")
+async def liveness():
+    """
+    Liveness probe: the event loop is responsive.
+    """
+    return {"alive": True}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Readiness probe: the engine is warmed up and can reach its vector store.
+    """
+    if rag_engine is None:
+        return JSONResponse({"ready": False, "error": "starting"}, status_code=503)
+    status = await asyncio.get_running_loop().run_in_executor(search_executor, rag_engine.readiness)
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Per-stage latency, LLM token and HTTP server histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/ask")
+async def ask(payload: AskRequest):
+    """
+    Asynchronous equivalent of the Flask /ask endpoint.
+
+    Returns 429 when the wait queue is full, 503 when no slot frees up within the
+    queue timeout and 504 when the answer takes longer than the request timeout.
+    """
+    if not payload.user_id or not payload.chat_id or not payload.question:
+        return JSONResponse({"error": "User ID, session ID, and question are required"}, status_code=400)
+
+    async def answer():
+        contract_history = await asyncio.get_running_loop().run_in_executor(
+            search_executor, chat_store.contract_history, payload.user_id, payload.chat_id
+        )
+        async for event, result in astream_rag(
+            payload.question, contract_history, engine=rag_engine,
+            use_cache=not payload.bypass_cache, retrieval_mode=payload.retrieval_mode,
+            executor=search_executor,
+        ):
+            if event == "done":
+                return result
+
+    try:
+        async with limiter.slot():
+            result = await asyncio.wait_for(answer(), timeout=REQUEST_TIMEOUT)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": "Timed out generating a response"}, status_code=504)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    chat_store.save_chat(payload.user_id, payload.chat_id, payload.question, result["response"], result["is_contract"])
+    return {
+        "question": payload.question,
+        "response": result["response"],
+        "sources": result["sources"],
+        "usage": result["usage"],
+    }
+
+
+@app.post("/ask/batch")
+async def ask_batch(payload: AskBatchRequest):
+    """
+    Asynchronous equivalent of the Flask /ask/batch endpoint.
+
+    Batches have their own limiter and threads, so neither the interactive
+    limiter's slots nor the retrieval threads serving /ask are taken by them,
+    and each runs its own bounded pool of LLM calls. A batch is not subject to
+    the per-request timeout.
+    """
+    if not payload.questions or not all(payload.questions):
+        return JSONResponse({"error": "A non-empty list of questions is required"}, status_code=400)
+    if len(payload.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            {"error": f"At most {BATCH_MAX_QUESTIONS} questions are accepted per batch"}, status_code=400
+        )
+
+    try:
+        async with batch_limiter.slot():
+            results = await asyncio.get_running_loop().run_in_executor(
+                batch_executor,
+                functools.partial(
+                    in_context(query_rag_batch), payload.questions, engine=rag_engine,
+                    use_cache=not payload.bypass_cache, retrieval_mode=payload.retrieval_mode,
+                ),
+            )
+    except Overloaded as e:
+        return overloaded_response(e)
+    return {"results": results}
+
+
+@app.post("/ask/stream")
+async def ask_stream(payload: AskRequest):
+    """
+    Asynchronous equivalent of the Flask /ask/stream endpoint.
+
+    A slot is taken when the stream starts and held until it finishes, so a
+    response that is never iterated never holds one. Overload, errors and the
+    request timeout are all reported as an "error" event, overload with its
+    429/503 status.
+    """
+    if not payload.user_id or not payload.chat_id or not payload.question:
+        return JSONResponse({"error": "User ID, session ID, and question are required"}, status_code=400)
+
+    contract_history = await asyncio.get_running_loop().run_in_executor(
+        search_executor, chat_store.contract_history, payload.user_id, payload.chat_id
+    )
+
+    async def generate():
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            yield format_sse("error", {"error": str(e), "status": e.status_code})
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REQUEST_TIMEOUT
+        events = astream_rag(
+            payload.question, contract_history, engine=rag_engine,
+            use_cache=not payload.bypass_cache, retrieval_mode=payload.retrieval_mode,
+            executor=search_executor,
+        )
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    event, result = await asyncio.wait_for(events.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                if event == "done":
+                    chat_store.save_chat(
+                        payload.user_id, payload.chat_id, payload.question, result["response"], result["is_contract"]
+                    )
+                yield format_sse(event, result)
+        except asyncio.TimeoutError:
+            yield format_sse("error", {"error": "Timed out generating a response"})
+        except ValueError as e:
+            yield format_sse("error", {"error": str(e)})
+        finally:
+            await events.aclose()
+            limiter.release()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/history/{user_id}/{session_id}")
+async def session_history(user_id: str, session_id: str, request: Request):
+    """
+    Asynchronous equivalent of the Flask /history/<user_id>/<session_id> endpoint.
+    """
+    limit, offset = page_params(request.query_params)
+    return await asyncio.get_running_loop().run_in_executor(
+        search_executor, chat_store.get_session_chat_history, user_id, session_id, limit, offset
+    )
+
+
+@app.get("/history/{user_id}")
+async def history(user_id: str, request: Request):
+    """
+    Asynchronous equivalent of the Flask /history/<user_id> endpoint.
+    """
+    limit, offset = page_params(request.query_params)
+    return await asyncio.get_running_loop().run_in_executor(
+        search_executor, chat_store.get_chat_history, user_id, limit, offset
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api.async_app:app", host="0.0.0.0", port=5000, loop="uvloop")
@@ -1,47 +1,347 @@
-# import sqlite3
-
-# DB_FILE = "chat_history.db"
-
-# # Initialize database
-# def init_db():
-#     conn = sqlite3.connect(DB_FILE)
-#     c = conn.cursor()
-#     c.execute('''
-#         CREATE TABLE IF NOT EXISTS chats (
-#             id INTEGER PRIMARY KEY AUTOINCREMENT,
-#             user_id TEXT,
-#             session_id TEXT,
-#             question TEXT,
-#             response TEXT,
-#             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-#         )
-#     ''')
-#     conn.commit()
-#     conn.close()
-
-# def save_chat(user_id, session_id, question, response):
-#     conn = sqlite3.connect(DB_FILE)
-#     c = conn.cursor()
-#     c.execute("INSERT INTO chats (user_id, session_id ,question, response) VALUES (?, ?, ?, ?)",
-#               (user_id, session_id, question, response))
-#     conn.commit()
-#     conn.close()
-
-# def get_session_chat_history(user_id, session_id):
-#     conn = sqlite3.connect(DB_FILE)
-#     c = conn.cursor()
-#     c.execute("SELECT question, response, timestamp FROM chats WHERE user_id = ? AND session_id = ? ORDER BY timestamp DESC", (user_id, session_id))
-#     rows = c.fetchall()
-#     conn.close()
-#     return [{"question": row[0], "response": row[1], "timestamp": row[2]} for row in rows]
-
-# def get_chat_history(user_id):
-#     conn = sqlite3.connect(DB_FILE)
-#     c = conn.cursor()
-#     c.execute("SELECT session_id FROM chats WHERE user_id = ? GROUP BY session_id", (user_id,))
-#     rows = c.fetchall()
-#     conn.close()
-#     return [{"session_id": row[0], "chats": get_session_chat_history(user_id, row[0])} for row in rows]
-
-# # Initialize DB on first run
-# init_db()
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+DB_FILE = os.environ.get("CHAT_HISTORY_DB", "chat_history.db")
+DB_POOL_SIZE = int(os.environ.get("CHAT_HISTORY_POOL_SIZE", "4"))
+SESSION_CACHE_SIZE = int(os.environ.get("CHAT_HISTORY_CACHE_SIZE", "1024"))
+# Most recent chats kept per cached session; older contracts fall outside the history budget anyway
+SESSION_CACHE_CHATS = int(os.environ.get("CHAT_HISTORY_CACHE_CHATS", "50"))
+# Seconds a cached session is trusted before chats other workers saved are read; 0 reads them every time
+SESSION_CACHE_TTL = float(os.environ.get("CHAT_HISTORY_CACHE_TTL", "2"))
+WRITE_BATCH_SIZE = 256
+WRITE_FLUSH_INTERVAL = 0.05
+WRITE_RETRY_DELAY = 0.5
+WRITE_RETRY_MAX_DELAY = 30.0
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Fixed set of SQLite connections shared between threads.
+
+    Connections are opened once in WAL mode, so readers never wait for the
+    writer and no request pays for opening the database.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+
+class ChatHistoryStore:
+    """
+    Server-side chat history keyed by user_id and session_id.
+
+    The latest chats of the sessions being chatted in are kept in an in-memory
+    LRU, so /ask resolves the contract history without touching SQLite. A
+    cached session is trusted for `cache_ttl` seconds and is also refreshed
+    once this process has written to it; a refresh only reads the rows added
+    since the last one, which other worker processes may have written.
+
+    Saving a chat only queues the row; a background thread writes queued rows
+    in batches, so writes never sit on the response path, and keeps them queued
+    and retries with backoff if a write fails.
+    """
+
+    def __init__(self, path: str = DB_FILE, pool_size: int = DB_POOL_SIZE,
+                 cache_size: int = SESSION_CACHE_SIZE, cache_chats: int = SESSION_CACHE_CHATS,
+                 cache_ttl: float = SESSION_CACHE_TTL):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self.cache_size = cache_size
+        self.cache_chats = cache_chats
+        self.cache_ttl = cache_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes flushes, so a batch is never written twice
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        # Batches written so far; a refresh that overlaps one may have missed its rows
+        self._flushes = 0
+        self._wake = threading.Event()
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.written = 0
+        self.write_errors = 0
+        self.last_write_error = None
+        self._init_db()
+        self._writer = threading.Thread(target=self._write_loop, name="chat-history-writer", daemon=True)
+        self._writer.start()
+
+    def _init_db(self):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT,
+                    session_id TEXT,
+                    question TEXT,
+                    response TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chats)")]
+            if "is_contract" not in columns:
+                conn.execute("ALTER TABLE chats ADD COLUMN is_contract INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS chats_session ON chats (user_id, session_id, id)")
+            conn.commit()
+
+    def save_chat(self, user_id: str, session_id: str, question: str, response: str,
+                  is_contract: bool = True):
+        """
+        Record a chat. Returns immediately; the row is written in the background.
+        """
+        entry = {
+            "question": question,
+            "response": response,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "is_contract": bool(is_contract),
+        }
+        key = (user_id, session_id)
+        with self._lock:
+            self._pending.append((key, entry))
+        self._wake.set()
+
+    def session_chats(self, user_id: str, session_id: str) -> list:
+        """
+        The latest chats of a session, at most `cache_chats`, oldest first.
+        """
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._sessions.get(key)
+            pending = [entry for pending_key, entry in self._pending if pending_key == key]
+            if cached is not None and now - cached["checked"] < self.cache_ttl:
+                self._sessions.move_to_end(key)
+                self.hits += 1
+                return self._latest(cached["chats"], pending)
+            if cached is None:
+                self.misses += 1
+            else:
+                self.refreshes += 1
+            last_id = cached["last_id"] if cached is not None else 0
+            flushes = self._flushes
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, question, response, timestamp, is_contract FROM chats "
+                "WHERE user_id = ? AND session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (user_id, session_id, last_id, self.cache_chats),
+            ).fetchall()
+        rows.reverse()
+
+        with self._lock:
+            cached = self._sessions.get(key) or {"chats": [], "last_id": 0, "checked": float("-inf")}
+            new_chats = [
+                {"question": row[1], "response": row[2], "timestamp": row[3], "is_contract": bool(row[4])}
+                for row in rows if row[0] > cached["last_id"]
+            ]
+            cached["chats"] = (cached["chats"] + new_chats)[-self.cache_chats:]
+            cached["last_id"] = max([cached["last_id"]] + [row[0] for row in rows])
+            if self._flushes == flushes:
+                cached["checked"] = now
+            self._sessions[key] = cached
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+            return self._latest(cached["chats"], pending)
+
+    def _latest(self, chats: list, pending: list) -> list:
+        # A queued chat may have been written and read back since it was queued
+        written = {(chat["timestamp"], chat["question"]) for chat in chats}
+        queued = [entry for entry in pending if (entry["timestamp"], entry["question"]) not in written]
+        return (chats + queued)[-self.cache_chats:]
+
+    def contract_history(self, user_id: str, session_id: str) -> list:
+        """
+        Contracts generated in a session, oldest first, as query_rag expects them.
+        """
+        return [chat["response"] for chat in self.session_chats(user_id, session_id) if chat["is_contract"]]
+
+    def get_session_chat_history(self, user_id: str, session_id: str, limit: int = HISTORY_PAGE_SIZE,
+                                 offset: int = 0) -> dict:
+        """
+        One page of a session's chats, newest first.
+        """
+        self.flush()
+        with self.pool.connection() as conn:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM chats WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+            ).fetchone()[0]
+            rows = conn.execute(
+                "SELECT question, response, timestamp, is_contract FROM chats "
+                "WHERE user_id = ? AND session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (user_id, session_id, limit, offset),
+            ).fetchall()
+        return {
+            "session_id": session_id,
+            "chats": [
+                {"question": row[0], "response": row[1], "timestamp": row[2], "is_contract": bool(row[3])}
+                for row in rows
+            ],
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+        }
+
+    def get_chat_history(self, user_id: str, limit: int = HISTORY_PAGE_SIZE, offset: int = 0) -> dict:
+        """
+        One page of a user's sessions, most recently active first, each with its
+        latest chat.
+        """
+        self.flush()
+        with self.pool.connection() as conn:
+            total = conn.execute(
+                "SELECT COUNT(DISTINCT session_id) FROM chats WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+            rows = conn.execute("""
+                SELECT c.session_id, c.question, c.response, c.timestamp, c.is_contract, s.chats
+                FROM (
+                    SELECT session_id, MAX(id) AS last_id, COUNT(*) AS chats
+                    FROM chats WHERE user_id = ? GROUP BY session_id
+                ) s JOIN chats c ON c.id = s.last_id
+                ORDER BY s.last_id DESC
+                LIMIT ? OFFSET ?
+            """, (user_id, limit, offset)).fetchall()
+        sessions = [
+            {
+                "session_id": row[0],
+                "chats": row[5],
+                "last_chat": {
+                    "question": row[1], "response": row[2], "timestamp": row[3], "is_contract": bool(row[4])
+                },
+            }
+            for row in rows
+        ]
+        return {"sessions": sessions, "total": total, "limit": limit, "offset": offset}
+
+    def _write_loop(self):
+        failures = 0
+        while not self._closed:
+            if failures:
+                time.sleep(min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_DELAY * 2 ** (failures - 1)))
+            else:
+                self._wake.wait()
+            self._wake.clear()
+            # Let a burst of chats accumulate into one transaction
+            time.sleep(WRITE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                failures += 1
+                with self._lock:
+                    self.write_errors += 1
+                    self.last_write_error = f"{type(e).__name__}: {e}"
+                    pending = len(self._pending)
+                print(f"⚠️ Chat history write failed ({e}); {pending} chats kept for retry", flush=True)
+                continue
+            if failures:
+                print("✅ Chat history writes recovered", flush=True)
+                failures = 0
+                with self._lock:
+                    self.last_write_error = None
+
+    def flush(self):
+        """
+        Write every queued chat to SQLite.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:WRITE_BATCH_SIZE]
+                if not batch:
+                    return
+                with self.pool.connection() as conn:
+                    try:
+                        conn.executemany(
+                            "INSERT INTO chats (user_id, session_id, question, response, timestamp, is_contract) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            [
+                                (key[0], key[1], entry["question"], entry["response"], entry["timestamp"],
+                                 int(entry["is_contract"]))
+                                for key, entry in batch
+                            ],
+                        )
+                        conn.commit()
+                    except Exception:
+                        # The batch stays queued for the next attempt
+                        conn.rollback()
+                        raise
+                with self._lock:
+                    del self._pending[:len(batch)]
+                    self.written += len(batch)
+                    self._flushes += 1
+                    # Read the written rows back, with their ids, on the next lookup
+                    for key in {key for key, _ in batch}:
+                        if key in self._sessions:
+                            self._sessions[key]["checked"] = float("-inf")
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ok": self.last_write_error is None,
+                "sessions_cached": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "pending_writes": len(self._pending),
+                "written": self.written,
+                "write_errors": self.write_errors,
+                "last_write_error": self.last_write_error,
+            }
+
+
+def get_chat_store():
+    """
+    Return the process-wide ChatHistoryStore, creating it on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatHistoryStore()
+                atexit.register(_store.close)
+    return _store
+
+
+def page_params(args) -> tuple:
+    """
+    Read "limit" and "offset" query parameters, clamped to sane values.
+    """
+    try:
+        limit = int(args.get("limit", HISTORY_PAGE_SIZE))
+        offset = int(args.get("offset", 0))
+    except (TypeError, ValueError):
+        limit, offset = HISTORY_PAGE_SIZE, 0
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE)), max(0, offset)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+
+MAX_IN_FLIGHT = int(os.environ.get("ASK_MAX_IN_FLIGHT", "64"))
+MAX_QUEUED = int(os.environ.get("ASK_MAX_QUEUED", "256"))
+QUEUE_TIMEOUT = float(os.environ.get("ASK_QUEUE_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.environ.get("ASK_REQUEST_TIMEOUT", "120"))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed instead of being admitted.
+
+    Attributes:
+        status_code (int): 429 when the wait queue is full, 503 when the request
+            waited longer than the queue timeout.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds the number of requests running at once and the number waiting for a slot.
+
+    Requests beyond `max_in_flight` wait in a queue of at most `max_queued`; once
+    the queue is full new requests are rejected immediately, and a queued request
+    that cannot start within `queue_timeout` seconds is rejected as well. Shedding
+    early keeps latency bounded for the requests that are admitted.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_queued: int = MAX_QUEUED,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self):
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded(429, "Too many requests are waiting; try again shortly.")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded(503, "Server is overloaded; try again shortly.")
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,131 @@
+"""
+Production entry point: a gunicorn master that preloads shared state and forks
+worker processes.
+
+    python -m api.serve --app flask --workers 4
+    python -m api.serve --app asyncio --workers 4
+
+Before forking, the master imports the app and loads the read-only state every
+worker needs (see data.rag_engine.preload_shared), then freezes the garbage
+collector so those objects stay shared copy-on-write. Each worker builds its
+own engine, connections and threads after the fork and reports its cold start
+and memory.
+
+When populate_database.py, build_quantized_index.py or
+calibrate_relevance_gate.py publish a new index version, the master reloads
+the shared state and replaces the workers gracefully: new workers start on
+the new index while old ones finish their in-flight requests.
+"""
+import argparse
+import gc
+import os
+import signal
+import threading
+import time
+
+from gunicorn.app.base import BaseApplication
+
+
+SERVER_BIND = os.environ.get("SERVER_BIND", "0.0.0.0:5000")
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(os.cpu_count() or 1)))
+# Request threads per Flask worker; asyncio workers serve concurrently on their loop
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "8"))
+# Seconds old workers get to finish in-flight requests on reload or shutdown
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", "150"))
+INDEX_WATCH_INTERVAL = float(os.environ.get("INDEX_WATCH_INTERVAL", "5"))
+
+APPS = {
+    "flask": ("api.app:app", "gthread"),
+    "asyncio": ("api.async_app:app", "uvicorn.workers.UvicornWorker"),
+}
+
+
+def preload(server):
+    """
+    Load the shared read-only state in the master and move everything allocated
+    so far out of the garbage collector's reach, so collections in the workers
+    do not write to (and thereby copy) the shared pages.
+    """
+    from data.rag_engine import CHROMA_PATH, preload_shared
+
+    start = time.perf_counter()
+    gc.unfreeze()
+    preload_shared(CHROMA_PATH)
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded shared state in {time.perf_counter() - start:.2f}s")
+
+
+def watch_index_version(server):
+    """
+    Poll the published index version and send the master SIGHUP when it
+    changes, which gunicorn handles as a graceful reload.
+    """
+    from data.index_manifest import read_index_version
+    from data.rag_engine import CHROMA_PATH
+
+    def run():
+        version = read_index_version(CHROMA_PATH)
+        while True:
+            time.sleep(INDEX_WATCH_INTERVAL)
+            latest = read_index_version(CHROMA_PATH)
+            if latest != version:
+                version = latest
+                server.log.info(f"Index version {latest} published, reloading workers")
+                os.kill(os.getpid(), signal.SIGHUP)
+
+    threading.Thread(target=run, name="index-watcher", daemon=True).start()
+
+
+def post_worker_init(worker):
+    # The asyncio app builds its engine in its lifespan instead
+    if worker.cfg.worker_class_str == APPS["flask"][1]:
+        from api.app import start
+
+        start()
+
+
+class Server(BaseApplication):
+    def __init__(self, target: str, options: dict):
+        self.target = target
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        module_name, attribute = self.target.split(":")
+        module = __import__(module_name, fromlist=[attribute])
+        return getattr(module, attribute)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(APPS), default="asyncio")
+    parser.add_argument("--bind", default=SERVER_BIND)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS)
+    args = parser.parse_args()
+
+    target, worker_class = APPS[args.app]
+    Server(target, {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": worker_class,
+        "threads": args.threads,
+        "preload_app": True,
+        # Workers that stop heartbeating for this long are restarted
+        "timeout": SERVER_GRACEFUL_TIMEOUT,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "keepalive": 5,
+        "on_starting": preload,
+        "on_reload": preload,
+        "when_ready": watch_index_version,
+        "post_worker_init": post_worker_init,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
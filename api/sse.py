@@ -0,0 +1,8 @@
+import json
+
+
+def format_sse(event, payload):
+    """
+    Serializes one Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
@@ -0,0 +1,46 @@
+import os
+import time
+
+import psutil
+
+
+_startup = {}
+
+
+def report_startup(**phases) -> dict:
+    """
+    Log how long this process took to become ready to serve and how much
+    memory it holds, and keep the figures for /health.
+
+    Cold start is measured from the moment the process was created, which for a
+    worker forked by api.serve is the fork. "unique_mb" is memory only this
+    process uses; pages still shared copy-on-write with the launcher and
+    memory-mapped index files are not in it, so it is what each additional
+    worker costs.
+
+    Args:
+        **phases: Seconds spent in named startup phases, e.g. engine=1.2.
+    """
+    process = psutil.Process()
+    memory = process.memory_full_info()
+    _startup.clear()
+    _startup.update({
+        "pid": os.getpid(),
+        "cold_start_seconds": round(time.time() - process.create_time(), 3),
+        "phases": {name: round(seconds, 3) for name, seconds in phases.items()},
+        "rss_mb": round(memory.rss / 2 ** 20, 1),
+        "unique_mb": round(memory.uss / 2 ** 20, 1),
+        # Proportional share, Linux only
+        "pss_mb": round(memory.pss / 2 ** 20, 1) if hasattr(memory, "pss") else None,
+    })
+    phase_text = ", ".join(f"{name} {seconds}s" for name, seconds in _startup["phases"].items())
+    print(
+        f"🚀 Worker {_startup['pid']} ready in {_startup['cold_start_seconds']}s ({phase_text}); "
+        f"RSS {_startup['rss_mb']} MB, unique {_startup['unique_mb']} MB",
+        flush=True,
+    )
+    return dict(_startup)
+
+
+def startup_stats() -> dict:
+    return dict(_startup)
@@ -0,0 +1,116 @@
+import os
+import random
+
+
+# Directories named after the corpora so ingestion routes files the way it
+# routes the real documentation
+CORPUS_DIRECTORIES = ("clarity-book", "stacks-js", "hiro-docs", "guides")
+
+# The splitter makes 2000-character chunks with 500 characters of overlap
+CHUNK_STRIDE = 1500
+FILE_CHARS = 20000
+
+CLARITY_TERMS = (
+    "define-public", "define-read-only", "define-private", "define-map", "define-data-var",
+    "define-fungible-token", "define-non-fungible-token", "stx-transfer?", "ft-mint?", "nft-mint?",
+    "map-get?", "map-set", "var-get", "var-set", "tx-sender", "contract-caller", "unwrap!", "asserts!",
+    "principal", "uint", "response", "tuple", "list", "trait", "impl-trait", "block-height",
+)
+STACKS_JS_TERMS = (
+    "makeContractCall", "openContractCall", "broadcastTransaction", "callReadOnlyFunction",
+    "uintCV", "principalCV", "standardPrincipalCV", "AnchorMode", "PostConditionMode", "StacksTestnet",
+    "StacksMainnet", "showConnect", "UserSession", "AppConfig",
+)
+HIRO_TERMS = (
+    "clarinet", "devnet", "simnet", "chainhook", "deployment plan", "explorer", "API endpoint",
+    "testnet faucet", "Clarinet.toml", "vitest", "mainnet", "ordhook",
+)
+WORDS = (
+    "the", "contract", "function", "returns", "value", "when", "caller", "token", "balance", "owner",
+    "transfer", "mint", "burn", "error", "check", "storage", "key", "state", "block", "transaction",
+    "sender", "amount", "event", "print", "argument", "type", "example", "call", "read", "write",
+    "network", "wallet", "deploy", "test", "fee", "nonce", "post", "condition", "asset", "principal",
+)
+TERMS_BY_DIRECTORY = {
+    "clarity-book": CLARITY_TERMS,
+    "stacks-js": STACKS_JS_TERMS,
+    "hiro-docs": HIRO_TERMS,
+    "guides": CLARITY_TERMS + STACKS_JS_TERMS,
+}
+
+
+def sentence(rng: random.Random, terms: tuple) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    for _ in range(rng.randint(1, 3)):
+        words.insert(rng.randrange(len(words)), f"`{rng.choice(terms)}`")
+    return " ".join(words).capitalize() + "."
+
+
+def code_block(rng: random.Random) -> str:
+    name = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}"
+    lines = [
+        f"(define-public ({name} (amount uint) (recipient principal))",
+        "  (begin",
+        "    (asserts! (> amount u0) (err u100))",
+        f"    ({rng.choice(('stx-transfer?', 'ft-transfer?', 'nft-transfer?'))} amount tx-sender recipient)",
+        "  )",
+        ")",
+    ]
+    return "```clarity\n" + "\n".join(lines) + "\n```"
+
+
+def markdown_file(rng: random.Random, title: str, terms: tuple, chars: int = FILE_CHARS) -> str:
+    parts = [f"# {title}\n"]
+    size = len(parts[0])
+    while size < chars:
+        heading = f"## {rng.choice(terms)} {rng.choice(WORDS)}\n"
+        paragraph = " ".join(sentence(rng, terms) for _ in range(rng.randint(3, 7)))
+        section = heading + "\n" + paragraph + "\n"
+        if rng.random() < 0.4:
+            section += "\n" + code_block(rng) + "\n"
+        parts.append(section)
+        size += len(section)
+    return "\n".join(parts)
+
+
+def generate_corpus(directory: str, chunks: int, seed: int = 0) -> list:
+    """
+    Write Markdown files under `directory` that split into roughly `chunks`
+    chunks, spread over one directory per corpus. The same seed always
+    produces the same files.
+
+    Returns:
+        list: Paths of the generated files.
+    """
+    rng = random.Random(seed)
+    files = max(1, -(-chunks * CHUNK_STRIDE // FILE_CHARS))
+    paths = []
+    for number in range(files):
+        corpus = CORPUS_DIRECTORIES[number % len(CORPUS_DIRECTORIES)]
+        folder = os.path.join(directory, corpus, f"part-{number // 1000:03d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"page-{number:06d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(markdown_file(rng, f"{corpus} page {number}", TERMS_BY_DIRECTORY[corpus]))
+        paths.append(path)
+    return paths
+
+
+def generate_questions(count: int, seed: int = 1) -> list:
+    """
+    Distinct questions in the style users ask, so neither the embedding nor
+    the response cache can answer them.
+    """
+    rng = random.Random(seed)
+    terms = CLARITY_TERMS + STACKS_JS_TERMS + HIRO_TERMS
+    templates = (
+        "Write a Clarity contract that uses {a} and {b} to {w} a {v}",
+        "How do I call {a} from a frontend with {b}?",
+        "Modify the contract so {a} checks the {w} before {b}",
+        "Explain how {a} works with {b} when the {w} {v} changes",
+    )
+    return [
+        rng.choice(templates).format(a=rng.choice(terms), b=rng.choice(terms), w=rng.choice(WORDS),
+                                     v=rng.choice(WORDS)) + f" (#{number})"
+        for number in range(count)
+    ]
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9\-]*")
+
+
+class Latency:
+    """
+    Deterministic latency model: `base` seconds plus `per_item` seconds per
+    item, with uniform jitter of +/- `jitter` as a fraction of the total.
+    """
+
+    def __init__(self, base: float = 0.0, per_item: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.base = base
+        self.per_item = per_item
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, items: int = 1) -> float:
+        seconds = self.base + self.per_item * items
+        if self.jitter:
+            with self._lock:
+                seconds *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(seconds, 0.0)
+
+    def sleep(self, items: int = 1):
+        seconds = self.delay(items)
+        if seconds:
+            time.sleep(seconds)
+
+    async def asleep(self, items: int = 1):
+        seconds = self.delay(items)
+        if seconds:
+            await asyncio.sleep(seconds)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Stand-in for the Bedrock Titan embeddings.
+
+    A text is embedded as the normalized sum of a fixed pseudo-random vector per
+    word, so texts sharing words are close and results are reproducible.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency: Latency = None):
+        self.dimensions = dimensions
+        self.latency = latency or Latency()
+        self.calls = 0
+        self.texts = 0
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word: str):
+        vector = self._words.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            self._words[word] = vector
+        return vector
+
+    def _embed(self, text: str) -> list:
+        total = np.zeros(self.dimensions, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            total += self._word_vector(word)
+        norm = np.linalg.norm(total)
+        return (total / norm if norm else total).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        self.latency.sleep(len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class FakeLLM:
+    """
+    Stand-in for the Gemini clients with the invoke/stream/astream surface the
+    pipeline uses.
+
+    Answers to the retriever prompts are search terms taken from the question;
+    any other prompt gets a fixed-size Clarity contract, streamed word by word
+    after `first_token` seconds with `per_token` seconds between tokens.
+    """
+
+    def __init__(self, first_token: Latency = None, per_token: Latency = None, response_tokens: int = 400):
+        self.first_token = first_token or Latency()
+        self.per_token = per_token or Latency()
+        self.response_tokens = response_tokens
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt: str) -> list:
+        with self._lock:
+            self.calls += 1
+        if "<search_terms>" in prompt:
+            query = prompt.rsplit("Follow up question:", 1)[-1].strip().split("\n", 1)[0]
+            words = WORD_PATTERN.findall(query.lower())[:6]
+            terms = "".join(f"<term>{word}</term>" for word in words)
+            return [f"<search_terms>{terms}</search_terms>"]
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        body = [f"```clarity\n;; benchmark answer {digest}\n(define-public (transfer (amount uint))\n"]
+        body.extend("  (ok amount) " for _ in range(self.response_tokens))
+        body.append(")\n```\n")
+        return body
+
+    def invoke(self, prompt: str) -> str:
+        tokens = self._answer(prompt)
+        self.first_token.sleep()
+        time.sleep(sum(self.per_token.delay() for _ in tokens))
+        return "".join(tokens)
+
+    def stream(self, prompt: str):
+        self.first_token.sleep()
+        for token in self._answer(prompt):
+            self.per_token.sleep()
+            yield token
+
+    async def astream(self, prompt: str):
+        await self.first_token.asleep()
+        for token in self._answer(prompt):
+            await self.per_token.asleep()
+            yield token
@@ -0,0 +1,425 @@
+"""
+Offline benchmarks for ingestion, query latency, /ask throughput and memory.
+
+Bedrock and Gemini are replaced by the deterministic stand-ins in
+benchmarks.fakes and the documentation by a generated Markdown corpus, so runs
+need no credentials or network and are comparable across commits:
+
+    python -m benchmarks.run --chunks 1000 10000 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import psutil
+
+from benchmarks.corpus import generate_corpus, generate_questions
+from benchmarks.fakes import FakeEmbeddings, FakeLLM, Latency
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_ROOT, "data")
+SCENARIOS = ("ingest", "memory", "query", "ask", "batch")
+
+
+class MemorySampler:
+    """
+    Samples this process's resident set size on a background thread and keeps
+    the peak, since the peak is what decides whether a run fits on a machine.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start_rss = self.peak_rss = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_rss = self.process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, self.end_rss)
+
+    def report(self):
+        return {
+            "start_rss_mb": round(self.start_rss / 2 ** 20, 1),
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1),
+            "end_rss_mb": round(self.end_rss / 2 ** 20, 1),
+        }
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    values = np.asarray(samples, dtype=np.float64)
+    return {
+        "count": len(samples),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+
+def stage_delta(before: dict, after: dict) -> dict:
+    """
+    Per-stage calls and seconds recorded between two stage_totals() snapshots.
+    """
+    delta = {}
+    for name, totals in after.items():
+        previous = before.get(name, {"count": 0, "seconds": 0.0})
+        count = totals["count"] - previous["count"]
+        if count:
+            seconds = totals["seconds"] - previous["seconds"]
+            delta[name] = {"count": count, "seconds": round(seconds, 4), "mean": round(seconds / count, 5)}
+    return delta
+
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_backends(args):
+    embeddings = FakeEmbeddings(
+        dimensions=args.dimensions,
+        latency=Latency(args.embed_latency, args.embed_per_text, args.jitter, args.seed),
+    )
+    llm = FakeLLM(
+        first_token=Latency(args.llm_first_token, jitter=args.jitter, seed=args.seed + 1),
+        per_token=Latency(args.llm_per_token, jitter=args.jitter, seed=args.seed + 2),
+        response_tokens=args.response_tokens,
+    )
+    expansion_llm = FakeLLM(
+        first_token=Latency(args.llm_first_token / 2, jitter=args.jitter, seed=args.seed + 3),
+        per_token=Latency(args.llm_per_token, jitter=args.jitter, seed=args.seed + 4),
+    )
+    return embeddings, llm, expansion_llm
+
+
+def load_populate_database(data_path: str, chroma_path: str, embeddings):
+    """
+    Import populate_database the way it runs as a script and point it at the
+    benchmark corpus, index and embeddings.
+    """
+    if DATA_DIR not in sys.path:
+        sys.path.insert(0, DATA_DIR)
+    import populate_database
+
+    populate_database.DATA_PATH = data_path
+    populate_database.CHROMA_PATH = chroma_path
+    populate_database.get_embedding_function = lambda: embeddings
+    return populate_database
+
+
+def bench_ingest(workdir: str, chunks: int, args) -> dict:
+    """
+    Generate the corpus and run populate_database's ingestion pipeline over it.
+    """
+    from data.telemetry import stage_totals
+
+    data_path = os.path.join(workdir, "corpus")
+    chroma_path = os.path.join(workdir, "chroma")
+    start = time.perf_counter()
+    files = generate_corpus(data_path, chunks, seed=args.seed)
+    generate_seconds = time.perf_counter() - start
+
+    embeddings, _, _ = make_backends(args)
+    populate = load_populate_database(data_path, chroma_path, embeddings)
+    before = stage_totals()
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        file_diff = populate.diff_files(data_path, {})
+        plan = populate.plan_buffers(args.max_memory, workers=args.workers)
+        file_chunks = populate.iter_file_chunks(file_diff.to_index, processes=args.processes,
+                                                window=plan.prefetch_files)
+        populate.add_to_chroma(file_chunks, plan=plan, workers=args.workers)
+        embed_seconds = time.perf_counter() - start
+        populate.save_manifest(chroma_path, file_diff.manifest)
+        populate.build_keyword_index()
+        seconds = time.perf_counter() - start
+
+    stored = populate.CorpusCollections(chroma_path, allow_legacy=False).count()
+    return {
+        "files": len(files),
+        "chunks": stored,
+        "generate_seconds": round(generate_seconds, 3),
+        "seconds": round(seconds, 3),
+        "embed_and_write_seconds": round(embed_seconds, 3),
+        "chunks_per_second": round(stored / embed_seconds, 1) if embed_seconds else None,
+        "embedding_calls": embeddings.calls,
+        "index_mb": round(directory_size(chroma_path) / 2 ** 20, 1),
+        "memory": memory.report(),
+        "stages": stage_delta(before, stage_totals()),
+    }
+
+
+def build_quantized(chroma_path: str, method: str):
+    """
+    Build the quantized vector index once per working directory and method.
+    """
+    from data.corpora import CorpusCollections
+    from data.quantized_index import QuantizedIndex, build_quantized_index, quantized_index_path
+
+    path = quantized_index_path(chroma_path)
+    if os.path.exists(path) and QuantizedIndex(path).method == method:
+        return
+    build_quantized_index(CorpusCollections(chroma_path), path, method=method)
+
+
+def build_engine(chroma_path: str, args):
+    from data.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from data.rag_engine import RagEngine
+
+    if args.vector_index != "chroma":
+        build_quantized(chroma_path, args.vector_index)
+    embeddings, llm, expansion_llm = make_backends(args)
+    engine = RagEngine(
+        chroma_path,
+        embedding_function=CachedEmbeddings(embeddings, "benchmark", EmbeddingCache()),
+        llm=llm,
+        expansion_llm=expansion_llm,
+        vector_index="chroma" if args.vector_index == "chroma" else "quantized",
+    )
+    engine.warm_up()
+    return engine
+
+
+def bench_query(workdir: str, args) -> dict:
+    """
+    Latency of stream_rag per retrieval mode: time to sources, to the first
+    token and to the full answer.
+    """
+    from data.query_data import stream_rag
+    from data.telemetry import stage_totals
+
+    engine = build_engine(os.path.join(workdir, "chroma"), args)
+    results = {}
+    for index, mode in enumerate(args.modes):
+        questions = generate_questions(args.queries, seed=args.seed + 100 + index)
+        timings = {"sources": [], "first_token": [], "total": []}
+        prompt_tokens = []
+        before = stage_totals()
+        for question in questions:
+            start = time.perf_counter()
+            first_token = None
+            for event, payload in stream_rag(question, [], engine=engine, retrieval_mode=mode):
+                now = time.perf_counter() - start
+                if event == "sources":
+                    timings["sources"].append(now)
+                elif event == "token" and first_token is None:
+                    first_token = now
+                elif event == "done":
+                    timings["total"].append(now)
+                    if payload["usage"]:
+                        prompt_tokens.append(payload["usage"]["prompt_tokens"])
+            timings["first_token"].append(first_token)
+        results[mode] = {
+            **{f"{name}_seconds": percentiles(samples) for name, samples in timings.items()},
+            "prompt_tokens": percentiles(prompt_tokens),
+            "stages": stage_delta(before, stage_totals()),
+        }
+    return results
+
+
+def bench_batch(workdir: str, args) -> dict:
+    """
+    Throughput of query_rag_batch against answering the same questions one
+    after another with query_rag.
+    """
+    from data.query_data import query_rag, query_rag_batch
+
+    engine = build_engine(os.path.join(workdir, "chroma"), args)
+    # Separate question sets, so neither run is answered from the other's caches
+    sequential_questions = generate_questions(args.batch_size, seed=args.seed + 200)
+    batch_questions = generate_questions(args.batch_size, seed=args.seed + 300)
+
+    start = time.perf_counter()
+    for question in sequential_questions:
+        query_rag(question, [], engine=engine)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = query_rag_batch(batch_questions, engine=engine)
+    batch = time.perf_counter() - start
+    return {
+        "questions": args.batch_size,
+        "sequential_seconds": round(sequential, 3),
+        "batch_seconds": round(batch, 3),
+        "speedup": round(sequential / batch, 2) if batch else None,
+        "errors": sum(result["error"] is not None for result in results),
+    }
+
+
+def bench_ask(workdir: str, args) -> dict:
+    """
+    Throughput and latency of the asyncio server's /ask under concurrent load,
+    driven in-process over ASGI so no port or network is involved.
+    """
+    import httpx
+
+    import api.async_app as async_app
+    from api.chat_history import ChatHistoryStore
+
+    async_app.rag_engine = build_engine(os.path.join(workdir, "chroma"), args)
+    async_app.chat_store = ChatHistoryStore(os.path.join(workdir, "chat_history.db"))
+    questions = generate_questions(args.requests, seed=args.seed + 7)
+
+    async def run(concurrency: int):
+        latencies = []
+        statuses = {}
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=async_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def one(number: int, question: str):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/ask", json={
+                        "user_id": f"user-{number}", "chat_id": f"chat-{number}", "question": question,
+                    })
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(number, question) for number, question in enumerate(questions)))
+            seconds = time.perf_counter() - start
+        return {
+            "requests": len(questions),
+            "seconds": round(seconds, 3),
+            "requests_per_second": round(len(questions) / seconds, 2),
+            "latency_seconds": percentiles(latencies),
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        }
+
+    results = {}
+    for concurrency in args.concurrency:
+        with MemorySampler() as memory:
+            results[str(concurrency)] = asyncio.run(run(concurrency))
+        results[str(concurrency)]["memory"] = memory.report()
+    async_app.chat_store.close()
+    return results
+
+
+def bench_memory(workdir: str, args) -> dict:
+    """
+    Resident memory taken by a warmed-up engine and the on-disk size of the
+    indexes it serves from.
+    """
+    chroma_path = os.path.join(workdir, "chroma")
+    if args.vector_index != "chroma":
+        # Built before measuring, so only serving from it is counted
+        build_quantized(chroma_path, args.vector_index)
+    process = psutil.Process()
+    before = process.memory_info().rss
+    engine = build_engine(chroma_path, args)
+    after = process.memory_info().rss
+    keyword_index = os.path.join(chroma_path, "keyword_index.sqlite3")
+    return {
+        "engine_rss_mb": round((after - before) / 2 ** 20, 1),
+        "process_rss_mb": round(after / 2 ** 20, 1),
+        "chunks": engine.db.count(),
+        "vector_index": engine.vector_index_stats(),
+        "vector_index_mb": round(directory_size(chroma_path) / 2 ** 20, 1),
+        "keyword_index_mb": round(os.path.getsize(keyword_index) / 2 ** 20, 1) if os.path.exists(keyword_index) else None,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--chunks", nargs="+", type=int, default=[1000],
+                        help="Corpus sizes to run, e.g. 1000 10000 100000.")
+    parser.add_argument("--output", help="Write the JSON results to this file as well as stdout.")
+    parser.add_argument("--workdir", help="Keep corpora and indexes here instead of a temporary directory.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50, help="Questions per retrieval mode.")
+    parser.add_argument("--modes", nargs="+", default=["vector", "hybrid", "multi"])
+    parser.add_argument("--requests", type=int, default=200, help="Requests sent to /ask per concurrency level.")
+    parser.add_argument("--batch-size", type=int, default=50, help="Questions per query_rag_batch call.")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--workers", type=int, default=8, help="Embedding workers during ingestion.")
+    parser.add_argument("--processes", type=int, default=1, help="Parse/split processes during ingestion.")
+    parser.add_argument("--max-memory", type=int, default=None, help="Ingestion buffer budget in MB.")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--vector-index", choices=("chroma", "int8", "pq"), default="chroma",
+                        help="Serve vector searches from Chroma or from a quantized index built with this method.")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding call.")
+    parser.add_argument("--embed-per-text", type=float, default=0.002, help="Extra seconds per embedded text.")
+    parser.add_argument("--llm-first-token", type=float, default=0.4, help="Seconds to the first LLM token.")
+    parser.add_argument("--llm-per-token", type=float, default=0.002, help="Seconds between LLM tokens.")
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction, e.g. 0.2.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from data.telemetry import setup_telemetry
+
+    setup_telemetry("stacks-ai-bench", exporter="none")
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "results": {},
+    }
+    for chunks in args.chunks:
+        workdir = os.path.join(args.workdir, str(chunks)) if args.workdir else tempfile.mkdtemp(prefix="bench-")
+        os.makedirs(workdir, exist_ok=True)
+        results = report["results"][str(chunks)] = {}
+        try:
+            if "ingest" in args.scenarios or not os.path.exists(os.path.join(workdir, "chroma")):
+                results["ingest"] = bench_ingest(workdir, chunks, args)
+            # Memory first, before other engines have grown the process
+            for scenario, bench in (
+                ("memory", bench_memory), ("query", bench_query), ("ask", bench_ask), ("batch", bench_batch),
+            ):
+                if scenario in args.scenarios:
+                    results[scenario] = bench(workdir, args)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
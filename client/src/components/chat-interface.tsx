@@ -12,6 +12,7 @@ import { toast } from "@/components/ui/use-toast"
 import { cn } from "@/lib/utils"
 import ChatMessage from "./chat-message"
 import { getOrCreateUserId } from "@/utils/userId"
+import { askStream } from "@/utils/askStream"
 import { set } from "date-fns"
 import { get } from "http"
 
@@ -63,6 +64,7 @@ export default function ChatInterface() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [streamingContent, setStreamingContent] = useState<string | null>(null);
 
   // Toggle dark mode
   const toggleDarkMode = () => {
@@ -216,25 +218,16 @@ export default function ChatInterface() {
     setIsLoading(true);
 
     try {
-      // Updated to use the full backend URL with port 5000
-      const response = await fetch(`${backendUrl}/ask`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Accept: "application/json",
-        },
-        body: JSON.stringify({
+      // Stream the answer so it renders while it is being generated
+      const data = await askStream(
+        backendUrl,
+        {
           user_id: userId,
           question: userMessage.content,
           chat_id: activeChatId,
-          history: getSessionChatHistory(userId, activeChatId as string),
-        }),
-      }
-    ) 
-      if (!response.ok) throw new Error('Failed to send message')
-      
-      
-      const data = await response.json()
+        },
+        (text) => setStreamingContent(text)
+      )
       saveChatToLocalStorage(userId, activeChatId as string, input, data.response);
       
       // Add assistant response to chat
@@ -259,6 +252,7 @@ export default function ChatInterface() {
         variant: "destructive",
       });
     } finally {
+      setStreamingContent(null);
       setIsLoading(false);
     }
   };
@@ -452,7 +446,11 @@ export default function ChatInterface() {
           )}
 
           {isLoading && (
-            <ChatMessage role="assistant" content="..." isLoading={true} />
+            streamingContent ? (
+              <ChatMessage role="assistant" content={streamingContent} isLoading={false} />
+            ) : (
+              <ChatMessage role="assistant" content="..." isLoading={true} />
+            )
           )}
           <div ref={messagesEndRef} />
         </div>
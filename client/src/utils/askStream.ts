@@ -0,0 +1,70 @@
+export interface AskStreamResult {
+  response: string;
+  sources: (string | null)[];
+  is_contract: boolean;
+}
+
+/**
+ * Posts a question to the backend's `/ask/stream` endpoint and reads the Server-Sent Events it returns.
+ *
+ * `onToken` is called with the accumulated response text every time a new "token" event arrives, so the
+ * caller can render the answer while it is still being generated.
+ *
+ * @param backendUrl - Base URL of the backend.
+ * @param body - The same JSON payload accepted by `/ask`.
+ * @param onToken - Callback receiving the response text generated so far.
+ * @returns The payload of the final "done" event.
+ */
+export async function askStream(
+  backendUrl: string | undefined,
+  body: Record<string, unknown>,
+  onToken: (text: string) => void
+): Promise<AskStreamResult> {
+  const response = await fetch(`${backendUrl}/ask/stream`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      Accept: "text/event-stream",
+    },
+    body: JSON.stringify(body),
+  });
+  if (!response.ok || !response.body) throw new Error("Failed to send message");
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+
+      if (event === "token") {
+        text += payload;
+        onToken(text);
+      } else if (event === "done") {
+        return payload as AskStreamResult;
+      } else if (event === "error") {
+        throw new Error(payload.error);
+      }
+    }
+  }
+  throw new Error("Stream ended before the response was complete");
+}
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from data.corpora import CorpusCollections
+from data.embedding_cache import embed_queries
+from data.get_embedding_function import get_embedding_function
+from data.index_manifest import publish_index_version
+from data.rag_engine import CHROMA_PATH
+from data.relevance_gate import (
+    RelevanceGate, build_centroids, relevance_centroids_path, save_calibration,
+)
+
+LABELLED_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevance_queries.jsonl")
+
+
+def load_labelled_queries(path: str) -> list:
+    """
+    Read {"question": str, "related": bool} lines.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score_queries(queries: list, db, embedding_function, gate: RelevanceGate) -> list:
+    """
+    Both gate signals for every labelled question: the distance to the nearest
+    chunk in the corpora it is routed to, and the similarity to the nearest
+    centroid.
+    """
+    # Embedded as /ask embeds questions, so thresholds fit the vectors the gate sees
+    embeddings = embed_queries(embedding_function, [query["question"] for query in queries])
+    scored = []
+    for query, embedding in zip(queries, embeddings):
+        hits = db.similarity_search_by_vector_with_relevance_scores(embedding, k=1, corpora=db.route(query["question"]))
+        scored.append({
+            **query,
+            "distance": hits[0][1] if hits else None,
+            "similarity": gate.centroid_similarity(embedding) if gate.centroids is not None else None,
+        })
+    return scored
+
+
+def rates(scored: list, max_distance, min_similarity) -> dict:
+    """
+    Share of related questions let through and of unrelated ones gated when
+    the gate uses the given thresholds (None leaves a signal out).
+    """
+    def gated(item):
+        verdicts = []
+        if max_distance is not None and item["distance"] is not None:
+            verdicts.append(item["distance"] > max_distance)
+        if min_similarity is not None and item["similarity"] is not None:
+            verdicts.append(item["similarity"] < min_similarity)
+        return bool(verdicts) and all(verdicts)
+
+    related = [item for item in scored if item["related"]]
+    unrelated = [item for item in scored if not item["related"]]
+    return {
+        "related_passed": round(sum(not gated(item) for item in related) / max(len(related), 1), 4),
+        "unrelated_gated": round(sum(gated(item) for item in unrelated) / max(len(unrelated), 1), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pick relevance gate thresholds from a labelled query set and save them next to the index."
+    )
+    parser.add_argument("--queries", default=LABELLED_QUERIES, help="JSONL file of labelled questions.")
+    parser.add_argument("--keep", type=float, default=0.98,
+                        help="Share of related questions each signal must let through.")
+    parser.add_argument("--signals", nargs="+", choices=("distance", "centroid"), default=["distance", "centroid"])
+    parser.add_argument("--rebuild-centroids", action="store_true", help="Recompute the ingest-time centroids.")
+    parser.add_argument("--dry-run", action="store_true", help="Report the thresholds without saving them.")
+    args = parser.parse_args()
+
+    embedding_function = get_embedding_function()
+    db = CorpusCollections(CHROMA_PATH, embedding_function)
+    centroids_path = relevance_centroids_path(CHROMA_PATH)
+    if "centroid" in args.signals and (args.rebuild_centroids or not os.path.exists(centroids_path)):
+        print(f"Built {build_centroids(db, centroids_path)} centroids")
+    gate = RelevanceGate(CHROMA_PATH, model_id=db.model_id)
+    if "centroid" in args.signals and os.path.exists(centroids_path):
+        gate.centroids = np.load(centroids_path)
+
+    queries = load_labelled_queries(args.queries)
+    scored = score_queries(queries, db, embedding_function, gate)
+    related = [item for item in scored if item["related"]]
+    if not related:
+        raise ValueError(f"{args.queries} has no related questions to calibrate against")
+
+    distances = [item["distance"] for item in related if item["distance"] is not None]
+    similarities = [item["similarity"] for item in related if item["similarity"] is not None]
+    max_distance = float(np.quantile(distances, args.keep)) if "distance" in args.signals and distances else None
+    min_similarity = (
+        float(np.quantile(similarities, 1 - args.keep)) if "centroid" in args.signals and similarities else None
+    )
+
+    print(f"{len(related)} related and {len(scored) - len(related)} unrelated questions")
+    for name, thresholds in (
+        ("distance", (max_distance, None)),
+        ("centroid", (None, min_similarity)),
+        ("combined", (max_distance, min_similarity)),
+    ):
+        if any(threshold is not None for threshold in thresholds):
+            print(f"{name:>9}: {rates(scored, *thresholds)}")
+
+    calibration = {
+        "model_id": db.model_id,
+        "max_distance": max_distance,
+        "min_similarity": min_similarity,
+        "keep": args.keep,
+        "queries": len(scored),
+        **rates(scored, max_distance, min_similarity),
+        "calibrated_at": int(time.time()),
+    }
+    print(json.dumps(calibration, indent=1))
+    if not args.dry_run:
+        save_calibration(CHROMA_PATH, calibration)
+        publish_index_version(CHROMA_PATH, "calibrate_relevance_gate")
+        print("✅ Saved; servers started with api.serve reload to use the new thresholds")
+
+
+if __name__ == "__main__":
+    main()
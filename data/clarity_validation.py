@@ -0,0 +1,218 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+CONTRACT_CHECK_CACHE_MAX_ENTRIES = int(os.environ.get("CONTRACT_CHECK_CACHE_MAX_ENTRIES", "4096"))
+
+# Top-level definitions, whose first argument must be a name
+DEFINITION_FORMS = {
+    "define-public", "define-private", "define-read-only", "define-constant", "define-data-var", "define-map",
+    "define-fungible-token", "define-non-fungible-token", "define-trait", "impl-trait", "use-trait",
+}
+# Definitions taking a (name args...) signature rather than a bare name
+FUNCTION_FORMS = {"define-public", "define-private", "define-read-only"}
+CLOSING = {")": "(", "}": "{"}
+# Fenced blocks the prompt asks for are untagged; JavaScript ones are told apart by content
+FENCE_PATTERN = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)```", re.DOTALL)
+CLARITY_TAGS = {"", "clarity", "clar", "lisp", "scheme"}
+SYMBOL_PATTERN = re.compile(r'[^\s(){}";,]+')
+TOKEN_PATTERN = re.compile(r"[(){}]|[^\s(){}]+")
+
+
+class ContractCheck:
+    """
+    Result of validating a response.
+
+    Attributes:
+        code (str): The Clarity code extracted from the response, "" when it has none.
+        issues (list): Problems found in the code; empty when it is valid.
+    """
+
+    def __init__(self, code: str, issues: list):
+        self.code = code
+        self.issues = issues
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.code) and not self.issues
+
+
+def strip_comments(code: str) -> str:
+    return "\n".join(line.split(";;", 1)[0] for line in code.splitlines())
+
+
+def looks_like_clarity(code: str) -> bool:
+    return strip_comments(code).lstrip().startswith("(")
+
+
+def extract_clarity(response_text: str) -> str:
+    """
+    The Clarity code in a response: its fenced Clarity blocks joined, or the
+    whole text when it is unfenced code such as an already extracted contract.
+    """
+    blocks = [
+        body.strip() for tag, body in FENCE_PATTERN.findall(response_text or "")
+        if tag.lower() in CLARITY_TAGS and looks_like_clarity(body)
+    ]
+    if blocks:
+        return "\n\n".join(blocks)
+    text = (response_text or "").strip()
+    return text if "```" not in text and looks_like_clarity(text) else ""
+
+
+def check_clarity(code: str) -> list:
+    """
+    Lint Clarity code without running it: brackets and strings must be
+    balanced, the top level may only hold list expressions such as definitions,
+    (map-set ...) or (print ...), each definition needs a name, and functions
+    need (name type) parameters and a body.
+
+    Returns:
+        list: Issue descriptions, empty when none were found.
+    """
+    issues = []
+    stack = []
+    top_level = []
+    line = 1
+    i = 0
+    while i < len(code):
+        char = code[i]
+        if char == "\n":
+            line += 1
+        elif char == ";":
+            end = code.find("\n", i)
+            i = len(code) if end == -1 else end
+            continue
+        elif char == '"':
+            if not stack:
+                issues.append(f"line {line}: string outside a definition")
+                return issues
+            start_line = line
+            i += 1
+            while i < len(code) and code[i] != '"':
+                if code[i] == "\\":
+                    i += 1
+                elif code[i] == "\n":
+                    line += 1
+                i += 1
+            if i >= len(code):
+                issues.append(f"line {start_line}: unterminated string")
+                break
+        elif char in "({":
+            if not stack and char == "(":
+                top_level.append((line, i + 1))
+            elif not stack:
+                issues.append(f"line {line}: tuple outside a definition")
+            stack.append((char, line))
+        elif char in CLOSING:
+            if not stack or stack[-1][0] != CLOSING[char]:
+                issues.append(f"line {line}: unexpected '{char}'")
+                return issues
+            stack.pop()
+            if not stack and char == ")":
+                top_level[-1] = (*top_level[-1], i)
+        elif not stack and not char.isspace():
+            token = SYMBOL_PATTERN.match(code, i)
+            issues.append(f"line {line}: '{token.group(0) if token else char}' outside a definition")
+            return issues
+        i += 1
+    for opener, opened_at in stack:
+        issues.append(f"line {opened_at}: '{opener}' is never closed")
+    if issues:
+        return issues
+
+    if not top_level:
+        issues.append("no top-level forms")
+    for form_line, start, end in top_level:
+        words = TOKEN_PATTERN.findall(strip_comments(code[start:end]))
+        name = words[0] if words else ""
+        if not SYMBOL_PATTERN.fullmatch(name):
+            issues.append(f"line {form_line}: top-level form does not start with a function name")
+            continue
+        if name not in DEFINITION_FORMS:
+            continue
+        words = words[1:]
+        if name in FUNCTION_FORMS:
+            issue = _signature_issue(words)
+        elif not words or not SYMBOL_PATTERN.fullmatch(words[0]):
+            issue = "without a name"
+        else:
+            issue = None
+        if issue:
+            issues.append(f"line {form_line}: {name} {issue}")
+    return issues
+
+
+def _signature_issue(words: list):
+    """
+    What is wrong with the tokens of a function definition after its keyword,
+    "( name (param type)... ) body...", or None.
+    """
+    if words[:1] != ["("] or len(words) < 2 or not SYMBOL_PATTERN.fullmatch(words[1]):
+        return "without a name"
+    depth = 0
+    for i, word in enumerate(words[2:], 2):
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            if depth == 0:
+                return None if i + 1 < len(words) else "without a body"
+            depth -= 1
+        elif depth == 0:
+            return f"parameter '{word}' is not a (name type) pair"
+    return "without a name"
+
+
+class ContractValidator:
+    """
+    Decides which responses are contracts worth keeping in a session's history.
+
+    A response counts as a contract only when it contains Clarity code that
+    passes check_clarity. Results are memoized by a hash of the code, since the
+    same contracts are re-checked on every turn of a session.
+    """
+
+    def __init__(self, max_entries: int = CONTRACT_CHECK_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def validate(self, response_text: str) -> ContractCheck:
+        code = extract_clarity(response_text)
+        if not code:
+            return ContractCheck("", ["no Clarity code"])
+        key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        with self._lock:
+            issues = self._entries.get(key)
+            if issues is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ContractCheck(code, list(issues))
+            self.misses += 1
+
+        issues = check_clarity(code)
+        with self._lock:
+            if issues:
+                self.rejected += 1
+            self._entries[key] = issues
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return ContractCheck(code, list(issues))
+
+    def history(self, current_contracts: list) -> list:
+        """
+        The valid contracts of a session's history, reduced to their code.
+        """
+        checks = (self.validate(contract) for contract in current_contracts or [])
+        return [check.code for check in checks if check.valid]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "rejected": self.rejected, "entries": len(self._entries)}
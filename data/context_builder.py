@@ -0,0 +1,212 @@
+import hashlib
+import os
+import re
+
+from langchain_core.documents import Document
+
+from data.multi_query import estimate_tokens
+
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "4000"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "3000"))
+# Share of a chunk's word shingles already present in a better-ranked chunk
+# above which it is dropped as a near-duplicate
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+SHINGLE_SIZE = 4
+# Chunks are split with 500 characters of overlap; look a little further
+MAX_OVERLAP_CHARS = 600
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+NO_HISTORY = "No prior contract exists."
+
+# Top-level Clarity definitions kept when an older contract is summarized
+DEFINITION_PATTERN = re.compile(r"^\s*\((define-[a-z-]+|impl-trait|use-trait)\b[^\n]*", re.MULTILINE)
+
+
+class PromptContext:
+    """
+    Context and contract history ready to be placed in the prompt.
+
+    Attributes:
+        context_text (str): Retrieved documentation, merged and deduplicated.
+        contract_history (str): Contract history fitted to its token budget.
+        usage (dict): Estimated token counts and what was merged, dropped or summarized.
+    """
+
+    def __init__(self, context_text: str, contract_history: str, usage: dict):
+        self.context_text = context_text
+        self.contract_history = contract_history
+        self.usage = usage
+
+
+def split_chunk_id(chunk_id: str):
+    """
+    Split a "source:page:index" chunk id into (source, page, index).
+    """
+    try:
+        source, page, index = chunk_id.rsplit(":", 2)
+        return source, page, int(index)
+    except (AttributeError, ValueError):
+        return None
+
+
+def overlap_length(first: str, second: str, max_chars: int = MAX_OVERLAP_CHARS) -> int:
+    """
+    Length of the longest suffix of `first` that is also a prefix of `second`.
+    """
+    for length in range(min(len(first), len(second), max_chars), 0, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent(results: list):
+    """
+    Merge chunks that were split next to each other from the same page.
+
+    Neighbouring chunks share up to 500 characters, so sending both repeats that
+    text. Each merged run takes the place of its best-ranked chunk.
+
+    Returns:
+        tuple: (list of (Document, score) pairs, number of chunks merged away)
+    """
+    runs = {}
+    for rank, (doc, score) in enumerate(results):
+        parts = split_chunk_id(doc.metadata.get("id"))
+        key = parts[:2] if parts else ("rank", rank)
+        runs.setdefault(key, []).append((parts[2] if parts else 0, rank, doc, score))
+
+    merged = []
+    for members in runs.values():
+        members.sort(key=lambda member: member[0])
+        run = [members[0]]
+        for member in members[1:]:
+            if member[0] == run[-1][0] + 1:
+                run.append(member)
+                continue
+            merged.append(_merge_run(run))
+            run = [member]
+        merged.append(_merge_run(run))
+    merged.sort(key=lambda item: item[0])
+    return [(doc, score) for _rank, doc, score in merged], len(results) - len(merged)
+
+
+def _merge_run(run: list):
+    best_rank = min(member[1] for member in run)
+    best_score = next(member[3] for member in run if member[1] == best_rank)
+    if len(run) == 1:
+        return best_rank, run[0][2], best_score
+    text = run[0][2].page_content
+    for member in run[1:]:
+        following = member[2].page_content
+        text += following[overlap_length(text, following):]
+    metadata = dict(run[0][2].metadata)
+    metadata["merged_ids"] = [member[2].metadata.get("id") for member in run]
+    return best_rank, Document(page_content=text, metadata=metadata), best_score
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    words = text.lower().split()
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(results: list, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """
+    Drop chunks whose text is mostly contained in a better-ranked chunk, e.g. the
+    same section copied between the Clarity book and the Hiro docs, or a chunk
+    already covered by a merged run.
+
+    Returns:
+        tuple: (list of (Document, score) pairs, number of chunks dropped)
+    """
+    kept = []
+    kept_shingles = []
+    for doc, score in results:
+        current = shingles(doc.page_content)
+        if any(
+            len(current & other) / max(len(current), 1) >= threshold
+            for other in kept_shingles
+        ):
+            continue
+        kept.append((doc, score))
+        kept_shingles.append(current)
+    return kept, len(results) - len(kept)
+
+
+def summarize_contract(contract: str, number: int) -> str:
+    """
+    Outline of an older contract: its top-level definitions, or only its hash
+    when it has none.
+    """
+    digest = hashlib.sha256(contract.encode("utf-8")).hexdigest()[:12]
+    definitions = [match.group(0).strip() for match in DEFINITION_PATTERN.finditer(contract)]
+    header = f";; Contract {number} (summarized, sha256 {digest})"
+    return "\n".join([header, *definitions])
+
+
+def build_history(current_contracts: list, token_budget: int = HISTORY_TOKEN_BUDGET):
+    """
+    Fit the session's contracts into `token_budget`.
+
+    The most recent contract is always kept in full since it is the one a
+    "modify" request refers to. Older contracts are summarized to their
+    definitions, newest first, and reduced to a hash once the budget runs out.
+
+    Returns:
+        tuple: (history text, {"full": int, "summarized": int, "hashed": int})
+    """
+    counts = {"full": 0, "summarized": 0, "hashed": 0}
+    if not current_contracts:
+        return NO_HISTORY, counts
+
+    latest = current_contracts[-1]
+    counts["full"] = 1
+    used = estimate_tokens(latest)
+    older = []
+    for number in range(len(current_contracts) - 1, 0, -1):
+        contract = current_contracts[number - 1]
+        summary = summarize_contract(contract, number)
+        if used + estimate_tokens(summary) <= token_budget:
+            counts["summarized"] += 1
+        else:
+            summary = summary.split("\n", 1)[0]
+            counts["hashed"] += 1
+        used += estimate_tokens(summary)
+        older.append(summary)
+    older.reverse()
+    return CONTEXT_SEPARATOR.join([*older, latest]), counts
+
+
+def build_context(results: list, current_contracts: list, context_budget: int = CONTEXT_TOKEN_BUDGET,
+                  history_budget: int = HISTORY_TOKEN_BUDGET) -> PromptContext:
+    """
+    Assemble the documentation context and contract history for the prompt.
+
+    Adjacent chunks are merged, near-duplicates dropped and the remaining chunks
+    kept in rank order until `context_budget` is spent; the best chunk is always
+    kept. Token counts are estimates, not the model's tokenizer.
+    """
+    merged, merged_away = merge_adjacent(results)
+    unique, duplicates = drop_near_duplicates(merged)
+
+    blocks = []
+    context_tokens = 0
+    for doc, _score in unique:
+        tokens = estimate_tokens(doc.page_content)
+        if blocks and context_tokens + tokens > context_budget:
+            break
+        blocks.append(doc.page_content)
+        context_tokens += tokens
+
+    contract_history, history_counts = build_history(current_contracts, history_budget)
+    usage = {
+        "chunks_retrieved": len(results),
+        "chunks_merged": merged_away,
+        "chunks_duplicate": duplicates,
+        "chunks_used": len(blocks),
+        "context_tokens": context_tokens,
+        "history_tokens": estimate_tokens(contract_history),
+        "contracts": history_counts,
+    }
+    return PromptContext(CONTEXT_SEPARATOR.join(blocks), contract_history, usage)
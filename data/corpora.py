@@ -0,0 +1,314 @@
+import os
+import re
+from pathlib import Path
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+
+CORPORA = ("claritybook", "stackjs", "hirodocs", "general")
+DEFAULT_CORPUS = "general"
+LEGACY_COLLECTION = "langchain"
+COLLECTION_PREFIX = "stacks_ai_"
+# Collection metadata recording which embedding model produced the vectors
+EMBEDDING_MODEL_KEY = "embedding_model"
+EMBEDDING_DIMENSIONS_KEY = "embedding_dimensions"
+CORPUS_ROUTING = os.environ.get("CORPUS_ROUTING", "1") != "0"
+
+# Matched against the directory names of a source path as encoded in a chunk id
+CORPUS_PATH_PATTERNS = {
+    "claritybook": re.compile(r"clarity|book", re.IGNORECASE),
+    "stackjs": re.compile(r"stacks?[-_. ]?js", re.IGNORECASE),
+    "hirodocs": re.compile(r"hiro", re.IGNORECASE),
+}
+
+# Keyword rules used to route a question to the corpora likely to answer it
+CORPUS_QUERY_PATTERNS = {
+    "claritybook": re.compile(
+        r"\bclarity\b|\bcontract|\bdefine-|\bmap\b|\btrait|\bnft\b|fungible|\bsip-?0?(09|10)\b|\bprincipal"
+        r"|tx-sender|\bmint|\bstx-|\bft-|\bnft-|\bdata-var|\bread-only|\bpublic function|\bprivate function"
+        r"|\blist\b|\btuple|\bassert|\bunwrap|\bresponse type|\berr\b|\bok\b|\bstorage",
+        re.IGNORECASE,
+    ),
+    "stackjs": re.compile(
+        r"stacks\.?js|@stacks/|\bjavascript|\btypescript|\bfrontend|\bfront-end|\breact\b|\bnext\.?js|\bnpm\b"
+        r"|\bwallet|\bconnect\b|\bleather|\bxverse|makecontractcall|opencontractcall|\bbroadcast|\bsign"
+        r"|\bintegrat",
+        re.IGNORECASE,
+    ),
+    "hirodocs": re.compile(
+        r"\bhiro\b|\bclarinet|\bchainhook|\bdevnet|\btestnet|\bmainnet|\bdeploy|\bexplorer|\bapi\b|\bendpoint"
+        r"|\bordhook|\bplatform|\bnode\b|\bsimnet|\btest(s|ing)?\b",
+        re.IGNORECASE,
+    ),
+}
+
+
+def collection_name(corpus: str) -> str:
+    return f"{COLLECTION_PREFIX}{corpus}"
+
+
+def corpus_for_source(source: str) -> str:
+    """
+    Corpus a source file belongs to, decided by its directory names.
+
+    Chunks are stored in and looked up from their corpus's collection by id
+    alone, so this depends only on the source path a chunk id encodes.
+    """
+    path = Path(source)
+    for part in path.parts[:-1] or path.parts:
+        for corpus, pattern in CORPUS_PATH_PATTERNS.items():
+            if pattern.search(part):
+                return corpus
+    return DEFAULT_CORPUS
+
+
+def source_of(chunk_id: str) -> str:
+    """
+    Source path encoded in a "source:page:index" chunk id.
+    """
+    return chunk_id.rsplit(":", 2)[0]
+
+
+def route_query(query_text: str, available=CORPORA) -> list:
+    """
+    Pick the corpora worth searching for a question using keyword rules.
+
+    The general corpus is always searched. When no rule matches, every corpus is
+    searched.
+    """
+    matched = [
+        corpus for corpus, pattern in CORPUS_QUERY_PATTERNS.items()
+        if corpus in available and pattern.search(query_text)
+    ]
+    if not matched:
+        return list(available)
+    if DEFAULT_CORPUS in available:
+        matched.append(DEFAULT_CORPUS)
+    return matched
+
+
+class EmbeddingMismatch(ValueError):
+    """
+    Raised when a collection holds vectors from a different embedding model or
+    dimension than the configured backend produces.
+    """
+
+
+class CorpusCollections:
+    """
+    One Chroma collection per corpus behind a single Chroma-like interface.
+
+    Chunks are written to the collection of their source's corpus, ids are
+    resolved back to their collection through the source path they encode, and
+    searches can be limited to a subset of corpora and run concurrently.
+
+    A database built before corpora were introduced keeps everything in the
+    default langchain collection. Readers open it as a single "legacy"
+    collection, without routing, until populate_database (which passes
+    allow_legacy=False) migrates it.
+
+    The embedding model id and dimensions are recorded in each collection's
+    metadata on first write and checked on open, so switching
+    EMBEDDING_BACKEND without re-indexing fails loudly instead of searching
+    vectors from one model with queries from another.
+
+    With a `vector_index` (see quantized_index.QuantizedIndex) similarity
+    searches are answered from it and only the matched chunks are read from
+    Chroma, so Chroma's HNSW index is never loaded.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function=None, executor=None, allow_legacy: bool = True,
+                 vector_index=None):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.executor = executor
+        self.vector_index = vector_index
+        existing = set(self.list_collection_names(persist_directory))
+        self.has_legacy = LEGACY_COLLECTION in existing
+        self.legacy = allow_legacy and self.has_legacy and not any(
+            collection_name(corpus) in existing for corpus in CORPORA
+        )
+        if self.legacy:
+            self.collections = {
+                LEGACY_COLLECTION: Chroma(
+                    persist_directory=persist_directory, embedding_function=embedding_function
+                )
+            }
+        else:
+            self.collections = {
+                corpus: Chroma(
+                    persist_directory=persist_directory,
+                    collection_name=collection_name(corpus),
+                    embedding_function=embedding_function,
+                )
+                for corpus in CORPORA
+            }
+        self.model_id = getattr(embedding_function, "model_id", None)
+        self.dimensions = getattr(embedding_function, "dimensions", None)
+        self._stamped = set()
+        self.check_embeddings()
+
+    @staticmethod
+    def list_collection_names(persist_directory: str) -> list:
+        if not os.path.exists(persist_directory):
+            return []
+        client = chromadb.PersistentClient(path=persist_directory)
+        # chromadb returns names from 0.6 on and Collection objects before that
+        return [getattr(collection, "name", collection) for collection in client.list_collections()]
+
+    @property
+    def corpora(self) -> list:
+        return list(self.collections)
+
+    def corpus_of(self, chunk_id: str) -> str:
+        if self.legacy:
+            return LEGACY_COLLECTION
+        return corpus_for_source(source_of(chunk_id))
+
+    def collection_for(self, chunk_id: str):
+        return self.collections[self.corpus_of(chunk_id)]
+
+    def route(self, query_text: str) -> list:
+        if self.legacy or not CORPUS_ROUTING:
+            return self.corpora
+        return route_query(query_text, available=self.corpora)
+
+    def _group_ids(self, chunk_ids):
+        groups = {}
+        for chunk_id in chunk_ids:
+            collection = self.collection_for(chunk_id)
+            groups.setdefault(id(collection), (collection, []))[1].append(chunk_id)
+        return groups.values()
+
+    @staticmethod
+    def recorded_embedding(collection):
+        """
+        (model_id, dimensions) a collection was built with. Collections from
+        before this was recorded have no model id; their dimensions are read
+        from a stored vector.
+        """
+        metadata = collection._collection.metadata or {}
+        model_id = metadata.get(EMBEDDING_MODEL_KEY)
+        dimensions = metadata.get(EMBEDDING_DIMENSIONS_KEY)
+        if dimensions is None and collection._collection.count():
+            sample = collection._collection.peek(1)["embeddings"]
+            if sample is not None and len(sample):
+                dimensions = len(sample[0])
+        return model_id, dimensions
+
+    def check_embeddings(self):
+        for name, collection in self.collections.items():
+            model_id, dimensions = self.recorded_embedding(collection)
+            if (model_id and self.model_id and model_id != self.model_id) or (
+                dimensions and self.dimensions and dimensions != self.dimensions
+            ):
+                raise EmbeddingMismatch(
+                    f"The {name} collection was built with {model_id or 'an unrecorded model'} "
+                    f"({dimensions} dimensions) but the configured backend is {self.model_id} "
+                    f"({self.dimensions} dimensions). Re-index with populate_database.py --reset "
+                    f"or switch EMBEDDING_BACKEND back."
+                )
+
+    def _stamp(self, collection):
+        if self.model_id is None or id(collection) in self._stamped:
+            return
+        metadata = {
+            key: value for key, value in (collection._collection.metadata or {}).items()
+            if not key.startswith("hnsw:")
+        }
+        if metadata.get(EMBEDDING_MODEL_KEY) != self.model_id:
+            metadata[EMBEDDING_MODEL_KEY] = self.model_id
+            if self.dimensions:
+                metadata[EMBEDDING_DIMENSIONS_KEY] = self.dimensions
+            collection._collection.modify(metadata=metadata)
+        self._stamped.add(id(collection))
+
+    def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        groups = {}
+        for item in zip(ids, embeddings, documents, metadatas):
+            collection = self.collection_for(item[0])
+            groups.setdefault(id(collection), (collection, []))[1].append(item)
+        for collection, items in groups.values():
+            self._stamp(collection)
+            collection._collection.upsert(
+                ids=[item[0] for item in items],
+                embeddings=[item[1] for item in items],
+                documents=[item[2] for item in items],
+                metadatas=[item[3] for item in items],
+            )
+
+    def delete(self, ids):
+        for collection, group in self._group_ids(ids):
+            collection.delete(ids=group)
+
+    def get(self, ids: list = None, include: list = None):
+        """
+        Same result shape as Chroma.get. With `ids`, each id is looked up in its
+        own collection; without, every collection is listed.
+        """
+        include = include or []
+        merged = {"ids": [], "documents": [], "metadatas": []}
+        if ids is not None:
+            parts = [collection.get(ids=group, include=include) for collection, group in self._group_ids(ids)]
+        else:
+            parts = [collection.get(include=include) for collection in self.collections.values()]
+        for part in parts:
+            merged["ids"].extend(part["ids"])
+            for field in ("documents", "metadatas"):
+                merged[field].extend(part.get(field) or [None] * len(part["ids"]))
+        return merged
+
+    def iter_pages(self, include: list, page_size: int = 1000):
+        """
+        Yield Chroma.get-shaped pages covering every collection.
+        """
+        for collection in self.collections.values():
+            total = collection._collection.count()
+            for offset in range(0, total, page_size):
+                yield collection.get(include=include, limit=page_size, offset=offset)
+
+    def count(self) -> int:
+        return sum(collection._collection.count() for collection in self.collections.values())
+
+    def counts(self) -> dict:
+        return {corpus: collection._collection.count() for corpus, collection in self.collections.items()}
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, corpora: list = None):
+        """
+        Search the given corpora (all by default) concurrently and merge their
+        hits by distance. All collections share one embedding model, so the
+        distances are comparable.
+        """
+        if self.vector_index is not None:
+            return self._load_hits(self.vector_index.search(embedding, k=k, corpora=corpora or self.corpora))
+        collections = [self.collections[corpus] for corpus in (corpora or self.corpora) if corpus in self.collections]
+
+        def search(collection):
+            if not collection._collection.count():
+                return []
+            return collection.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+
+        if self.executor is not None and len(collections) > 1:
+            results = [hit for hits in self.executor.map(search, collections) for hit in hits]
+        else:
+            results = [hit for collection in collections for hit in search(collection)]
+        return sorted(results, key=lambda hit: hit[1])[:k]
+
+    def _load_hits(self, hits):
+        items = self.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(items["ids"], items["documents"], items["metadatas"])
+        }
+        # Chunks deleted since the index was built are skipped
+        return [(by_id[chunk_id], distance) for chunk_id, distance in hits if chunk_id in by_id]
+
+    def drop_legacy(self):
+        """
+        Delete the pre-corpus langchain collection once its chunks have been
+        re-indexed into per-corpus collections.
+        """
+        if LEGACY_COLLECTION in self.list_collection_names(self.persist_directory):
+            chromadb.PersistentClient(path=self.persist_directory).delete_collection(LEGACY_COLLECTION)
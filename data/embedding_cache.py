@@ -0,0 +1,290 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_TTL = float(os.environ.get("EMBEDDING_CACHE_TTL", str(24 * 60 * 60)))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+EMBEDDING_CACHE_MAX_DISK_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_DISK_BYTES", str(1024 * 1024 * 1024)))
+# Concurrent embed_query calls for backends without a batched query method
+QUERY_BATCH_WORKERS = int(os.environ.get("QUERY_BATCH_WORKERS", "8"))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace and case so trivially different questions share a cache entry.
+    """
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(text: str, model_id: str) -> str:
+    """
+    Key of a query's embedding; normalized, since "What is Clarity?" and
+    "what is  clarity?" should not be embedded twice.
+    """
+    return hashlib.sha256(f"{model_id}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def document_cache_key(text: str, model_id: str) -> str:
+    """
+    Key of a document's embedding: its exact text, kept apart from query keys,
+    so chunks differing only in case or whitespace keep their own vectors.
+    """
+    return hashlib.sha256(f"{model_id}\x00document\x00{text}".encode("utf-8")).hexdigest()
+
+
+def embed_queries(embeddings, texts: list) -> list:
+    """
+    Embed several questions as queries, not documents. Uses the backend's own
+    embed_queries when it has one, otherwise calls embed_query concurrently.
+    """
+    batch = getattr(embeddings, "embed_queries", None)
+    if batch is not None:
+        return batch(texts)
+    if not texts:
+        return []
+    with ThreadPoolExecutor(min(len(texts), QUERY_BATCH_WORKERS), thread_name_prefix="embed-query") as pool:
+        return list(pool.map(embeddings.embed_query, texts))
+
+
+def _pack(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> list:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embedding vectors.
+
+    The first tier is an in-memory LRU bounded by the number of bytes held and
+    expiring entries after a TTL. The optional second tier is a SQLite file that
+    survives restarts; memory misses fall through to it and disk hits are promoted
+    back into memory. Vectors are stored as packed float32.
+    """
+
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, ttl: float = EMBEDDING_CACHE_TTL,
+                 path: str = None, max_disk_bytes: int = EMBEDDING_CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._disk_bytes = row[0]
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                blob, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return _unpack(blob)
+                self._remove(key)
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT vector, created FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._insert(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return _unpack(row[0])
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector):
+        blob = _pack(vector)
+        created = time.time()
+        with self._lock:
+            self._insert(key, blob, created)
+            if self._conn is not None:
+                self._write_disk([(key, blob, created)])
+
+    def put_many(self, items):
+        """
+        Store several (key, vector) pairs with a single disk transaction.
+        """
+        created = time.time()
+        rows = [(key, _pack(vector), created) for key, vector in items]
+        with self._lock:
+            for key, blob, _ in rows:
+                self._insert(key, blob, created)
+            if self._conn is not None and rows:
+                self._write_disk(rows)
+
+    def _insert(self, key: str, blob: bytes, created: float):
+        if key in self._entries:
+            self._remove(key)
+        if len(blob) > self.max_bytes:
+            return
+        self._entries[key] = (blob, created)
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        blob, _ = self._entries.pop(key)
+        self._bytes -= len(blob)
+
+    def _write_disk(self, rows):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)", rows
+        )
+        self._disk_bytes += sum(len(blob) for _, blob, _ in rows)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._trim_disk()
+        self._conn.commit()
+
+    def _trim_disk(self):
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM embeddings WHERE created < ?", (cutoff,))
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._disk_bytes = row[0]
+        while self._disk_bytes > self.max_disk_bytes:
+            deleted = self._conn.execute("""
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY created LIMIT 1000
+                )
+            """).rowcount
+            if not deleted:
+                break
+            row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+            self._disk_bytes = row[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.commit()
+                self._disk_bytes = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and current sizes of both tiers.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self._conn is not None else None,
+                "max_disk_bytes": self.max_disk_bytes if self._conn is not None else None,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that consults an EmbeddingCache before calling the
+    underlying model, so repeated questions and unchanged chunks are never
+    re-embedded.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: EmbeddingCache, dimensions: int = None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache
+        self.dimensions = dimensions
+
+    def embed_query(self, text: str) -> list:
+        key = cache_key(text, self.model_id)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_queries(self, texts: list) -> list:
+        """
+        Batch form of embed_query, sharing its cache entries.
+        """
+        keys = [cache_key(text, self.model_id) for text in texts]
+        return self._embed_cached(keys, texts, lambda missing: embed_queries(self.embeddings, missing))
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [document_cache_key(text, self.model_id) for text in texts]
+        return self._embed_cached(keys, texts, self.embeddings.embed_documents)
+
+    def _embed_cached(self, keys: list, texts: list, embed) -> list:
+        vectors = [self.cache.get(key) for key in keys]
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            first_indexes = [indexes[0] for indexes in missing.values()]
+            computed = embed([texts[i] for i in first_indexes])
+            for indexes, vector in zip(missing.values(), computed):
+                for i in indexes:
+                    vectors[i] = vector
+            self.cache.put_many(zip(missing.keys(), computed))
+        return vectors
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide EmbeddingCache, configured from the environment.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(path=EMBEDDING_CACHE_PATH)
+    return _cache
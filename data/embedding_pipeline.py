@@ -0,0 +1,289 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    from data.telemetry import stage
+except ImportError:
+    from telemetry import stage
+
+
+EMBED_BATCH_SIZE = 32
+EMBED_WORKERS = 8
+WRITE_BATCH_SIZE = 256
+MAX_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Rough characters-per-token ratio used to estimate token throughput
+CHARS_PER_TOKEN = 4
+# Rough resident size of one buffered chunk: ~2000 chars of text plus a
+# 1536-dim embedding held as a list of Python floats
+CHUNK_MEMORY_ESTIMATE = 64 * 1024
+
+THROTTLING_MARKERS = ("Throttling", "TooManyRequests", "Rate exceeded", "ServiceUnavailable", "ModelNotReady")
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Bedrock throttling surfaces either as a botocore ClientError or wrapped in a
+    ValueError by langchain, so check both the error code and the message.
+    """
+    code = getattr(error, "response", {}).get("Error", {}).get("Code", "")
+    return any(marker in code or marker in str(error) for marker in THROTTLING_MARKERS)
+
+
+def embed_with_retry(embeddings, texts: list, max_retries: int = MAX_RETRIES):
+    """
+    Embed a batch of texts, retrying with exponential backoff and full jitter.
+
+    Throttling errors back off from a larger base so a rate-limited account
+    recovers instead of being hammered by every worker at once.
+    """
+    attempt = 0
+    while True:
+        try:
+            with stage("embed", texts=len(texts), attempt=attempt):
+                return embeddings.embed_documents(texts)
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            base = BASE_BACKOFF * (4 if is_throttling_error(e) else 1)
+            delay = random.uniform(0, min(MAX_BACKOFF, base * 2 ** attempt))
+            print(f"⚠️  Embedding batch failed ({e}); retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def batched(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ThroughputMeter:
+    """
+    Tracks chunks and estimated tokens embedded since the pipeline started.
+    """
+
+    def __init__(self, total: int = None):
+        self.total = total
+        self.chunks = 0
+        self.tokens = 0
+        self.start = time.perf_counter()
+
+    def add(self, chunks: list):
+        self.chunks += len(chunks)
+        self.tokens += sum(len(chunk.page_content) for chunk in chunks) // CHARS_PER_TOKEN
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        progress = f"{self.chunks}/{self.total}" if self.total is not None else f"{self.chunks}"
+        return (
+            f"{progress} chunks in {elapsed:.1f}s "
+            f"({self.chunks / elapsed:.1f} chunks/s, ~{self.tokens / elapsed:.0f} tokens/s)"
+        )
+
+
+def embed_and_store(db, embeddings, chunks, total: int = None, batch_size: int = EMBED_BATCH_SIZE,
+                    workers: int = EMBED_WORKERS, write_batch_size: int = WRITE_BATCH_SIZE,
+                    max_in_flight: int = None, on_write=None):
+    """
+    Embed chunks in parallel batches and write them to Chroma in bounded batches.
+
+    At most `max_in_flight` (default `workers * 2`) embedding batches are in
+    flight and `chunks` is consumed lazily, so memory stays bounded no matter how
+    many chunks are passed in. Each write batch is committed as soon
+    as it is full; because callers skip chunk ids that already exist, a crashed
+    run resumes without re-embedding anything that was committed.
+
+    Args:
+        db (CorpusCollections): Vector store to write to.
+        embeddings (Embeddings): Embedding function used for the documents.
+        chunks (Iterable[Document]): Chunks with an "id" in their metadata.
+        total (int, optional): Number of chunks, for progress reporting.
+        on_write (callable, optional): Called with each list of chunks once it is written.
+
+    Returns:
+        ThroughputMeter: Final throughput figures.
+    """
+    meter = ThroughputMeter(total)
+    pending_write = []
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+
+    def flush():
+        if not pending_write:
+            return
+        write_to_chroma(db, pending_write)
+        if on_write is not None:
+            on_write([chunk for chunk, _ in pending_write])
+        pending_write.clear()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        in_flight = {}
+        batches = batched(chunks, batch_size)
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                future = executor.submit(embed_with_retry, embeddings, [chunk.page_content for chunk in batch])
+                in_flight[future] = batch
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                vectors = future.result()
+                pending_write.extend(zip(batch, vectors))
+                meter.add(batch)
+                if len(pending_write) >= write_batch_size:
+                    flush()
+                    print(f"👉 {meter.report()}")
+        flush()
+
+    print(f"✅ Embedded {meter.report()}")
+    return meter
+
+
+def write_to_chroma(db, items: list):
+    """
+    Upsert (Document, vector) pairs using the precomputed vectors, so Chroma
+    does not embed the texts a second time.
+    """
+    with stage("write", chunks=len(items)):
+        db.upsert(
+            ids=[chunk.metadata["id"] for chunk, _ in items],
+            embeddings=[vector for _, vector in items],
+            documents=[chunk.page_content for chunk, _ in items],
+            metadatas=[chunk.metadata for chunk, _ in items],
+        )
+
+
+class BufferPlan:
+    """
+    Buffer sizes for every stage of the ingestion pipeline.
+    """
+
+    def __init__(self, batch_size: int, write_batch_size: int, max_in_flight: int, prefetch_files: int):
+        self.batch_size = batch_size
+        self.write_batch_size = write_batch_size
+        self.max_in_flight = max_in_flight
+        self.prefetch_files = prefetch_files
+
+    def __repr__(self):
+        return (
+            f"BufferPlan(batch_size={self.batch_size}, write_batch_size={self.write_batch_size}, "
+            f"max_in_flight={self.max_in_flight}, prefetch_files={self.prefetch_files})"
+        )
+
+
+def plan_buffers(max_memory_mb: int = None, batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+                 write_batch_size: int = WRITE_BATCH_SIZE, prefetch_files: int = 16):
+    """
+    Shrink the pipeline's buffers so the chunks they can hold at once fit in
+    `max_memory_mb`. With no limit the requested sizes are used unchanged.
+
+    Buffered chunks are: the embedding batches in flight, the pending write batch
+    and the files prefetched by the parse/split stage (assumed to average one
+    embedding batch each).
+    """
+    max_in_flight = workers * 2
+    if max_memory_mb is None:
+        return BufferPlan(batch_size, write_batch_size, max_in_flight, prefetch_files)
+
+    budget = max(1, max_memory_mb * 1024 * 1024 // CHUNK_MEMORY_ESTIMATE)
+    sizes = {
+        "prefetch_files": prefetch_files,
+        "max_in_flight": max_in_flight,
+        "write_batch_size": write_batch_size,
+        "batch_size": batch_size,
+    }
+
+    def buffered():
+        return sizes["batch_size"] * (sizes["max_in_flight"] + sizes["prefetch_files"]) + sizes["write_batch_size"]
+
+    # Shrink read-ahead first, then parallelism, then the batch sizes themselves
+    for name in sizes:
+        while buffered() > budget and sizes[name] > 1:
+            sizes[name] //= 2
+    return BufferPlan(sizes["batch_size"], sizes["write_batch_size"], sizes["max_in_flight"], sizes["prefetch_files"])
+
+
+def prefetch(iterable, maxsize: int):
+    """
+    Run `iterable` on a background thread, handing items over through a queue of
+    at most `maxsize` items. The producing stage then overlaps with the consumer
+    while backpressure keeps it from running ahead.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    sentinel = object()
+    stop = threading.Event()
+    error = []
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            error.append(e)
+        finally:
+            while not stop.is_set():
+                try:
+                    items.put(sentinel, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is sentinel:
+                break
+            yield item
+        if error:
+            raise error[0]
+    finally:
+        stop.set()
+
+
+def map_bounded(fn, items, processes: int = 1, window: int = None):
+    """
+    Lazily yield fn(item) for each item, in order.
+
+    With `processes` > 1 the calls run in a process pool, with at most `window`
+    (default `processes * 2`) submitted ahead of the consumer so results never pile
+    up in memory.
+    """
+    if processes <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    window = window or processes * 2
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = []
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
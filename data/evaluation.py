@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from data.keyword_index import identifiers, tokenize
+    from data.query_data import get_rag_engine, stream_rag
+except ImportError:
+    from keyword_index import identifiers, tokenize
+    from query_data import get_rag_engine, stream_rag
+
+
+EVAL_PROMPT = """
+Expected Response: {expected_response}
+Actual Response: {actual_response}
+---
+(Answer with 'true' or 'false') Does the actual response match the expected response?
+"""
+
+EVAL_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_questions.jsonl")
+EVAL_CACHE = os.environ.get("EVAL_CACHE", "eval_cache.sqlite3")
+EVAL_CONCURRENCY = int(os.environ.get("EVAL_CONCURRENCY", "4"))
+# Questions started per second, to stay inside the Gemini and Bedrock quotas
+EVAL_RATE = float(os.environ.get("EVAL_RATE", "2"))
+# Share of the expected answer's terms the keyword judge requires in the response
+KEYWORD_JUDGE_THRESHOLD = 0.6
+
+
+def parse_verdict(text: str) -> bool:
+    """
+    Read a judge's 'true' / 'false' answer to EVAL_PROMPT.
+    """
+    text = text.strip().lower()
+    if "true" in text:
+        return True
+    if "false" in text:
+        return False
+    raise ValueError("Invalid evaluation result. Cannot determine if 'true' or 'false'.")
+
+
+def load_eval_set(path: str = EVAL_SET) -> list:
+    """
+    Read {"question": str, "expected": str} lines.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class LLMJudge:
+    """
+    Grades an answer by asking an LLM the EVAL_PROMPT question.
+    """
+
+    def __init__(self, llm, name: str):
+        self.llm = llm
+        self.id = f"llm:{name}"
+
+    def prompt(self, expected: str, actual: str) -> str:
+        return EVAL_PROMPT.format(expected_response=expected, actual_response=actual)
+
+    def grade(self, expected: str, actual: str) -> bool:
+        return parse_verdict(self.llm.invoke(self.prompt(expected, actual)))
+
+
+class KeywordJudge:
+    """
+    Offline stand-in for LLMJudge: an answer passes when it contains enough of
+    the expected answer's code identifiers (or, without any, its words).
+    Cruder than an LLM, but free, deterministic and good at catching answers
+    that lost the constructs they should use.
+    """
+
+    def __init__(self, threshold: float = KEYWORD_JUDGE_THRESHOLD):
+        self.threshold = threshold
+        self.id = f"keyword:{threshold}"
+
+    def prompt(self, expected: str, actual: str) -> str:
+        return EVAL_PROMPT.format(expected_response=expected, actual_response=actual)
+
+    def grade(self, expected: str, actual: str) -> bool:
+        terms = set(identifiers(expected)) or set(tokenize(expected))
+        if not terms:
+            return True
+        found = set(tokenize(actual))
+        return len(terms & found) / len(terms) >= self.threshold
+
+
+class GradeCache:
+    """
+    Verdicts keyed by a hash of the judge and its prompt, so rerunning an
+    evaluation only grades answers that changed.
+    """
+
+    def __init__(self, path: str = EVAL_CACHE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS grades (key TEXT PRIMARY KEY, passed INTEGER NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(judge, expected: str, actual: str) -> str:
+        return hashlib.sha256(f"{judge.id}\x00{judge.prompt(expected, actual)}".encode("utf-8")).hexdigest()
+
+    def grade(self, judge, expected: str, actual: str) -> bool:
+        key = self.key(judge, expected, actual)
+        with self._lock:
+            row = self._conn.execute("SELECT passed FROM grades WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return bool(row[0])
+            self.misses += 1
+        passed = judge.grade(expected, actual)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO grades (key, passed) VALUES (?, ?)", (key, int(passed)))
+            self._conn.commit()
+        return passed
+
+    def close(self):
+        self._conn.close()
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1 / `rate` seconds apart across threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def evaluate_case(case: dict, engine, judge, grades: GradeCache, use_cache: bool, retrieval_mode: str = None):
+    """
+    Answer one question through stream_rag and grade the answer.
+    """
+    result = {"question": case["question"], "passed": None, "error": None, "latency": None, "first_token": None,
+              "usage": None}
+    response_text = None
+    start = time.perf_counter()
+    try:
+        for event, payload in stream_rag(
+            case["question"], [], engine=engine, use_cache=use_cache, retrieval_mode=retrieval_mode
+        ):
+            if event == "token" and result["first_token"] is None:
+                result["first_token"] = time.perf_counter() - start
+            elif event == "done":
+                result["latency"] = time.perf_counter() - start
+                result["usage"] = payload["usage"]
+                response_text = payload["response"]
+        result["passed"] = grades.grade(judge, case["expected"], response_text)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+def summarize(results: list) -> dict:
+    graded = [result for result in results if result["passed"] is not None]
+    latencies = [result["latency"] for result in results if result["latency"] is not None]
+    first_tokens = [result["first_token"] for result in results if result["first_token"] is not None]
+    usages = [result["usage"] for result in results if result["usage"]]
+    return {
+        "questions": len(results),
+        "graded": len(graded),
+        "errors": sum(result["error"] is not None for result in results),
+        "accuracy": round(sum(result["passed"] for result in graded) / len(graded), 4) if graded else None,
+        "latency_seconds": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95)},
+        "first_token_seconds": {"p50": percentile(first_tokens, 0.5), "p95": percentile(first_tokens, 0.95)},
+        "prompt_tokens": sum(usage["prompt_tokens"] for usage in usages),
+        "completion_tokens": sum(usage["completion_tokens"] for usage in usages),
+        # Answers from the response cache or the relevance gate carry no usage
+        "cached_answers": len(graded) - len(usages),
+    }
+
+
+def run_evaluation(cases: list, engine, judge, grades: GradeCache, concurrency: int = EVAL_CONCURRENCY,
+                   rate: float = EVAL_RATE, use_cache: bool = True, retrieval_mode: str = None) -> dict:
+    """
+    Answer and grade every case on a pool of `concurrency` threads, starting at
+    most `rate` questions per second.
+
+    Returns:
+        dict: {"summary": dict, "results": list} with results in case order.
+    """
+    limiter = RateLimiter(rate)
+
+    def run(case):
+        limiter.wait()
+        return evaluate_case(case, engine, judge, grades, use_cache, retrieval_mode)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="eval") as pool:
+        results = list(pool.map(run, cases))
+    summary = summarize(results)
+    summary["judge"] = judge.id
+    summary["grade_cache"] = {"hits": grades.hits, "misses": grades.misses}
+    return {"summary": summary, "results": results}
+
+
+def compare(summary: dict, baseline: dict) -> dict:
+    """
+    Change in accuracy, p50 latency and tokens against a baseline summary.
+    """
+    def delta(current, previous):
+        return None if current is None or previous is None else round(current - previous, 4)
+
+    return {
+        "accuracy": delta(summary["accuracy"], baseline["accuracy"]),
+        "latency_p50_seconds": delta(summary["latency_seconds"]["p50"], baseline["latency_seconds"]["p50"]),
+        "prompt_tokens": delta(summary["prompt_tokens"], baseline["prompt_tokens"]),
+        "completion_tokens": delta(summary["completion_tokens"], baseline["completion_tokens"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a question set with query_rag and grade the answers.")
+    parser.add_argument("--eval-set", default=EVAL_SET, help="JSONL file of questions and expected answers.")
+    parser.add_argument("--judge", choices=("llm", "keyword"), default="llm",
+                        help="Grade with Gemini or, offline, by the expected answer's identifiers.")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=EVAL_RATE, help="Questions started per second.")
+    parser.add_argument("--bypass-cache", action="store_true", help="Do not answer from the response cache.")
+    parser.add_argument("--retrieval-mode", choices=("vector", "keyword", "hybrid", "multi"))
+    parser.add_argument("--output", help="Write the report as JSON.")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against.")
+    args = parser.parse_args()
+
+    engine = get_rag_engine()
+    engine.warm_up()
+    judge = LLMJudge(engine.llm, engine.model) if args.judge == "llm" else KeywordJudge()
+    grades = GradeCache()
+    report = run_evaluation(
+        load_eval_set(args.eval_set), engine, judge, grades, concurrency=args.concurrency, rate=args.rate,
+        use_cache=not args.bypass_cache, retrieval_mode=args.retrieval_mode,
+    )
+    grades.close()
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["summary"]["change"] = compare(report["summary"], json.load(f)["summary"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report["summary"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
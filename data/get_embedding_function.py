@@ -1,6 +1,24 @@
+import os
+
+import boto3
+from botocore.config import Config
 from langchain_community.embeddings.ollama import OllamaEmbeddings
 from langchain_aws import  BedrockEmbeddings
 
+try:
+    from data.embedding_cache import CachedEmbeddings, get_embedding_cache
+except ImportError:
+    from embedding_cache import CachedEmbeddings, get_embedding_cache
+
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "bedrock")
+BEDROCK_REGION = "us-east-1"
+BEDROCK_MODEL_ID = "amazon.titan-embed-text-v1"
+BEDROCK_DIMENSIONS = 1536
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "32"))
+OLLAMA_MODEL = os.environ.get("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+OLLAMA_DIMENSIONS = 768
+
 
 # def get_embedding_function():
 #     embeddings = BedrockEmbeddings(
@@ -9,10 +27,86 @@ from langchain_aws import  BedrockEmbeddings
 #     # embeddings = OllamaEmbeddings(model="nomic-embed-text")
 #     return embeddings\
 
-def get_embedding_function():
+def get_bedrock_client():
+    """
+    Build a bedrock-runtime client with a connection pool large enough for
+    concurrent requests, so TLS connections are reused instead of re-opened.
+    """
+    config = Config(
+        region_name=BEDROCK_REGION,
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+        tcp_keepalive=True,
+    )
+    return boto3.client("bedrock-runtime", config=config)
+
+def bedrock_backend():
     embeddings = BedrockEmbeddings(
         # credentials_profile_name="default",
-        region_name="us-east-1",
-        model_id="amazon.titan-embed-text-v1"  
+        client=get_bedrock_client(),
+        region_name=BEDROCK_REGION,
+        model_id=BEDROCK_MODEL_ID
     )
-    return embeddings
\ No newline at end of file
+    return embeddings, BEDROCK_MODEL_ID, BEDROCK_DIMENSIONS
+
+def ollama_backend():
+    return OllamaEmbeddings(model=OLLAMA_MODEL), f"ollama:{OLLAMA_MODEL}", OLLAMA_DIMENSIONS
+
+def local_backend():
+    # Imported here so the Bedrock backend never loads ONNX Runtime
+    try:
+        from data.local_embeddings import LocalEmbeddings
+    except ImportError:
+        from local_embeddings import LocalEmbeddings
+    embeddings = LocalEmbeddings()
+    return embeddings, embeddings.model_id, embeddings.dimensions
+
+# Each factory returns (embeddings, model_id, dimensions)
+EMBEDDING_BACKENDS = {
+    "bedrock": bedrock_backend,
+    "ollama": ollama_backend,
+    "local": local_backend,
+}
+
+def register_embedding_backend(name: str, factory):
+    """
+    Make another embedding backend selectable through EMBEDDING_BACKEND.
+    """
+    EMBEDDING_BACKENDS[name] = factory
+
+def preload_embedding_config(backend: str = None):
+    """
+    Load what every embedding client needs before workers are forked, without
+    opening connections or starting threads: the Bedrock service description
+    is parsed into the default boto3 session that clients are later built
+    from, and local model files are downloaded once rather than by each worker.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "bedrock":
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        session = boto3.DEFAULT_SESSION._session
+        session.get_service_model("bedrock-runtime")
+        session.get_component("endpoint_resolver")
+    elif backend == "local":
+        try:
+            from data.local_embeddings import model_files
+        except ImportError:
+            from local_embeddings import model_files
+        model_files()
+
+def get_embedding_function(use_cache: bool = True, backend: str = None):
+    """
+    Build the embeddings for `backend` (EMBEDDING_BACKEND by default).
+
+    With the cache, the result carries the backend's model_id and dimensions,
+    which the vector store records and checks so vectors from different models
+    are never mixed.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {sorted(EMBEDDING_BACKENDS)}")
+    embeddings, model_id, dimensions = EMBEDDING_BACKENDS[backend]()
+    if use_cache:
+        return CachedEmbeddings(embeddings, model_id=model_id, cache=get_embedding_cache(), dimensions=dimensions)
+    return embeddings
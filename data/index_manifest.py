@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+MANIFEST_FILE = "index_manifest.json"
+# Touched whenever a new index is published, so running servers can reload
+INDEX_VERSION_FILE = "index_version.json"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, MANIFEST_FILE)
+
+
+def load_manifest(chroma_path: str) -> dict:
+    """
+    Load the per-file manifest ({source: {"mtime", "size", "hash"}}) stored next
+    to the Chroma index. A missing manifest means every file is new.
+    """
+    try:
+        with open(manifest_path(chroma_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(chroma_path: str, manifest: dict):
+    """
+    Write the manifest atomically so a crash never leaves a truncated file.
+    """
+    os.makedirs(chroma_path, exist_ok=True)
+    path = manifest_path(chroma_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def index_version_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, INDEX_VERSION_FILE)
+
+
+def publish_index_version(chroma_path: str, reason: str) -> int:
+    """
+    Record that the index under `chroma_path` changed. Servers started with
+    api.serve watch this file and reload their workers gracefully.
+
+    Returns:
+        int: The new version.
+    """
+    version = time.time_ns()
+    path = index_version_path(chroma_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "reason": reason}, f)
+    os.replace(tmp_path, path)
+    return version
+
+
+def read_index_version(chroma_path: str):
+    """
+    The last published version, or None if nothing was published yet.
+    """
+    try:
+        with open(index_version_path(chroma_path), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def iter_source_files(data_path: str, suffix: str = ".md"):
+    """
+    Yield source paths formatted the way DirectoryLoader records them in chunk metadata.
+    """
+    for root, _dirs, files in os.walk(data_path):
+        for file in sorted(files):
+            if file.endswith(suffix):
+                yield str(Path(root) / file)
+
+
+class FileDiff:
+    """
+    Files under the data path classified against the previous manifest.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.deleted = []
+        self.unchanged = []
+        self.manifest = {}
+
+    @property
+    def to_index(self):
+        return self.added + self.changed
+
+    def summary(self):
+        return (
+            f"{len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.deleted)} deleted, {len(self.unchanged)} unchanged files"
+        )
+
+
+def diff_files(data_path: str, manifest: dict) -> FileDiff:
+    """
+    Compare the files under `data_path` with `manifest`.
+
+    Files whose mtime and size match the manifest are assumed unchanged without
+    being read; otherwise the content hash decides, so touching a file without
+    editing it does not trigger re-embedding.
+
+    Returns:
+        FileDiff: The classification plus the manifest describing the current tree.
+    """
+    diff = FileDiff()
+    for source in iter_source_files(data_path):
+        stat = os.stat(source)
+        previous = manifest.get(source)
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size}
+        if previous and previous["mtime"] == entry["mtime"] and previous["size"] == entry["size"]:
+            entry["hash"] = previous["hash"]
+        else:
+            entry["hash"] = hash_file(source)
+        diff.manifest[source] = entry
+
+        if previous is None:
+            diff.added.append(source)
+        elif previous["hash"] != entry["hash"]:
+            diff.changed.append(source)
+        else:
+            diff.unchanged.append(source)
+
+    diff.deleted = [source for source in manifest if source not in diff.manifest]
+    return diff
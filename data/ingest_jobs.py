@@ -0,0 +1,470 @@
+"""
+Ingestion jobs: a SQLite-backed queue of index builds that never touch the
+live index until they are complete.
+
+    python ingest_jobs.py submit --reset     # queue a full rebuild
+    python ingest_jobs.py worker             # run queued jobs one at a time
+    python ingest_jobs.py status [JOB_ID]    # progress and ETA
+    python ingest_jobs.py cancel JOB_ID
+    python ingest_jobs.py resume JOB_ID      # continue a cancelled or failed job
+    python ingest_jobs.py discard JOB_ID     # delete its staging build instead
+
+Each job builds in its own staging directory under `chroma.builds/`: an
+empty one for --reset, otherwise a copy of the live index that is updated
+incrementally. A build that lacks the live index's quantized index or
+relevance gate calibration gets them before the swap. When the build is
+complete, `chroma` (a symlink) is atomically pointed at it and the new index
+version is published, so servers started with api.serve reload onto it while
+the previous build keeps serving their in-flight requests. A cancelled, failed or interrupted job
+keeps its staging build; resuming it skips every chunk already embedded.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from index_manifest import publish_index_version
+from corpora import CorpusCollections
+from populate_database import (
+    CHROMA_PATH, IngestProgress, add_ingest_arguments, ingest, ingest_options, quantized_index_options,
+)
+from quantized_index import build_quantized_index, quantized_index_path
+from relevance_gate import relevance_gate_path
+from telemetry import setup_telemetry, shutdown_telemetry
+
+
+INGEST_JOBS_DB = os.environ.get("INGEST_JOBS_DB", "ingest_jobs.sqlite3")
+# Embedding workers and CPU priority of queued jobs, kept low so they can run
+# next to a live /ask workload
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_NICE = int(os.environ.get("INGEST_NICE", "10"))
+# Previous builds kept besides the live one, for workers still reading them and for rollback
+INGEST_KEEP_BUILDS = int(os.environ.get("INGEST_KEEP_BUILDS", "1"))
+INGEST_POLL_INTERVAL = float(os.environ.get("INGEST_POLL_INTERVAL", "2"))
+# Seconds between progress updates, which are also when cancellation is noticed
+PROGRESS_INTERVAL = 5.0
+
+QUEUED = "queued"
+RUNNING = "running"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FAILED = "failed"
+SUCCEEDED = "succeeded"
+DISCARDED = "discarded"
+# Jobs whose staging build may still be resumed
+RESUMABLE = (QUEUED, RUNNING, CANCELLING, CANCELLED, FAILED)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job once it has been asked to stop.
+    """
+
+
+def builds_path(chroma_path: str) -> str:
+    return f"{os.path.normpath(chroma_path)}.builds"
+
+
+def build_path(chroma_path: str, job_id: int) -> str:
+    return os.path.join(builds_path(chroma_path), f"job-{job_id}")
+
+
+def job_eta(job: dict):
+    """
+    Seconds left in the indexing phase, extrapolated from the files done so far.
+    """
+    if job["phase"] != "indexing" or not job["files_done"] or not job["phase_started_at"]:
+        return None
+    elapsed = time.time() - job["phase_started_at"]
+    return round(elapsed / job["files_done"] * (job["files_total"] - job["files_done"]), 1)
+
+
+def format_job(job: dict) -> str:
+    eta = job_eta(job)
+    progress = f"{job['files_done']}/{job['files_total']} files, {job['chunks_written']} chunks written"
+    return (
+        f"Job {job['id']} {job['status']}: {job['phase'] or '-'} ({progress})"
+        + (f", ETA {eta:.0f}s" if eta is not None else "")
+        + (f" - {job['error']}" if job["error"] else "")
+    )
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Ingestion jobs in a SQLite file shared by every process that submits, runs
+    or inspects them. At most one job runs at a time.
+    """
+
+    def __init__(self, path: str = INGEST_JOBS_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    status TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    phase TEXT,
+                    phase_started_at REAL,
+                    files_total INTEGER NOT NULL DEFAULT 0,
+                    files_done INTEGER NOT NULL DEFAULT 0,
+                    chunks_written INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def submit(self, options: dict) -> int:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (status, options, created_at) VALUES (?, ?, ?)",
+                (QUEUED, json.dumps(options), time.time()),
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id: int):
+        with self._connect() as conn:
+            return self._job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, statuses: tuple = None, limit: int = 20) -> list:
+        with self._connect() as conn:
+            if statuses:
+                rows = conn.execute(
+                    f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY id DESC LIMIT ?",
+                    (*statuses, limit),
+                )
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+            return [self._job(row) for row in rows]
+
+    def update(self, job_id: int, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, pid: int):
+        """
+        Mark the oldest queued job as running in process `pid` and return it,
+        or None when a job is already running or none is queued.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM jobs WHERE status IN (?, ?)", (RUNNING, CANCELLING)).fetchone():
+                    return None
+                row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_pid = ?, error = NULL, started_at = COALESCE(started_at, ?) "
+                    "WHERE id = ?",
+                    (RUNNING, pid, now, row["id"]),
+                )
+                return self._job(row)
+            finally:
+                conn.execute("COMMIT")
+
+    def cancel(self, job_id: int) -> str:
+        """
+        Cancel a queued job, or ask a running one to stop at its next progress update.
+
+        Returns:
+            str: The job's status afterwards.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE status WHEN ? THEN ? ELSE ? END, "
+                "finished_at = CASE status WHEN ? THEN ? ELSE finished_at END "
+                "WHERE id = ? AND status IN (?, ?)",
+                (QUEUED, CANCELLED, CANCELLING, QUEUED, time.time(), job_id, QUEUED, RUNNING),
+            )
+        return self.status(job_id)
+
+    def resume(self, job_id: int) -> str:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = NULL WHERE id = ? AND status IN (?, ?)",
+                (QUEUED, job_id, CANCELLED, FAILED),
+            )
+        return self.status(job_id)
+
+    def status(self, job_id: int):
+        job = self.get(job_id)
+        return job["status"] if job else None
+
+    def recover(self):
+        """
+        Requeue jobs left running by a worker that died, so they resume from
+        their staging build.
+        """
+        for job in self.list((RUNNING, CANCELLING), limit=100):
+            if job["worker_pid"] and not process_alive(job["worker_pid"]):
+                self.update(job["id"], status=QUEUED if job["status"] == RUNNING else CANCELLED)
+                print(f"♻️ Job {job['id']} was interrupted; {'requeued' if job['status'] == RUNNING else 'cancelled'}")
+
+
+class JobProgress(IngestProgress):
+    """
+    Records a running job's progress and stops it once it is cancelled.
+    """
+
+    def __init__(self, jobs: JobQueue, job_id: int):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.files_done = 0
+        self.chunks = 0
+        self._last_update = 0.0
+
+    def phase(self, name: str, files: int = None):
+        fields = {"phase": name, "phase_started_at": time.time()}
+        if files is not None:
+            self.files_done = 0
+            fields.update(files_total=files, files_done=0)
+        self.jobs.update(self.job_id, **fields)
+        self._check_cancelled()
+
+    def file_done(self, source: str):
+        self.files_done += 1
+        self._tick()
+
+    def chunks_written(self, count: int):
+        self.chunks += count
+        self._tick()
+
+    def _tick(self):
+        now = time.monotonic()
+        if now - self._last_update < PROGRESS_INTERVAL:
+            return
+        self._last_update = now
+        self.jobs.update(self.job_id, files_done=self.files_done, chunks_written=self.chunks)
+        print(f"⏳ {format_job(self.jobs.get(self.job_id))}")
+        self._check_cancelled()
+
+    def _check_cancelled(self):
+        if self.jobs.status(self.job_id) == CANCELLING:
+            raise JobCancelled()
+
+
+def prepare_staging(chroma_path: str, staging: str, reset: bool):
+    """
+    Create the staging build: empty for a reset, otherwise a copy of the live
+    index. The copy is made under a temporary name first, so an interrupted
+    copy is never mistaken for a staging build.
+    """
+    os.makedirs(builds_path(chroma_path), exist_ok=True)
+    tmp_path = f"{staging}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    if not reset and os.path.isdir(chroma_path):
+        shutil.copytree(os.path.realpath(chroma_path), tmp_path)
+    else:
+        os.makedirs(tmp_path)
+    os.replace(tmp_path, staging)
+
+
+def carry_over_derived(chroma_path: str, staging: str):
+    """
+    Give the staging build the quantized index and relevance gate calibration
+    the live index has but the build lacks, as after a reset, so swapping it
+    in does not break VECTOR_INDEX=quantized servers or drop the calibration.
+    The quantized index is rebuilt with the live one's method and subspaces;
+    any error fails the job and leaves the live index in place.
+    """
+    live = os.path.realpath(chroma_path)
+    if not os.path.isdir(live):
+        return
+    live_index = quantized_index_path(live)
+    staging_index = quantized_index_path(staging)
+    if os.path.exists(live_index) and not os.path.exists(staging_index):
+        options = quantized_index_options(live_index)
+        print(f"🗜️ Building {options['method']} quantized index to match the live index")
+        build_quantized_index(CorpusCollections(staging, allow_legacy=False), staging_index, **options)
+    if os.path.exists(relevance_gate_path(live)) and not os.path.exists(relevance_gate_path(staging)):
+        shutil.copy2(relevance_gate_path(live), relevance_gate_path(staging))
+        print("🎯 Kept the live relevance gate calibration")
+
+
+def activate_build(chroma_path: str, build: str):
+    """
+    Point `chroma_path` at `build` by replacing its symlink, which readers see
+    atomically. A `chroma_path` that is still a plain directory, from before
+    builds were staged, is first moved into the builds directory.
+    """
+    chroma_path = os.path.normpath(chroma_path)
+    if os.path.isdir(chroma_path) and not os.path.islink(chroma_path):
+        os.makedirs(builds_path(chroma_path), exist_ok=True)
+        os.replace(chroma_path, os.path.join(builds_path(chroma_path), f"initial-{time.time_ns()}"))
+    link_path = f"{chroma_path}.link.tmp"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.relpath(os.path.abspath(build), os.path.dirname(os.path.abspath(chroma_path))), link_path)
+    os.replace(link_path, chroma_path)
+
+
+def prune_builds(chroma_path: str, jobs: JobQueue, keep: int = INGEST_KEEP_BUILDS):
+    """
+    Delete finished builds beyond the newest `keep` that are not live. Staging
+    builds of jobs that can still be resumed are left alone.
+    """
+    root = builds_path(chroma_path)
+    live = os.path.realpath(chroma_path)
+    resumable = {os.path.realpath(build_path(chroma_path, job["id"])) for job in jobs.list(RESUMABLE, limit=1000)}
+    finished = [
+        entry for entry in os.scandir(root)
+        if entry.is_dir(follow_symlinks=False) and not entry.name.endswith(".tmp")
+        and os.path.realpath(entry.path) not in resumable | {live}
+    ]
+    finished.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in finished[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        print(f"🧹 Removed old build {entry.name}")
+
+
+def run_job(jobs: JobQueue, job: dict, chroma_path: str = CHROMA_PATH) -> str:
+    """
+    Build a claimed job's index in its staging directory and swap it in.
+
+    Returns:
+        str: The job's final status.
+    """
+    job_id = job["id"]
+    staging = build_path(chroma_path, job_id)
+    progress = JobProgress(jobs, job_id)
+    print(f"🏗️ Running ingestion job {job_id} in {staging}")
+    try:
+        if not os.path.isdir(staging):
+            progress.phase("staging")
+            prepare_staging(chroma_path, staging, reset=job["options"].get("reset", False))
+        changed = ingest(staging, progress=progress, **job["options"])
+        progress.phase("swapping")
+        if changed:
+            carry_over_derived(chroma_path, staging)
+            publish_index_version(staging, "populate_database")
+            activate_build(chroma_path, staging)
+            print("📣 Published the new index; servers started with api.serve reload their workers")
+            prune_builds(chroma_path, jobs)
+        else:
+            shutil.rmtree(staging, ignore_errors=True)
+            print("Nothing changed; the live index was kept")
+    except JobCancelled:
+        jobs.update(job_id, status=CANCELLED, finished_at=time.time())
+        print(f"🛑 Job {job_id} cancelled; `python ingest_jobs.py resume {job_id}` continues it")
+        return CANCELLED
+    except Exception as e:
+        jobs.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        print(f"❌ Job {job_id} failed: {e}")
+        return FAILED
+    jobs.update(
+        job_id, status=SUCCEEDED, phase="done", files_done=progress.files_done,
+        chunks_written=progress.chunks, finished_at=time.time(),
+    )
+    print(f"✅ Job {job_id} succeeded")
+    return SUCCEEDED
+
+
+def work(jobs: JobQueue, chroma_path: str = CHROMA_PATH, until: int = None, once: bool = False):
+    """
+    Run queued jobs one at a time.
+
+    Args:
+        until (int, optional): Return that job's final status once it has finished, wherever it ran.
+        once (bool): Return when no job is queued instead of waiting for more.
+    """
+    jobs.recover()
+    while True:
+        job = jobs.claim(os.getpid())
+        if job is not None:
+            status = run_job(jobs, job, chroma_path)
+            if job["id"] == until:
+                return status
+            continue
+        if until is not None and jobs.status(until) not in (QUEUED, RUNNING, CANCELLING):
+            return jobs.status(until)
+        if once and until is None:
+            return None
+        time.sleep(INGEST_POLL_INTERVAL)
+
+
+def discard(jobs: JobQueue, job_id: int, chroma_path: str = CHROMA_PATH) -> str:
+    """
+    Delete the staging build of a cancelled or failed job.
+    """
+    if jobs.status(job_id) not in (CANCELLED, FAILED):
+        return jobs.status(job_id)
+    shutil.rmtree(build_path(chroma_path, job_id), ignore_errors=True)
+    jobs.update(job_id, status=DISCARDED)
+    return DISCARDED
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_ingest_arguments(commands.add_parser("submit", help="Queue an ingestion job."), workers=INGEST_WORKERS)
+    worker = commands.add_parser("worker", help="Run queued jobs.")
+    worker.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+    status = commands.add_parser("status", help="Show recent jobs, or one job in detail.")
+    status.add_argument("job_id", type=int, nargs="?")
+    for name in ("cancel", "resume", "discard"):
+        commands.add_parser(name).add_argument("job_id", type=int)
+    args = parser.parse_args()
+
+    jobs = JobQueue()
+    if args.command == "submit":
+        print(f"📥 Queued ingestion job {jobs.submit(ingest_options(args))}")
+    elif args.command == "worker":
+        if INGEST_NICE and hasattr(os, "nice"):
+            os.nice(INGEST_NICE)
+        setup_telemetry("stacks-ai-ingest")
+        work(jobs, once=args.once)
+        shutdown_telemetry()
+    elif args.command == "status":
+        if args.job_id is None:
+            for job in jobs.list():
+                print(format_job(job))
+        else:
+            job = jobs.get(args.job_id)
+            print(json.dumps(job and dict(job, eta_seconds=job_eta(job)), indent=1))
+    elif args.command == "cancel":
+        print(f"Job {args.job_id}: {jobs.cancel(args.job_id)}")
+    elif args.command == "resume":
+        print(f"Job {args.job_id}: {jobs.resume(args.job_id)}")
+    elif args.command == "discard":
+        print(f"Job {args.job_id}: {discard(jobs, args.job_id)}")
+
+
+if __name__ == "__main__":
+    main()
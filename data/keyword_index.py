@@ -0,0 +1,243 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+
+KEYWORD_INDEX_FILE = "keyword_index.sqlite3"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Identifiers such as `define-non-fungible-token`, `stx-transfer?` or
+# `makeContractCall` are kept whole; hyphenated ones are also indexed by part.
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_\-]*[?!]?")
+IDENTIFIER_PATTERN = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)+[?!]?|[a-z]+[A-Z][A-Za-z0-9]*")
+# Fenced blocks and inline code, whose hyphenated words are recorded as symbols
+CODE_PATTERN = re.compile(r"```.*?```|`[^`\n]+`", re.DOTALL)
+# Question words skipped at query time; Clarity and JavaScript keywords such as
+# "and", "or", "not", "let" and "if" are deliberately not among them
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "be", "been", "to", "of", "in", "on", "for", "with", "by", "from",
+    "at", "it", "its", "this", "that", "these", "those", "i", "me", "my", "we", "you", "your", "how", "what",
+    "which", "who", "why", "when", "where", "do", "does", "did", "can", "could", "should", "would", "will",
+    "please", "about", "into", "there", "here", "some", "any", "using", "use",
+}
+# Terms found in more than this share of chunks say little about relevance and are skipped
+KEYWORD_MAX_DF_RATIO = float(os.environ.get("KEYWORD_MAX_DF_RATIO", "0.5"))
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        bare = token.rstrip("?!")
+        if bare != token:
+            tokens.append(bare)
+        parts = re.split(r"[-_]", bare)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def identifiers(text: str) -> list:
+    """
+    Code identifiers mentioned in `text`, lowercased the way they are indexed.
+    """
+    return [match.lower() for match in IDENTIFIER_PATTERN.findall(text)]
+
+
+def code_symbols(text: str) -> set:
+    """
+    Hyphenated, underscored or ?/!-suffixed names used in the code of `text`.
+    """
+    return {
+        token for span in CODE_PATTERN.findall(text.lower()) for token in TOKEN_PATTERN.findall(span)
+        if re.search(r"[-_?!]", token)
+    }
+
+
+def keyword_index_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, KEYWORD_INDEX_FILE)
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over the same chunk ids as the Chroma collection.
+
+    Stored in SQLite next to the vector index so it is built by
+    populate_database and read by the API without a separate service.
+
+    Writes share one connection; searches use a read connection per thread
+    and score BM25 in SQL, so concurrent queries do not wait on each other.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS symbols (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS symbols_chunk ON symbols (chunk_id)")
+        self._conn.commit()
+
+    def _reader(self):
+        """
+        This thread's read connection, with the collection statistics BM25
+        needs cached until another connection changes the index.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+            self._local.stats = None
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._local.stats is None or self._local.stats[0] != version:
+            total, average_length = conn.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            self._local.stats = (version, total, average_length)
+        return conn, self._local.stats[1], self._local.stats[2]
+
+    def add(self, items):
+        """
+        Index (chunk_id, text) pairs, replacing any previous version of each chunk.
+        """
+        items = list(items)
+        with self._lock:
+            self._delete([chunk_id for chunk_id, _ in items])
+            for chunk_id, text in items:
+                counts = Counter(tokenize(text))
+                self._conn.execute(
+                    "INSERT INTO chunks (id, length) VALUES (?, ?)", (chunk_id, sum(counts.values()))
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in counts.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO symbols (term, chunk_id) VALUES (?, ?)",
+                    [(term, chunk_id) for term in code_symbols(text)],
+                )
+            self._conn.commit()
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            self._delete(list(chunk_ids))
+            self._conn.commit()
+
+    def _delete(self, chunk_ids: list):
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM symbols WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM symbols")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def count(self) -> int:
+        return self._reader()[1]
+
+    def search(self, query: str, k: int = 7):
+        """
+        Rank chunks against `query` with BM25. Stopwords and terms found in most
+        chunks are left out unless nothing else remains.
+
+        Returns:
+            list: (chunk_id, score) pairs, best first, at most k.
+        """
+        terms = set(tokenize(query))
+        terms = terms - STOPWORDS or terms
+        if not terms:
+            return []
+        conn, total, average_length = self._reader()
+        if not total:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        frequencies = conn.execute(
+            f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", list(terms)
+        ).fetchall()
+        weights = [(term, df) for term, df in frequencies if df <= KEYWORD_MAX_DF_RATIO * total] or frequencies
+        if not weights:
+            return []
+        values = ",".join("(?, ?)" for _ in weights)
+        parameters = []
+        for term, df in weights:
+            parameters.extend((term, math.log(1 + (total - df + 0.5) / (df + 0.5))))
+        rows = conn.execute(f"""
+            WITH weights (term, idf) AS (VALUES {values})
+            SELECT p.chunk_id,
+                   SUM(w.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * c.length / ?))) AS score
+            FROM weights w
+            JOIN postings p ON p.term = w.term
+            JOIN chunks c ON c.id = p.chunk_id
+            GROUP BY p.chunk_id
+            ORDER BY score DESC
+            LIMIT ?
+        """, [*parameters, BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, average_length, k]).fetchall()
+        return [(chunk_id, score) for chunk_id, score in rows]
+
+    def contains_all(self, chunk_id: str, terms) -> bool:
+        """
+        Whether every term is indexed for `chunk_id`.
+        """
+        terms = list(set(terms))
+        if not terms:
+            return False
+        placeholders = ",".join("?" * len(terms))
+        found = self._reader()[0].execute(
+            f"SELECT COUNT(*) FROM postings WHERE chunk_id = ? AND term IN ({placeholders})",
+            [chunk_id, *terms],
+        ).fetchone()[0]
+        return found == len(terms)
+
+    def identifiers(self, text: str) -> list:
+        """
+        Code identifiers mentioned in `text`: names with a ?/! suffix or in
+        camelCase, and hyphenated or underscored words the indexed code uses,
+        so prose such as "non-fungible" or "read-only" is not mistaken for one.
+        """
+        candidates = IDENTIFIER_PATTERN.findall(text)
+        marked = {
+            candidate.lower() for candidate in candidates if candidate[-1] in "?!" or candidate != candidate.lower()
+        }
+        words = list({candidate.lower() for candidate in candidates} - marked)
+        known = set()
+        if words:
+            placeholders = ",".join("?" * len(words))
+            known = {row[0] for row in self._reader()[0].execute(
+                f"SELECT DISTINCT term FROM symbols WHERE term IN ({placeholders})", words
+            )}
+        return [candidate.lower() for candidate in candidates if candidate.lower() in marked | known]
@@ -0,0 +1,579 @@
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from langchain_google_genai import GoogleGenerativeAI
+
+
+# "gemini", or "fake" for the local stand-in that needs no credentials
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini")
+LLM_PROVIDERS = ("gemini", "fake")
+# Model answering when the primary one keeps failing or its circuit is open; empty disables it
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "gemini-1.5-flash")
+# Seconds a whole answer may take, and a streamed one may take to start
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "90"))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "20"))
+EXPANSION_TIMEOUT = float(os.environ.get("EXPANSION_TIMEOUT", "10"))
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "0.5"))
+LLM_BACKOFF_MAX = 8.0
+# Send a second, identical request when the first has not answered (or started
+# streaming) within the provider's recent p95
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.5"))
+# Calls observed before a provider's p95 is trusted for hedging
+LLM_HEDGE_MIN_SAMPLES = 50
+LATENCY_WINDOW = 200
+LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", "5"))
+LLM_CIRCUIT_RESET = float(os.environ.get("LLM_CIRCUIT_RESET", "30"))
+LLM_THREADS = int(os.environ.get("LLM_THREADS", "32"))
+
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.05"))
+FAKE_LLM_STALL_RATE = float(os.environ.get("FAKE_LLM_STALL_RATE", "0"))
+FAKE_LLM_FAILURE_RATE = float(os.environ.get("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_ANSWER = """```
+;; Generated by the fake LLM provider
+(define-data-var counter uint u0)
+
+(define-public (increment)
+  (begin
+    (var-set counter (+ (var-get counter) u1))
+    (ok (var-get counter))))
+
+(define-read-only (get-counter)
+  (var-get counter))
+```
+### Detailed Explanation
+- **Purpose**: A counter, returned by the local fake LLM provider.
+"""
+
+
+class LLMTimeout(ValueError):
+    """
+    Raised when an LLM call misses its deadline.
+    """
+
+
+class LLMUnavailable(ValueError):
+    """
+    Raised when every provider failed or has its circuit open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a provider after `failures` consecutive failures.
+
+    Once open, one trial request is let through every `reset` seconds; the
+    first success closes the circuit again.
+    """
+
+    def __init__(self, failures: int = LLM_CIRCUIT_FAILURES, reset: float = LLM_CIRCUIT_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.consecutive = 0
+        self.opened_at = None
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset:
+                return False
+            self.opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.consecutive >= self.failures and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "open" if time.monotonic() - self.opened_at < self.reset else "half_open"
+
+
+class LatencyWindow:
+    """
+    The last `size` latencies of a provider, for its hedging delay.
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if len(ordered) < min_samples:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Provider:
+    """
+    A model client with its own circuit breaker and latency history.
+
+    Latency is kept per method: the whole answer for invoke, the first token
+    for stream and astream, since that is what a hedge races.
+    """
+
+    def __init__(self, name: str, client, breaker: CircuitBreaker = None):
+        self.name = name
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = {"invoke": LatencyWindow(), "stream": LatencyWindow()}
+        self.counts = {"calls": 0, "failures": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def hedge_delay(self, method: str):
+        p95 = self.latency[method].percentile(0.95)
+        return None if p95 is None else max(p95, LLM_HEDGE_MIN_DELAY)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        p95 = {method: window.percentile(0.95, min_samples=1) for method, window in self.latency.items()}
+        return {
+            "model": self.name,
+            "circuit": self.breaker.state(),
+            "circuit_opened": self.breaker.opened,
+            **counts,
+            "p95_seconds": {method: None if value is None else round(value, 3) for method, value in p95.items()},
+        }
+
+
+class StreamRace:
+    """
+    One attempt at a provider, possibly hedged.
+
+    Requests run on `executor` threads and push their output to a queue. The
+    first request to produce output wins and the others are abandoned; an
+    abandoned stream stops at its next chunk, an abandoned invoke runs out on
+    its thread while the caller moves on.
+    """
+
+    def __init__(self, executor, provider: Provider, method: str, prompt: str):
+        self.executor = executor
+        self.provider = provider
+        self.method = method
+        self.prompt = prompt
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.started = 0
+        self.running = 0
+        self.winner = None
+        self.finished = False
+        self.start()
+
+    def start(self):
+        self.executor.submit(self._pump, self.started)
+        self.started += 1
+        self.running += 1
+
+    def _pump(self, index: int):
+        try:
+            if self.method == "invoke":
+                self.queue.put((index, "chunk", self.provider.client.invoke(self.prompt)))
+            else:
+                stream = self.provider.client.stream(self.prompt)
+                try:
+                    for chunk in stream:
+                        if self.cancelled.is_set() or self.winner not in (None, index):
+                            return
+                        self.queue.put((index, "chunk", chunk))
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+            self.queue.put((index, "end", None))
+        except Exception as e:
+            self.queue.put((index, "error", e))
+
+    def first(self, deadline: float, hedge_delay: float = None):
+        """
+        Wait for the first output of any request, starting a hedge request
+        after `hedge_delay` seconds. Returns the first chunk, or None when the
+        winner finished without output.
+        """
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+        while True:
+            wait_until = min(deadline, hedge_at) if hedge_at is not None else deadline
+            try:
+                index, kind, payload = self.queue.get(timeout=max(0.0, wait_until - time.monotonic()))
+            except queue.Empty:
+                if hedge_at is not None and time.monotonic() < deadline:
+                    hedge_at = None
+                    self.start()
+                    self.provider.record(hedges=1)
+                    continue
+                self.cancel()
+                raise LLMTimeout(f"{self.provider.name} did not answer in time")
+            if kind == "error":
+                self.running -= 1
+                if self.running:
+                    continue
+                self.cancel()
+                raise payload
+            self.winner = index
+            if index:
+                self.provider.record(hedge_wins=1)
+            if kind == "end":
+                self.finished = True
+                return None
+            return payload
+
+    def rest(self, deadline: float):
+        """
+        Yield the winner's remaining output.
+        """
+        while not self.finished:
+            try:
+                index, kind, payload = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise LLMTimeout(f"{self.provider.name} did not finish in time")
+            if index != self.winner:
+                continue
+            if kind == "error":
+                raise payload
+            if kind == "end":
+                self.finished = True
+            else:
+                yield payload
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class AsyncStreamRace:
+    """
+    StreamRace for astream: requests are tasks on the running loop, and the
+    losers are cancelled outright.
+    """
+
+    def __init__(self, provider: Provider, prompt: str):
+        self.provider = provider
+        self.prompt = prompt
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.running = 0
+        self.winner = None
+        self.finished = False
+        self.start()
+
+    def start(self):
+        self.tasks.append(asyncio.ensure_future(self._pump(len(self.tasks))))
+        self.running += 1
+
+    async def _pump(self, index: int):
+        try:
+            async for chunk in self.provider.client.astream(self.prompt):
+                if self.winner not in (None, index):
+                    return
+                self.queue.put_nowait((index, "chunk", chunk))
+            self.queue.put_nowait((index, "end", None))
+        except Exception as e:
+            self.queue.put_nowait((index, "error", e))
+
+    async def first(self, deadline: float, hedge_delay: float = None):
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+        while True:
+            wait_until = min(deadline, hedge_at) if hedge_at is not None else deadline
+            try:
+                index, kind, payload = await asyncio.wait_for(
+                    self.queue.get(), timeout=max(0.0, wait_until - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                if hedge_at is not None and time.monotonic() < deadline:
+                    hedge_at = None
+                    self.start()
+                    self.provider.record(hedges=1)
+                    continue
+                self.cancel()
+                raise LLMTimeout(f"{self.provider.name} did not answer in time")
+            if kind == "error":
+                self.running -= 1
+                if self.running:
+                    continue
+                self.cancel()
+                raise payload
+            self.winner = index
+            for task_index, task in enumerate(self.tasks):
+                if task_index != index:
+                    task.cancel()
+            if index:
+                self.provider.record(hedge_wins=1)
+            if kind == "end":
+                self.finished = True
+                return None
+            return payload
+
+    async def rest(self, deadline: float):
+        while not self.finished:
+            try:
+                index, kind, payload = await asyncio.wait_for(
+                    self.queue.get(), timeout=max(0.0, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                raise LLMTimeout(f"{self.provider.name} did not finish in time")
+            if index != self.winner:
+                continue
+            if kind == "error":
+                raise payload
+            if kind == "end":
+                self.finished = True
+            else:
+                yield payload
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff before retry number `attempt`.
+    """
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** (attempt - 1)))
+
+
+class ResilientLLM:
+    """
+    The invoke/stream/astream surface of a LangChain LLM over a list of
+    providers, so one stalled or failing call cannot pin a worker.
+
+    Each call has a deadline of `timeout` seconds, and streams must start
+    within `first_token_timeout`. A failed attempt is retried with jittered
+    backoff up to `retries` times before moving on to the next provider
+    (the fallback model); providers whose circuit is open are skipped. With
+    `hedge`, an attempt that has not produced output within its provider's
+    recent p95 gets an identical second request and the first to answer wins.
+    Once a stream has yielded output it is not retried.
+    """
+
+    def __init__(self, providers: list, executor, timeout: float = LLM_TIMEOUT,
+                 first_token_timeout: float = LLM_FIRST_TOKEN_TIMEOUT, retries: int = LLM_RETRIES,
+                 hedge: bool = LLM_HEDGE):
+        self.providers = providers
+        self.executor = executor
+        self.timeout = timeout
+        self.first_token_timeout = first_token_timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.retried = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        return "".join(self._run("invoke", prompt))
+
+    def stream(self, prompt: str):
+        yield from self._run("stream", prompt)
+
+    async def astream(self, prompt: str):
+        deadline = time.monotonic() + self.timeout
+        errors = []
+        for provider, attempt in self._attempts(errors):
+            if attempt:
+                await asyncio.sleep(min(backoff_delay(attempt), max(0.0, deadline - time.monotonic())))
+            self._check_deadline(deadline, errors)
+            race = AsyncStreamRace(provider, prompt)
+            started = time.monotonic()
+            try:
+                first = await race.first(self._first_deadline("stream", deadline), self._hedge_delay(provider, "stream"))
+            except Exception as e:
+                self._failed(provider, e, errors)
+                continue
+            self._succeeded(provider, "stream", started)
+            try:
+                if first is not None:
+                    yield first
+                async for chunk in race.rest(deadline):
+                    yield chunk
+            except Exception as e:
+                self._failed(provider, e, errors)
+                raise
+            finally:
+                race.cancel()
+            return
+        self._check_deadline(deadline, errors)
+        raise LLMUnavailable(self._unavailable_message(errors))
+
+    def _run(self, method: str, prompt: str):
+        deadline = time.monotonic() + self.timeout
+        errors = []
+        for provider, attempt in self._attempts(errors):
+            if attempt:
+                time.sleep(min(backoff_delay(attempt), max(0.0, deadline - time.monotonic())))
+            self._check_deadline(deadline, errors)
+            race = StreamRace(self.executor, provider, method, prompt)
+            started = time.monotonic()
+            try:
+                first = race.first(self._first_deadline(method, deadline), self._hedge_delay(provider, method))
+            except Exception as e:
+                self._failed(provider, e, errors)
+                continue
+            self._succeeded(provider, method, started)
+            try:
+                if first is not None:
+                    yield first
+                yield from race.rest(deadline)
+            except Exception as e:
+                self._failed(provider, e, errors)
+                raise
+            finally:
+                race.cancel()
+            return
+        self._check_deadline(deadline, errors)
+        raise LLMUnavailable(self._unavailable_message(errors))
+
+    def _attempts(self, errors: list):
+        """
+        Yield (provider, attempt number) in the order they should be tried.
+        """
+        for position, provider in enumerate(self.providers):
+            for attempt in range(self.retries + 1):
+                if not provider.breaker.allow():
+                    errors.append(f"{provider.name}: circuit open")
+                    break
+                with self._lock:
+                    if attempt:
+                        self.retried += 1
+                    elif position:
+                        self.fallbacks += 1
+                provider.record(calls=1)
+                yield provider, attempt
+
+    def _first_deadline(self, method: str, deadline: float) -> float:
+        if method == "invoke":
+            return deadline
+        return min(deadline, time.monotonic() + self.first_token_timeout)
+
+    def _hedge_delay(self, provider: Provider, method: str):
+        return provider.hedge_delay(method) if self.hedge else None
+
+    def _check_deadline(self, deadline: float, errors: list):
+        if time.monotonic() >= deadline:
+            raise LLMTimeout(f"No answer within {self.timeout}s ({'; '.join(errors) or 'no attempt finished'})")
+
+    @staticmethod
+    def _succeeded(provider: Provider, method: str, started: float):
+        provider.breaker.record_success()
+        provider.latency[method].add(time.monotonic() - started)
+
+    @staticmethod
+    def _failed(provider: Provider, error: Exception, errors: list):
+        provider.breaker.record_failure()
+        provider.record(failures=1, timeouts=int(isinstance(error, LLMTimeout)))
+        errors.append(f"{provider.name}: {error}")
+
+    @staticmethod
+    def _unavailable_message(errors: list) -> str:
+        return f"No LLM provider answered ({'; '.join(errors) or 'no providers configured'})"
+
+    def stats(self):
+        with self._lock:
+            counts = {"retries": self.retried, "fallbacks": self.fallbacks}
+        return {"hedging": self.hedge, **counts, "providers": [provider.stats() for provider in self.providers]}
+
+
+class FakeLLM:
+    """
+    Local stand-in for Gemini, selected with LLM_PROVIDER=fake.
+
+    Every prompt is answered with the same small, valid Clarity contract (and
+    the query expansion prompts with no extra terms) after `latency` seconds.
+    A `stall_rate` share of calls hang for `stall` seconds and a
+    `failure_rate` share raise, to exercise deadlines, hedging, retries and
+    circuit breaking without credentials.
+    """
+
+    def __init__(self, model: str = "fake", latency: float = FAKE_LLM_LATENCY, stall_rate: float = FAKE_LLM_STALL_RATE,
+                 stall: float = 600.0, failure_rate: float = FAKE_LLM_FAILURE_RATE, seed: int = None):
+        self.model = model
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self) -> float:
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.failure_rate:
+            raise ValueError(f"{self.model} fake failure")
+        return self.stall if roll < self.failure_rate + self.stall_rate else self.latency
+
+    def _answer(self, prompt: str) -> str:
+        return "<search_terms></search_terms>" if "<search_terms>" in prompt else FAKE_ANSWER
+
+    def invoke(self, prompt: str) -> str:
+        time.sleep(self._delay())
+        return self._answer(prompt)
+
+    def stream(self, prompt: str):
+        time.sleep(self._delay())
+        for line in self._answer(prompt).splitlines(keepends=True):
+            yield line
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self._delay())
+        for line in self._answer(prompt).splitlines(keepends=True):
+            yield line
+
+
+def create_client(model: str, max_output_tokens: int, provider: str = LLM_PROVIDER, timeout: float = LLM_TIMEOUT):
+    """
+    Build the client for one model of the configured provider.
+    """
+    if provider == "fake":
+        return FakeLLM(model)
+    if provider != "gemini":
+        raise ValueError(f"Unknown LLM provider '{provider}', expected one of {LLM_PROVIDERS}")
+    return GoogleGenerativeAI(
+        model=model,
+        max_output_tokens=max_output_tokens,
+        google_api_key=os.environ.get("GOOGLE_API_KEY"),
+        timeout=timeout,
+        # Retries, with backoff and fallback, are done by ResilientLLM
+        max_retries=0,
+    )
+
+
+def llm_providers(model: str, max_output_tokens: int, client=None, fallback_model: str = LLM_FALLBACK_MODEL) -> list:
+    """
+    The primary model and, when configured, the fallback model. A client passed
+    in, e.g. a benchmark stand-in, is used as the only provider.
+    """
+    if client is not None:
+        return [Provider(model, client)]
+    providers = [Provider(model, create_client(model, max_output_tokens))]
+    if fallback_model and fallback_model != model:
+        providers.append(Provider(fallback_model, create_client(fallback_model, max_output_tokens)))
+    return providers
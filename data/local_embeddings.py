@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import onnxruntime
+from huggingface_hub import hf_hub_download
+from langchain_core.embeddings import Embeddings
+from tokenizers import Tokenizer
+
+
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Directory holding model.onnx and tokenizer.json; downloaded from the Hub when unset
+LOCAL_EMBEDDING_MODEL_PATH = os.environ.get("LOCAL_EMBEDDING_MODEL_PATH")
+LOCAL_EMBEDDING_THREADS = int(os.environ.get("LOCAL_EMBEDDING_THREADS", str(os.cpu_count() or 1)))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+# How long the first query of a micro-batch waits for others to join it
+LOCAL_EMBEDDING_MAX_WAIT = float(os.environ.get("LOCAL_EMBEDDING_MAX_WAIT", "0.005"))
+LOCAL_EMBEDDING_MAX_TOKENS = 256
+
+
+def model_files(model: str = LOCAL_EMBEDDING_MODEL, model_path: str = LOCAL_EMBEDDING_MODEL_PATH):
+    """
+    Paths of the ONNX model and its tokenizer, downloading them into the
+    Hugging Face cache if no local directory is configured.
+
+    Returns:
+        tuple: (onnx_path, tokenizer_path)
+    """
+    if model_path:
+        return os.path.join(model_path, "model.onnx"), os.path.join(model_path, "tokenizer.json")
+    return hf_hub_download(model, "onnx/model.onnx"), hf_hub_download(model, "tokenizer.json")
+
+
+class MicroBatcher:
+    """
+    Groups texts submitted concurrently from many threads into batches for one
+    model call.
+
+    The first text of a batch waits at most `max_wait` seconds for others to
+    arrive, so a lone query pays almost nothing while a burst of queries is
+    embedded in a single forward pass.
+    """
+
+    def __init__(self, embed_batch, max_batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 max_wait: float = LOCAL_EMBEDDING_MAX_WAIT):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.embed_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "average_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence-transformers style model run in-process with ONNX Runtime on CPU.
+
+    Token embeddings are mean-pooled over the attention mask and L2-normalized.
+    Queries from concurrent requests go through a MicroBatcher; documents are
+    embedded directly in batches of `batch_size`.
+    """
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, model_path: str = LOCAL_EMBEDDING_MODEL_PATH,
+                 threads: int = LOCAL_EMBEDDING_THREADS, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 max_wait: float = LOCAL_EMBEDDING_MAX_WAIT):
+        onnx_path, tokenizer_path = model_files(model, model_path)
+        self.model_id = f"local:{model}"
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=LOCAL_EMBEDDING_MAX_TOKENS)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.batcher = MicroBatcher(self._embed_batch, batch_size, max_wait)
+        # Warm up so the first real request does not pay for graph initialization
+        self.dimensions = len(self._embed_batch(["warm up"])[0])
+
+    def _embed_batch(self, texts: list) -> list:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, inputs)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.batcher.submit(text).result()
+
+    def embed_queries(self, texts: list) -> list:
+        futures = [self.batcher.submit(text) for text in texts]
+        return [future.result() for future in futures]
@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from data.embedding_cache import normalize_text
+from data.prompts import CLARITYBOOK_RETRIEVER_PROMPT, HIRODOCS_RETRIEVER_PROMPT, STACKJS_RETRIEVER_PROMPT
+
+
+EXPANSION_MODEL = os.environ.get("EXPANSION_MODEL", "gemini-1.5-flash")
+EXPANSION_CACHE_MAX_ENTRIES = int(os.environ.get("EXPANSION_CACHE_MAX_ENTRIES", "4096"))
+EXPANSION_CACHE_TTL = float(os.environ.get("EXPANSION_CACHE_TTL", str(24 * 60 * 60)))
+MULTI_QUERY_MAX_TERMS = int(os.environ.get("MULTI_QUERY_MAX_TERMS", "12"))
+MULTI_QUERY_TOKEN_BUDGET = int(os.environ.get("MULTI_QUERY_TOKEN_BUDGET", "6000"))
+# Rough characters-per-token ratio used to estimate chunk sizes
+CHARS_PER_TOKEN = 4
+
+RETRIEVER_PROMPTS = {
+    "claritybook": CLARITYBOOK_RETRIEVER_PROMPT,
+    "stackjs": STACKJS_RETRIEVER_PROMPT,
+    "hirodocs": HIRODOCS_RETRIEVER_PROMPT,
+}
+
+TERM_PATTERN = re.compile(r"<term>(.*?)</term>", re.DOTALL)
+RESPONSE_PATTERN = re.compile(r"<response>(.*?)</response>", re.DOTALL)
+
+
+def parse_search_terms(text: str) -> list:
+    """
+    Extract the search terms from a retriever prompt's answer.
+
+    Coding queries come back as a <search_terms> list, other queries as a single
+    <response>; "not_needed" means the query needs no documentation.
+    """
+    terms = [term.strip() for term in TERM_PATTERN.findall(text) if term.strip()]
+    if terms:
+        return terms
+    match = RESPONSE_PATTERN.search(text)
+    if match and match.group(1).strip() and match.group(1).strip() != "not_needed":
+        return [match.group(1).strip()]
+    return []
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class QueryExpander:
+    """
+    Expands a question into documentation search terms using the CLARITYBOOK,
+    STACKJS and HIRODOCS retriever prompts, run in parallel.
+
+    Expansions are cached by normalized question and conversation, since the
+    same questions come up over and over. An expansion in which any prompt
+    failed is not cached, so an outage does not pin the question to fewer
+    terms for the whole TTL.
+    """
+
+    def __init__(self, llm, executor, prompts: dict = None, max_entries: int = EXPANSION_CACHE_MAX_ENTRIES,
+                 ttl: float = EXPANSION_CACHE_TTL):
+        self.llm = llm
+        self.executor = executor
+        self.prompts = prompts or RETRIEVER_PROMPTS
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def expand(self, query_text: str, chat_history: str = "") -> list:
+        key = (normalize_text(query_text), normalize_text(chat_history))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[0])
+            self.misses += 1
+
+        futures = [
+            self.executor.submit(self._expand_with, prompt, query_text, chat_history)
+            for prompt in self.prompts.values()
+        ]
+        terms = []
+        seen = set()
+        failed = False
+        for future in futures:
+            prompt_terms = future.result()
+            if prompt_terms is None:
+                failed = True
+                continue
+            for term in prompt_terms:
+                if term.casefold() not in seen:
+                    seen.add(term.casefold())
+                    terms.append(term)
+
+        with self._lock:
+            if failed:
+                self.failures += 1
+                return list(terms)
+            self._entries[key] = (terms, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return list(terms)
+
+    def _expand_with(self, prompt: str, query_text: str, chat_history: str):
+        """
+        Returns:
+            list: The prompt's search terms, or None if the LLM call failed.
+        """
+        try:
+            answer = self.llm.invoke(prompt.format(chat_history=chat_history or "None", query=query_text))
+        except Exception:
+            # Expansion only improves recall; the original question is still searched
+            return None
+        return parse_search_terms(answer)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "failures": self.failures, "entries": len(self._entries),
+            }
+
+
+def trim_to_budget(results: list, token_budget: int = MULTI_QUERY_TOKEN_BUDGET) -> list:
+    """
+    Keep (Document, score) results in order until their estimated token count
+    would exceed `token_budget`. The first result is always kept.
+    """
+    trimmed = []
+    used = 0
+    for doc, score in results:
+        tokens = estimate_tokens(doc.page_content)
+        if trimmed and used + tokens > token_budget:
+            break
+        trimmed.append((doc, score))
+        used += tokens
+    return trimmed
@@ -1,32 +1,151 @@
 import argparse
 import os
-import shutil
-from langchain_community.document_loaders import DirectoryLoader
+from collections import Counter, defaultdict
+from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema.document import Document
 from get_embedding_function import get_embedding_function
-from langchain_chroma import Chroma
+from embedding_cache import get_embedding_cache
+from embedding_pipeline import (
+    EMBED_BATCH_SIZE, EMBED_WORKERS, WRITE_BATCH_SIZE, BufferPlan, embed_and_store, map_bounded, plan_buffers, prefetch,
+)
+from index_manifest import diff_files, hash_text, load_manifest, save_manifest
+from keyword_index import KeywordIndex, keyword_index_path
+from corpora import LEGACY_COLLECTION, CorpusCollections, corpus_for_source
+from telemetry import setup_telemetry, shutdown_telemetry, stage
+from quantized_index import QuantizedIndex, build_quantized_index, quantized_index_path
+from relevance_gate import build_centroids, relevance_centroids_path
 
 CHROMA_PATH = "chroma"
 DATA_PATH = "src/"
 
+class IngestProgress:
+    """
+    Hooks ingest() calls while it runs, e.g. to report a job's progress or to
+    stop it by raising. The defaults do nothing.
+    """
+
+    def phase(self, name: str, files: int = None):
+        pass
+
+    def file_done(self, source: str):
+        pass
+
+    def chunks_written(self, count: int):
+        pass
+
+def add_ingest_arguments(parser: argparse.ArgumentParser, workers: int = EMBED_WORKERS):
+    parser.add_argument("--reset", action="store_true", help="Rebuild the database from scratch.")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embedding batch.")
+    parser.add_argument("--workers", type=int, default=workers, help="Parallel embedding workers.")
+    parser.add_argument("--write-batch-size", type=int, default=WRITE_BATCH_SIZE, help="Chunks per Chroma write.")
+    parser.add_argument("--processes", type=int, default=1, help="Processes used to parse and split files.")
+    parser.add_argument("--max-memory", type=int, default=None,
+                        help="Approximate limit in MB on chunks buffered between pipeline stages.")
+    parser.add_argument("--rebuild-keyword-index", action="store_true",
+                        help="Rebuild the BM25 keyword index from the chunks already in Chroma.")
+
+def ingest_options(args) -> dict:
+    """
+    ingest() keyword arguments from parsed add_ingest_arguments options.
+    """
+    return {
+        "reset": args.reset,
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "write_batch_size": args.write_batch_size,
+        "processes": args.processes,
+        "max_memory": args.max_memory,
+        "rebuild_keyword_index": args.rebuild_keyword_index,
+    }
+
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--reset", action="store_true", help="Reset the database.")
+    parser = argparse.ArgumentParser(
+        description="Queue an ingestion job and run it now. The index is built in a staging directory and "
+                    "swapped in when complete, so servers keep answering from the previous one meanwhile."
+    )
+    add_ingest_arguments(parser)
     args = parser.parse_args()
-    if args.reset:
-        print("✨ Clearing Database")
-        clear_database()
+    setup_telemetry("stacks-ai-ingest")
+    # Imported here since ingest_jobs imports this module
+    from ingest_jobs import JobQueue, SUCCEEDED, work
+
+    jobs = JobQueue()
+    job_id = jobs.submit(ingest_options(args))
+    print(f"📥 Queued ingestion job {job_id}")
+    status = work(jobs, until=job_id)
+    shutdown_telemetry()
+    if status != SUCCEEDED:
+        raise SystemExit(f"Ingestion job {job_id} {status}")
 
-    documents = load_documents()
-    chunks = split_documents(documents)
-    add_to_chroma(chunks)
+def ingest(chroma_path: str = None, reset: bool = False, batch_size: int = EMBED_BATCH_SIZE,
+           workers: int = EMBED_WORKERS, write_batch_size: int = WRITE_BATCH_SIZE, processes: int = 1,
+           max_memory: int = None, rebuild_keyword_index: bool = False, progress: IngestProgress = None) -> bool:
+    """
+    Bring the index under `chroma_path` in line with the files under DATA_PATH.
 
-def load_documents():
+    `reset` does not clear anything itself; ingest_jobs builds reset jobs in
+    an empty staging directory.
+
+    Returns:
+        bool: Whether the index changed and should be published.
+    """
+    chroma_path = chroma_path or CHROMA_PATH
+    progress = progress or IngestProgress()
     print(f"Looking in absolute path: {os.path.abspath(DATA_PATH)}")
-    document_loader = DirectoryLoader(DATA_PATH, glob="**/*.md")
-    documents = document_loader.load()
-    print(f"Loaded {len(documents)} documents .md from {DATA_PATH}")
+    manifest = load_manifest(chroma_path)
+    migrating = LEGACY_COLLECTION in CorpusCollections.list_collection_names(chroma_path)
+    if migrating:
+        # Everything still lives in the single pre-corpus collection; re-index
+        # every file so it lands in its corpus collection.
+        print("🔀 Migrating the langchain collection to per-corpus collections")
+        manifest = {}
+    file_diff = diff_files(DATA_PATH, manifest)
+    print(f"📄 {file_diff.summary()}")
+
+    plan = plan_buffers(max_memory, batch_size, workers, write_batch_size)
+    if max_memory is not None:
+        print(f"Buffer plan for {max_memory} MB: {plan}")
+    progress.phase("indexing", files=len(file_diff.to_index))
+    file_chunks = iter_file_chunks(file_diff.to_index, processes=processes, window=plan.prefetch_files)
+    add_to_chroma(
+        file_chunks, deleted_sources=file_diff.deleted, plan=plan, workers=workers, chroma_path=chroma_path,
+        progress=progress,
+    )
+    if migrating:
+        CorpusCollections(chroma_path, allow_legacy=False).drop_legacy()
+    save_manifest(chroma_path, file_diff.manifest)
+    progress.phase("keyword_index")
+    with stage("keyword_index"):
+        build_keyword_index(rebuild=rebuild_keyword_index, chroma_path=chroma_path)
+    changed = bool(file_diff.to_index or file_diff.deleted)
+    progress.phase("quantized_index")
+    with stage("quantized_index"):
+        refresh_quantized_index(changed, chroma_path=chroma_path)
+    progress.phase("relevance_centroids")
+    with stage("relevance_centroids"):
+        refresh_relevance_centroids(changed, chroma_path=chroma_path)
+    return changed or reset or rebuild_keyword_index
+
+def iter_file_chunks(sources: list[str], processes: int = 1, window: int = 16):
+    """
+    Lazily parse and split files, yielding (source, chunks) one file at a time.
+
+    With `processes` > 1 parsing and splitting run in a process pool; at most
+    `window` files are in progress at once, so memory does not grow with the
+    size of the corpus.
+    """
+    return map_bounded(load_and_split, sources, processes=processes, window=window)
+
+def load_and_split(source: str):
+    documents = load_documents([source])
+    return source, calculate_chunk_ids(split_documents(documents))
+
+def load_documents(sources: list[str]):
+    documents = []
+    for source in sources:
+        with stage("parse", source=source):
+            documents.extend(UnstructuredFileLoader(source).load())
     return documents
 
 def split_documents(documents: list[Document]):
@@ -36,25 +155,147 @@ def split_documents(documents: list[Document]):
         length_function=len,
         is_separator_regex=False,
     )
-    return text_splitter.split_documents(documents)
+    with stage("split", documents=len(documents)):
+        return text_splitter.split_documents(documents)
 
-def add_to_chroma(chunks: list[Document]):
-    db = Chroma(
-        persist_directory=CHROMA_PATH, embedding_function=get_embedding_function()
+def add_to_chroma(file_chunks, deleted_sources: list[str] = (), plan: BufferPlan = None,
+                  workers: int = EMBED_WORKERS, chroma_path: str = None, progress: IngestProgress = None):
+    """
+    Bring the Chroma collection in line with the chunks of each file.
+
+    `file_chunks` yields (source, chunks) pairs and is consumed as a stream, on
+    a background thread, so parsing overlaps with embedding. Chunks are only
+    embedded when their id is new or their content hash differs from the stored
+    one. Stored chunks of a re-indexed file that it no longer produces, and all
+    chunks of `deleted_sources`, are deleted, so shifted chunk boundaries never
+    leave orphaned vectors behind.
+    """
+    chroma_path = chroma_path or CHROMA_PATH
+    progress = progress or IngestProgress()
+    if plan is None:
+        plan = plan_buffers(workers=workers)
+    embedding_function = get_embedding_function()
+    db = CorpusCollections(chroma_path, embedding_function, allow_legacy=False)
+    keyword_index = KeywordIndex(keyword_index_path(chroma_path))
+    existing_items = db.get(include=["metadatas"])
+    existing_hashes = {}
+    ids_by_source = defaultdict(set)
+    for chunk_id, metadata in zip(existing_items["ids"], existing_items["metadatas"]):
+        metadata = metadata or {}
+        existing_hashes[chunk_id] = metadata.get("content_hash")
+        ids_by_source[metadata.get("source")].add(chunk_id)
+    del existing_items
+    print(f"Number of existing documents in DB: {len(existing_hashes)}")
+
+    counts = Counter()
+
+    def remove(ids):
+        if ids:
+            db.delete(ids=list(ids))
+            keyword_index.delete(ids)
+            counts["removed"] += len(ids)
+
+    def index_keywords(chunks):
+        keyword_index.add((chunk.metadata["id"], chunk.page_content) for chunk in chunks)
+        progress.chunks_written(len(chunks))
+
+    def chunks_to_embed():
+        files = 0
+        for source, chunks in prefetch(file_chunks, maxsize=plan.prefetch_files):
+            files += 1
+            current_ids = set()
+            for chunk in chunks:
+                chunk_id = chunk.metadata["id"]
+                current_ids.add(chunk_id)
+                if chunk_id not in existing_hashes:
+                    counts["added"] += 1
+                    yield chunk
+                elif existing_hashes[chunk_id] != chunk.metadata["content_hash"]:
+                    counts["updated"] += 1
+                    yield chunk
+                else:
+                    counts["unchanged"] += 1
+            remove(ids_by_source.get(source, set()) - current_ids)
+            progress.file_done(source)
+        print(f"Loaded {files} documents .md from {DATA_PATH}")
+
+    embed_and_store(
+        db, embedding_function, chunks_to_embed(),
+        batch_size=plan.batch_size, workers=workers,
+        write_batch_size=plan.write_batch_size, max_in_flight=plan.max_in_flight,
+        on_write=index_keywords,
+    )
+    for source in deleted_sources:
+        remove(ids_by_source.get(source, set()))
+
+    print(
+        f"📊 Chunks: {counts['added']} added, {counts['updated']} updated, "
+        f"{counts['removed']} removed, {counts['unchanged']} unchanged"
     )
-    chunks_with_ids = calculate_chunk_ids(chunks)
-    existing_items = db.get(include=[])
-    existing_ids = set(existing_items["ids"])
-    print(f"Number of existing documents in DB: {len(existing_ids)}")
-
-    new_chunks = [chunk for chunk in chunks_with_ids if chunk.metadata["id"] not in existing_ids]
-    if new_chunks:
-        print(f"👉 Adding new documents: {len(new_chunks)}")
-        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-        db.add_documents(new_chunks, ids=new_chunk_ids)
-        db.persist()
-    else:
-        print("✅ No new documents to add")
+    print(f"📚 Chunks per corpus: {db.counts()}")
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+
+def build_keyword_index(rebuild: bool = False, page_size: int = 1000, chroma_path: str = None):
+    """
+    Backfill the BM25 keyword index from the chunks stored in Chroma.
+
+    New and changed chunks are indexed as they are written, so this only does
+    work when the keyword index is empty (e.g. a database built before the index
+    existed) or when a rebuild is requested.
+    """
+    chroma_path = chroma_path or CHROMA_PATH
+    keyword_index = KeywordIndex(keyword_index_path(chroma_path))
+    db = CorpusCollections(chroma_path, allow_legacy=False)
+    total = db.count()
+    if not rebuild and (keyword_index.count() or not total):
+        return
+    print(f"🔎 Building keyword index for {total} chunks")
+    keyword_index.clear()
+    for page in db.iter_pages(include=["documents"], page_size=page_size):
+        keyword_index.add(zip(page["ids"], page["documents"]))
+    print(f"✅ Keyword index holds {keyword_index.count()} chunks")
+
+def refresh_quantized_index(changed: bool, chroma_path: str = None):
+    """
+    Rebuild the quantized vector index, if one was built, with the same method
+    when this run changed any chunks, so VECTOR_INDEX=quantized never serves a
+    stale index.
+    """
+    chroma_path = chroma_path or CHROMA_PATH
+    path = quantized_index_path(chroma_path)
+    if not os.path.exists(path):
+        return
+    db = CorpusCollections(chroma_path, allow_legacy=False)
+    index = QuantizedIndex(path)
+    if not changed and not index.is_stale(db.counts()):
+        return
+    del index
+    options = quantized_index_options(path)
+    print(f"🗜️ Rebuilding {options['method']} quantized index")
+    build_quantized_index(db, path, **options)
+
+def quantized_index_options(path: str) -> dict:
+    """
+    build_quantized_index() keyword arguments that rebuild the index at `path`
+    with the same method and, for pq, the same number of subspaces.
+    """
+    index = QuantizedIndex(path)
+    options = {"method": index.method}
+    if index.method == "pq":
+        options["subspaces"] = index.codes.shape[1]
+    return options
+
+def refresh_relevance_centroids(changed: bool, chroma_path: str = None):
+    """
+    Recompute the centroids the relevance gate compares questions against.
+    """
+    chroma_path = chroma_path or CHROMA_PATH
+    path = relevance_centroids_path(chroma_path)
+    if not changed and os.path.exists(path):
+        return
+    count = build_centroids(CorpusCollections(chroma_path, allow_legacy=False), path)
+    if count:
+        print(f"🎯 Saved {count} relevance centroids")
 
 def calculate_chunk_ids(chunks):
     last_page_id = None
@@ -70,11 +311,9 @@ def calculate_chunk_ids(chunks):
         chunk_id = f"{current_page_id}:{current_chunk_index}"
         last_page_id = current_page_id
         chunk.metadata["id"] = chunk_id
+        chunk.metadata["content_hash"] = hash_text(chunk.page_content)
+        chunk.metadata["corpus"] = corpus_for_source(source)
     return chunks
 
-def clear_database():
-    if os.path.exists(CHROMA_PATH):
-        shutil.rmtree(CHROMA_PATH)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,324 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+# "chroma" searches the HNSW index; "quantized" the memory-mapped index below
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "chroma")
+VECTOR_INDEXES = ("chroma", "quantized")
+QUANTIZED_INDEX_DIR = "quantized_index"
+QUANTIZATION_METHODS = ("int8", "pq")
+# Candidates taken from the quantized scan and re-ranked with the float vectors
+QUANTIZED_RERANK_CANDIDATES = int(os.environ.get("QUANTIZED_RERANK_CANDIDATES", "100"))
+# Rows scanned per step, which bounds the temporary float copy of the codes
+SCAN_BLOCK = 16384
+PQ_SUBSPACES = 96
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = 20000
+PQ_ITERATIONS = 20
+
+META_FILE = "meta.json"
+IDS_FILE = "ids.json"
+VECTORS_FILE = "vectors.f32"
+CODES_FILE = "codes.bin"
+NORMS_FILE = "norms.npy"
+SCALES_FILE = "scales.npy"
+CODEBOOKS_FILE = "codebooks.npy"
+
+
+def quantized_index_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, QUANTIZED_INDEX_DIR)
+
+
+def nearest_centroids(points, centroids):
+    distances = (
+        (points ** 2).sum(axis=1)[:, None] - 2 * points @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    )
+    return distances.argmin(axis=1)
+
+
+def kmeans(points, clusters: int, iterations: int, rng):
+    """
+    Plain Lloyd's k-means, seeded with randomly chosen points.
+    """
+    centroids = points[rng.choice(len(points), clusters, replace=len(points) < clusters)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+        counts = np.bincount(assignment, minlength=clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class QuantizedIndex:
+    """
+    Read-only vector index built from the Chroma collections by
+    build_quantized_index.
+
+    Every file is memory-mapped, so the operating system shares one copy of the
+    pages between all API worker processes instead of each worker loading its
+    own HNSW index. A search scans the compact codes of the routed corpora,
+    int8 (4x smaller than float32) or product-quantized (one byte per
+    subspace), keeps the best `rerank_candidates` and re-ranks them exactly
+    with the float vectors, of which only the candidate rows are read.
+
+    Distances are squared L2, the same as the Chroma collections, so results can
+    be used in place of Chroma's.
+    """
+
+    def __init__(self, path: str, rerank_candidates: int = QUANTIZED_RERANK_CANDIDATES):
+        self.path = path
+        self.rerank_candidates = rerank_candidates
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, IDS_FILE), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.method = meta["method"]
+        self.dimensions = meta["dimensions"]
+        self.model_id = meta.get("model_id")
+        self.ranges = {corpus: tuple(bounds) for corpus, bounds in meta["ranges"].items()}
+        self.collection_counts = meta["counts"]
+        count = len(self.ids)
+
+        self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), np.float32, "r", shape=(count, self.dimensions))
+        self.norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r")
+        if self.method == "int8":
+            self.codes = np.memmap(os.path.join(path, CODES_FILE), np.int8, "r", shape=(count, self.dimensions))
+            self.scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r")
+        else:
+            self.codebooks = np.load(os.path.join(path, CODEBOOKS_FILE))
+            self.codes = np.memmap(
+                os.path.join(path, CODES_FILE), np.uint8, "r", shape=(count, self.codebooks.shape[0])
+            )
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def check(self, db):
+        """
+        Raise ValueError when the index was built from a different embedding
+        model or corpus layout than `db` (a CorpusCollections) now has.
+        """
+        if (db.model_id and self.model_id and db.model_id != self.model_id) or (
+            db.dimensions and db.dimensions != self.dimensions
+        ):
+            raise ValueError(
+                f"The quantized index was built with {self.model_id} ({self.dimensions} dimensions) but the "
+                f"configured backend is {db.model_id} ({db.dimensions} dimensions). Rebuild it with "
+                f"build_quantized_index.py."
+            )
+        if set(self.ranges) != set(db.corpora):
+            raise ValueError(
+                f"The quantized index covers {sorted(self.ranges)} but the database has {sorted(db.corpora)}. "
+                f"Rebuild it with build_quantized_index.py."
+            )
+
+    def is_stale(self, counts: dict) -> bool:
+        """
+        Whether chunks were added or removed in Chroma since the index was built.
+        """
+        return counts != self.collection_counts
+
+    def _approximate(self, query, table, start: int, stop: int):
+        # Squared distance up to the constant |query|^2, which does not change the order
+        if self.method == "int8":
+            dots = self.codes[start:stop].astype(np.float32) @ query
+            return self.norms[start:stop] - 2 * self.scales[start:stop] * dots
+        return table[np.arange(table.shape[0]), self.codes[start:stop]].sum(axis=1)
+
+    def _distance_table(self, query):
+        if self.method != "pq":
+            return None
+        subspaces = query.reshape(self.codebooks.shape[0], 1, -1)
+        return ((self.codebooks - subspaces) ** 2).sum(axis=2)
+
+    def search(self, embedding, k: int = 4, corpora: list = None):
+        """
+        Nearest chunks to `embedding` within `corpora` (all by default).
+
+        Returns:
+            list: (chunk_id, squared L2 distance) pairs, nearest first.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        table = self._distance_table(query)
+        keep = max(self.rerank_candidates, k)
+        rows, scores = [], []
+        for corpus in corpora or list(self.ranges):
+            start, stop = self.ranges.get(corpus, (0, 0))
+            for block_start in range(start, stop, SCAN_BLOCK):
+                block_stop = min(block_start + SCAN_BLOCK, stop)
+                approximate = self._approximate(query, table, block_start, block_stop)
+                if len(approximate) > keep:
+                    best = np.argpartition(approximate, keep)[:keep]
+                else:
+                    best = np.arange(len(approximate))
+                rows.append(best + block_start)
+                scores.append(approximate[best])
+        if not rows:
+            return []
+        rows = np.concatenate(rows)
+        if len(rows) > keep:
+            rows = rows[np.argpartition(np.concatenate(scores), keep)[:keep]]
+        # Sorted rows read the float vectors front to back
+        rows = np.sort(rows)
+        exact = ((self.vectors[rows] - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:k]
+        return [(self.ids[rows[i]], float(exact[i])) for i in order]
+
+    def exact_search(self, embedding, k: int = 4):
+        """
+        Brute-force search over the float vectors, the reference for recall.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = np.concatenate([
+            ((self.vectors[start:start + SCAN_BLOCK] - query) ** 2).sum(axis=1)
+            for start in range(0, self.count(), SCAN_BLOCK)
+        ])
+        order = np.argsort(distances)[:k]
+        return [(self.ids[i], float(distances[i])) for i in order]
+
+    def stats(self):
+        code_bytes = self.codes.shape[1] * self.codes.itemsize
+        return {
+            "method": self.method,
+            "vectors": self.count(),
+            "dimensions": self.dimensions,
+            "bytes_per_vector": code_bytes,
+            "float_bytes_per_vector": self.dimensions * 4,
+            "rerank_candidates": self.rerank_candidates,
+        }
+
+
+def _iter_blocks(array, block: int = SCAN_BLOCK):
+    for start in range(0, len(array), block):
+        yield start, np.asarray(array[start:start + block], dtype=np.float32)
+
+
+def build_quantized_index(db, path: str, method: str = "int8", subspaces: int = PQ_SUBSPACES,
+                          seed: int = 0, page_size: int = 1000) -> QuantizedIndex:
+    """
+    Build a QuantizedIndex at `path` from the vectors stored in `db` (a
+    CorpusCollections).
+
+    Vectors are streamed page by page into a float32 file, grouped by corpus so
+    each corpus is one contiguous range, and then encoded block by block, so
+    memory use does not grow with the collection. The index is written to a
+    temporary directory and swapped in when complete; workers that still have
+    the old files mapped keep reading them until they reopen.
+    """
+    if method not in QUANTIZATION_METHODS:
+        raise ValueError(f"Unknown quantization method '{method}', expected one of {QUANTIZATION_METHODS}")
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    ids, ranges, counts = [], {}, {}
+    dimensions = None
+    model_id = None
+    with open(os.path.join(tmp_path, VECTORS_FILE), "wb") as f:
+        for corpus, collection in db.collections.items():
+            start = len(ids)
+            total = collection._collection.count()
+            model_id = model_id or db.recorded_embedding(collection)[0]
+            for offset in range(0, total, page_size):
+                page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+                vectors = np.asarray(page["embeddings"], dtype=np.float32)
+                if not len(vectors):
+                    continue
+                dimensions = vectors.shape[1]
+                f.write(vectors.tobytes())
+                ids.extend(page["ids"])
+            ranges[corpus] = [start, len(ids)]
+            counts[corpus] = len(ids) - start
+    if not ids:
+        shutil.rmtree(tmp_path)
+        raise ValueError("The Chroma database holds no vectors; run populate_database.py first.")
+    if method == "pq" and dimensions % subspaces:
+        shutil.rmtree(tmp_path)
+        raise ValueError(f"{dimensions} dimensions cannot be split into {subspaces} PQ subspaces")
+
+    vectors = np.memmap(os.path.join(tmp_path, VECTORS_FILE), np.float32, "r", shape=(len(ids), dimensions))
+    norms = np.concatenate([(block ** 2).sum(axis=1) for _, block in _iter_blocks(vectors)])
+    np.save(os.path.join(tmp_path, NORMS_FILE), norms.astype(np.float32))
+
+    if method == "int8":
+        codes = np.memmap(os.path.join(tmp_path, CODES_FILE), np.int8, "w+", shape=(len(ids), dimensions))
+        scales = np.empty(len(ids), dtype=np.float32)
+        for start, block in _iter_blocks(vectors):
+            block_scales = np.abs(block).max(axis=1) / 127
+            block_scales[block_scales == 0] = 1
+            codes[start:start + len(block)] = np.clip(np.rint(block / block_scales[:, None]), -127, 127)
+            scales[start:start + len(block)] = block_scales
+        np.save(os.path.join(tmp_path, SCALES_FILE), scales)
+    else:
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(ids), min(len(ids), PQ_TRAIN_SAMPLE), replace=False))])
+        width = dimensions // subspaces
+        codebooks = np.stack([
+            kmeans(sample[:, m * width:(m + 1) * width], PQ_CENTROIDS, PQ_ITERATIONS, rng)
+            for m in range(subspaces)
+        ]).astype(np.float32)
+        np.save(os.path.join(tmp_path, CODEBOOKS_FILE), codebooks)
+        codes = np.memmap(os.path.join(tmp_path, CODES_FILE), np.uint8, "w+", shape=(len(ids), subspaces))
+        for start, block in _iter_blocks(vectors):
+            for m in range(subspaces):
+                codes[start:start + len(block), m] = nearest_centroids(
+                    block[:, m * width:(m + 1) * width], codebooks[m]
+                )
+    codes.flush()
+    del codes, vectors
+
+    with open(os.path.join(tmp_path, IDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "method": method,
+            "dimensions": dimensions,
+            "model_id": model_id,
+            "ranges": ranges,
+            "counts": counts,
+        }, f, indent=1)
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return QuantizedIndex(path)
+
+
+def recall_at_k(index: QuantizedIndex, db, queries: int = 100, k: int = 7, seed: int = 0) -> dict:
+    """
+    Recall@k of the quantized index against the full-precision Chroma index and
+    against exact search.
+
+    Stored chunk vectors serve as queries; each query's own chunk is left out of
+    every result list, so it does not inflate the recall.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(index.count(), min(queries, index.count()), replace=False)
+    recalls = {"chroma": [], "exact": [], "chroma_vs_exact": []}
+    for row in rows:
+        query = np.asarray(index.vectors[row])
+        own = index.ids[row]
+
+        def top(hits):
+            return [chunk_id for chunk_id, _ in hits if chunk_id != own][:k]
+
+        quantized = set(top(index.search(query, k + 1)))
+        exact = top(index.exact_search(query, k + 1))
+        chroma = top(
+            (doc.metadata.get("id"), score)
+            for doc, score in db.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=k + 1)
+        )
+        if not exact:
+            continue
+        recalls["chroma"].append(len(quantized & set(chroma)) / max(len(chroma), 1))
+        recalls["exact"].append(len(quantized & set(exact)) / len(exact))
+        recalls["chroma_vs_exact"].append(len(set(chroma) & set(exact)) / len(exact))
+    return {name: round(float(np.mean(values)), 4) if values else None for name, values in recalls.items()}
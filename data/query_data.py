@@ -1,23 +1,24 @@
+import asyncio
+import functools
 import os
-from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAI
-from langchain_chroma import Chroma
-from data.get_embedding_function import get_embedding_function  
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from data.rag_engine import get_rag_engine
+from data.context_builder import build_context
+from data.embedding_cache import embed_queries
+from data.multi_query import estimate_tokens
+from data.telemetry import StageTimer, in_context, record_llm_tokens, setup_telemetry, stage
+from data.response_cache import hash_contracts
 # import logging
 
 
 # logging.basicConfig(level=logging.DEBUG)
 
-load_dotenv()
-
-
-google_api_key = os.environ.get("GOOGLE_API_KEY")
-if not google_api_key:
-    raise ValueError("GOOGLE_API_KEY is not set in the .env file.")
-
-
-CHROMA_PATH = "chroma"
 
+# LLM calls a batch runs at once, and the largest batch the APIs accept
+BATCH_LLM_WORKERS = int(os.environ.get("BATCH_LLM_WORKERS", "4"))
+BATCH_RETRIEVAL_WORKERS = int(os.environ.get("BATCH_RETRIEVAL_WORKERS", "8"))
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "100"))
 
 SUPPORTED_MESSAGE = (
     "This tool only supports generating or modifying Clarity smart contracts for the Stacks ecosystem "
@@ -32,7 +33,10 @@ def main():
     print("Welcome to the Stacks Clarity Contract Generator!")
     print("This tool generates or modifies Clarity smart contracts for the Stacks ecosystem.")
     print("Enter your requests below. Type 'quit' to exit.")
-    
+
+    setup_telemetry("stacks-ai-cli")
+    engine = get_rag_engine()
+    engine.warm_up()
  
     current_contracts = []
     
@@ -44,7 +48,7 @@ def main():
             break
         
       
-        response_text, sources, is_contract = query_rag(query_text, current_contracts)
+        response_text, sources, is_contract = query_rag(query_text, current_contracts, engine=engine)
         
         
         if is_contract:
@@ -54,36 +58,328 @@ def main():
         formatted_response = f"Response:\n{response_text}\n\nSources: {sources}"
         print(formatted_response)
 
-def query_rag(query_text: str, current_contracts: list):
+def query_rag(query_text: str, current_contracts: list, engine=None, use_cache: bool = True,
+              retrieval_mode: str = None):
     """
     Process a user query using Retrieval-Augmented Generation (RAG).
 
     Args:
         query_text (str): The user's query, potentially including frontend code.
         current_contracts (list): List of previously generated contracts.
+        engine (RagEngine, optional): Engine to run the query on. Defaults to the process-wide engine.
+        use_cache (bool): Reuse a cached answer for a sufficiently similar request. Defaults to True.
+        retrieval_mode (str, optional): "vector", "keyword", "hybrid" or "multi". Defaults to the engine's mode.
 
     Returns:
         tuple: (response_text, sources, is_contract)
             - response_text: The LLM's response (contract code + explanation or a message).
             - sources: List of document IDs from the Chroma database.
-            - is_contract: Boolean indicating if the response is a contract.
+            - is_contract: Boolean indicating if the response holds Clarity code that passed validation.
     """
-    
-    embedding_function = get_embedding_function()
+    for event, payload in stream_rag(
+        query_text, current_contracts, engine=engine, use_cache=use_cache, retrieval_mode=retrieval_mode
+    ):
+        if event == "done":
+            return payload["response"], payload["sources"], payload["is_contract"]
+
+def query_rag_batch(questions: list, current_contracts: list = None, engine=None, use_cache: bool = True,
+                    retrieval_mode: str = None, llm_workers: int = BATCH_LLM_WORKERS):
+    """
+    Answer many questions at once, e.g. for evaluation runs or pre-generating
+    common contracts.
+
+    Repeated questions are answered once. All questions are embedded together
+    as queries, sharing /ask's embedding cache entries (only those missing
+    from the cache reach the model), their
+    searches run concurrently and share the chunks they load, and each
+    question's LLM call is dispatched to a pool of `llm_workers` as soon as its
+    retrieval finishes.
+
+    Args:
+        questions (list): The questions, answered independently.
+        current_contracts (list, optional): Contract history shared by every question.
+
+    Returns:
+        list: One dict per question, in order, with "question", "response", "sources",
+            "is_contract", "usage" and "error". When a question fails, "error" holds the
+            message and "response" is None; the other questions are unaffected.
+    """
+    if engine is None:
+        engine = get_rag_engine()
+    current_contracts = current_contracts or []
+    unique = list(dict.fromkeys(questions))
+    answers = {}
+
+    with stage("batch", questions=len(questions), unique=len(unique)):
+        try:
+            with stage("embed", texts=len(unique)):
+                embeddings = embed_queries(engine.embedding_function, unique)
+        except Exception:
+            # Leave embedding to each question, so a failure is reported per question
+            embeddings = [None] * len(unique)
+
+        chunks = {}
+        # Retrieval gets its own pool: hybrid search submits to the engine's executor
+        # and would wait on itself if it ran there.
+        with ThreadPoolExecutor(BATCH_RETRIEVAL_WORKERS, thread_name_prefix="batch-retrieval") as retrieval_pool, \
+                ThreadPoolExecutor(llm_workers, thread_name_prefix="batch-llm") as llm_pool:
+            retrievals = {
+                retrieval_pool.submit(
+                    in_context(retrieve_context), question, current_contracts, engine, use_cache=use_cache,
+                    query_embedding=embedding, retrieval_mode=retrieval_mode, chunks=chunks,
+                ): question
+                for question, embedding in zip(unique, embeddings)
+            }
+            completions = {}
+            for future in as_completed(retrievals):
+                question = retrievals[future]
+                try:
+                    completions[llm_pool.submit(in_context(answer_retrieval), future.result(), engine)] = question
+                except Exception as e:
+                    answers[question] = {"error": str(e)}
+            for future in as_completed(completions):
+                try:
+                    answers[completions[future]] = dict(future.result(), error=None)
+                except Exception as e:
+                    answers[completions[future]] = {"error": str(e)}
+
+    empty = {"response": None, "sources": [], "is_contract": False, "usage": None}
+    return [{"question": question, **empty, **answers[question]} for question in questions]
+
+def answer_retrieval(retrieval: dict, engine):
+    """
+    Complete one retrieve_context result with a single, non-streaming LLM call.
+    """
+    if retrieval["cached"] is not None:
+        response_text, sources, is_contract = retrieval["cached"]
+        return {"response": response_text, "sources": sources, "is_contract": is_contract, "usage": None}
+
+    llm = StageTimer("llm", model=engine.model, prompt_tokens=retrieval["usage"]["prompt_tokens"])
+    try:
+        response_text = engine.llm.invoke(retrieval["prompt"])
+    except Exception as e:
+        llm.end(e)
+        raise ValueError(f"Error invoking Google Gemini LLM: {e}")
+    latency = llm.end(completion_tokens=estimate_tokens(response_text))
+    return complete_rag(retrieval, response_text, latency, engine)
+
+def stream_rag(query_text: str, current_contracts: list, engine=None, use_cache: bool = True,
+               retrieval_mode: str = None):
+    """
+    Streaming variant of query_rag.
+
+    Retrieval runs first and its sources are yielded immediately, followed by
+    the LLM output as it is generated. Concurrent requests with the same
+    question, contract history and options share one computation.
+
+    Yields:
+        tuple: (event, payload) where event is one of
+            - "sources": payload is the list of retrieved document IDs.
+            - "token": payload is the next piece of generated text.
+            - "done": payload is a dict with "response", "sources", "is_contract" and
+              "usage", the prompt's estimated token counts (None for a cached answer).
+    """
+    if engine is None:
+        engine = get_rag_engine()
+
+    key = engine.single_flight.key(query_text, hash_contracts(current_contracts), use_cache, retrieval_mode)
+    yield from engine.single_flight.run(
+        key,
+        lambda: generate_rag(query_text, current_contracts, engine, use_cache, retrieval_mode),
+    )
+
+def generate_rag(query_text: str, current_contracts: list, engine, use_cache: bool, retrieval_mode: str):
+    """
+    Run the pipeline behind stream_rag for a single request.
+    """
+    retrieval = retrieve_context(
+        query_text, current_contracts, engine, use_cache=use_cache, retrieval_mode=retrieval_mode
+    )
+    yield "sources", retrieval["sources"]
+
+    if retrieval["cached"] is not None:
+        response_text, sources, is_contract = retrieval["cached"]
+        yield "token", response_text
+        yield "done", {"response": response_text, "sources": sources, "is_contract": is_contract, "usage": None}
+        return
+
+    # Stream the shared Google Gemini LLM's output for the prompt
+    llm = StageTimer("llm", model=engine.model, prompt_tokens=retrieval["usage"]["prompt_tokens"])
+    chunks = []
+    error = None
+    try:
+        for chunk in engine.llm.stream(retrieval["prompt"]):
+            llm.mark_first_token()
+            chunks.append(chunk)
+            yield "token", chunk
+    except Exception as e:
+        error = e
+        raise ValueError(f"Error invoking Google Gemini LLM: {e}")
+    finally:
+        response_text = "".join(chunks)
+        latency = llm.end(error, completion_tokens=estimate_tokens(response_text))
+
+    yield "done", complete_rag(retrieval, response_text, latency, engine)
+
+async def astream_rag(query_text: str, current_contracts: list, engine=None, use_cache: bool = True,
+                      retrieval_mode: str = None, executor=None):
+    """
+    Asynchronous variant of stream_rag for asyncio servers.
+
+    Retrieval (embedding, vector and keyword search) runs on `executor` (the
+    loop's default executor if None) and the LLM is streamed with its async API,
+    so the event loop is never blocked.
+
+    Yields:
+        tuple: The same (event, payload) pairs as stream_rag.
+    """
+    if engine is None:
+        engine = get_rag_engine()
+
+    key = engine.single_flight.key(query_text, hash_contracts(current_contracts), use_cache, retrieval_mode)
+    async for event in engine.single_flight.arun(
+        key,
+        lambda: agenerate_rag(query_text, current_contracts, engine, use_cache, retrieval_mode, executor),
+    ):
+        yield event
+
+async def agenerate_rag(query_text: str, current_contracts: list, engine, use_cache: bool, retrieval_mode: str,
+                        executor):
+    """
+    Run the pipeline behind astream_rag for a single request.
+    """
+    loop = asyncio.get_running_loop()
+    retrieval = await loop.run_in_executor(
+        executor,
+        functools.partial(
+            in_context(retrieve_context), query_text, current_contracts, engine,
+            use_cache=use_cache, retrieval_mode=retrieval_mode,
+        ),
+    )
+    yield "sources", retrieval["sources"]
+
+    if retrieval["cached"] is not None:
+        response_text, sources, is_contract = retrieval["cached"]
+        yield "token", response_text
+        yield "done", {"response": response_text, "sources": sources, "is_contract": is_contract, "usage": None}
+        return
+
+    llm = StageTimer("llm", model=engine.model, prompt_tokens=retrieval["usage"]["prompt_tokens"])
+    chunks = []
+    error = None
     try:
-        db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
+        async for chunk in engine.llm.astream(retrieval["prompt"]):
+            llm.mark_first_token()
+            chunks.append(chunk)
+            yield "token", chunk
     except Exception as e:
-        raise ValueError(f"Error loading Chroma database: {e}")
+        error = e
+        raise ValueError(f"Error invoking Google Gemini LLM: {e}")
+    finally:
+        response_text = "".join(chunks)
+        latency = llm.end(error, completion_tokens=estimate_tokens(response_text))
+
+    yield "done", complete_rag(retrieval, response_text, latency, engine)
+
+def retrieve_context(query_text: str, current_contracts: list, engine, use_cache: bool = True,
+                     query_embedding=None, retrieval_mode: str = None, chunks: dict = None):
+    """
+    Run the retrieval half of the pipeline: search for context, consult the
+    response cache and build the prompt.
 
+    Args:
+        query_embedding (list, optional): Precomputed embedding of query_text.
+        retrieval_mode (str, optional): "vector", "keyword", "hybrid" or "multi". Defaults to the engine's mode.
+        chunks (dict, optional): Chunks loaded by other searches, shared through Retriever.search.
 
-    results = db.similarity_search_with_score(query_text, k=7)
-    context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in results])
+    Returns:
+        dict: {"query_embedding", "sources", "contracts_hash", "cached", "prompt", "usage", "gated"} where
+            "cached" is the cached (response_text, sources, is_contract) tuple or None,
+            and "prompt" and "usage" are None when a cached answer was found. When the
+            relevance gate judged the question off-topic, "gated" is True and "cached"
+            holds the supported message. "query_embedding" is
+            None when the keyword index answered without embedding the query, in
+            which case the response cache is not used.
+    """
+    # Only contracts that pass validation are resent, reduced to their code
+    current_contracts = engine.contract_validator.history(current_contracts)
+    with stage("retrieve") as span:
+        search = engine.retriever.search(
+            query_text, k=7, mode=retrieval_mode, query_embedding=query_embedding, chunks=chunks
+        )
+        span.set_attributes({"mode": search.mode, "results": len(search.results)})
+    results = search.results
+    query_embedding = search.query_embedding
 
+    # Extract sources from the retrieved documents
+    sources = [doc.metadata.get("id", None) for doc, _score in results]
 
-    contract_history = "\n\n---\n\n".join(current_contracts) if current_contracts else "No prior contract exists."
+    retrieval = {
+        "query_embedding": query_embedding,
+        "sources": sources,
+        "contracts_hash": hash_contracts(current_contracts),
+        "cached": None,
+        "prompt": None,
+        "usage": None,
+        "gated": False,
+    }
+    with stage("relevance_gate") as span:
+        retrieval["gated"] = engine.relevance_gate.check(search, current_contracts)
+        span.set_attribute("gated", retrieval["gated"])
+    if retrieval["gated"]:
+        # Clearly unrelated to the documentation: refuse without calling the LLM
+        retrieval["sources"] = []
+        retrieval["cached"] = (SUPPORTED_MESSAGE, [], False)
+        return retrieval
+    if not use_cache:
+        engine.response_cache.record_bypass()
+    elif query_embedding is not None:
+        with stage("cache_lookup") as span:
+            retrieval["cached"] = engine.response_cache.lookup(query_embedding, sources, retrieval["contracts_hash"])
+            span.set_attribute("hit", retrieval["cached"] is not None)
+        if retrieval["cached"] is not None:
+            return retrieval
+
+    # Merge overlapping chunks, drop duplicates and keep context and history within budget
+    with stage("context_build") as span:
+        context = build_context(results, current_contracts)
+        retrieval["prompt"] = build_prompt(query_text, context.context_text, context.contract_history)
+        retrieval["usage"] = dict(context.usage, prompt_tokens=estimate_tokens(retrieval["prompt"]))
+        span.set_attributes({
+            "prompt_tokens": retrieval["usage"]["prompt_tokens"],
+            "chunks_used": retrieval["usage"]["chunks_used"],
+        })
+    return retrieval
+
+def complete_rag(retrieval: dict, response_text: str, latency: float, engine):
+    """
+    Post-process a generated response and cache it.
 
-    # Construct the prompt for the LLM
-    prompt = f"""
+    Returns:
+        dict: {"response", "sources", "is_contract", "usage"}
+    """
+    usage = dict(retrieval["usage"], completion_tokens=estimate_tokens(response_text))
+    record_llm_tokens(usage["prompt_tokens"], usage["completion_tokens"])
+
+    with stage("response_parse") as span:
+        # Only responses with valid Clarity code enter the session's contract history
+        check = engine.contract_validator.validate(response_text)
+        is_contract = check.valid
+        span.set_attributes({"is_contract": is_contract, "contract_issues": len(check.issues)})
+
+        sources = retrieval["sources"]
+        if retrieval["query_embedding"] is not None:
+            engine.response_cache.store(
+                retrieval["query_embedding"], sources, retrieval["contracts_hash"],
+                (response_text, sources, is_contract), latency,
+            )
+    return {"response": response_text, "sources": sources, "is_contract": is_contract, "usage": usage}
+
+def build_prompt(query_text: str, context_text: str, contract_history: str):
+    """
+    Construct the prompt for the LLM.
+    """
+    return f"""
     First, determine if the following query is directly related to generating or modifying a Clarity smart contract for the Stacks ecosystem, or integrating it with Stacks.js (including based on provided frontend code).
 
     Query: {query_text}
@@ -127,26 +423,5 @@ def query_rag(query_text: str, current_contracts: list):
     Ensure the contract (if included) is complete, functional, and adheres to Stacks conventions. If frontend code is provided in the query, analyze it and tailor the Stacks.js integration accordingly.
     """
 
-    # Initialize the Google Gemini LLM
-    llm_gemini = GoogleGenerativeAI(
-        model="gemini-1.5-pro",
-        max_output_tokens=2048,  
-        google_api_key=google_api_key,
-    )
-
-    # Invoke the LLM with the prompt
-    try:
-        response_text = llm_gemini.invoke(prompt)
-    except Exception as e:
-        raise ValueError(f"Error invoking Google Gemini LLM: {e}")
-
-    # Determine if the response is a contract or integration (not the supported message)
-    is_contract = response_text.strip() != SUPPORTED_MESSAGE.strip()
-
-    # Extract sources from the retrieved documents
-    sources = [doc.metadata.get("id", None) for doc, _score in results]
-
-    return response_text, sources, is_contract
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
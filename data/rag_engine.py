@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from data.corpora import CorpusCollections
+from data.get_embedding_function import get_embedding_function, preload_embedding_config
+from data.index_manifest import read_index_version
+from data.embedding_cache import get_embedding_cache
+from data.response_cache import ResponseCache
+from data.keyword_index import KeywordIndex, keyword_index_path
+from data.retrieval import Retriever
+from data.multi_query import EXPANSION_MODEL, QueryExpander
+from data.single_flight import SingleFlight
+from data.relevance_gate import RelevanceGate
+from data.clarity_validation import ContractValidator
+from data.llm_provider import (
+    EXPANSION_TIMEOUT, LLM_PROVIDER, LLM_THREADS, Provider, ResilientLLM, create_client, llm_providers,
+)
+from data.quantized_index import VECTOR_INDEX, VECTOR_INDEXES, QuantizedIndex, quantized_index_path
+
+load_dotenv()
+
+
+CHROMA_PATH = "chroma"
+GEMINI_MODEL = "gemini-1.5-pro"
+GEMINI_MAX_OUTPUT_TOKENS = 2048
+RETRIEVAL_THREADS = int(os.environ.get("RETRIEVAL_THREADS", "8"))
+
+_engine = None
+_engine_lock = threading.Lock()
+# Read-only state loaded by preload_shared, keyed by (name, chroma_path)
+_shared = {}
+
+
+class RagEngine:
+    """
+    Long-lived owner of the clients used to answer a query.
+
+    Building the Bedrock embedding client, opening the Chroma store and creating
+    the Gemini client are all expensive, so they are done once here and shared by
+    every request. The underlying clients are safe to use from several threads.
+
+    `embedding_function`, `llm` and `expansion_llm` replace the Bedrock and
+    Gemini clients, e.g. with the local stand-ins used by the benchmarks.
+    Either way the LLMs are called through ResilientLLM, which adds deadlines,
+    retries, hedging and (for Gemini) the fallback model.
+
+    With `vector_index="quantized"` vector searches use the memory-mapped index
+    built by build_quantized_index.py instead of Chroma's HNSW index.
+    """
+
+    def __init__(self, chroma_path: str = CHROMA_PATH, model: str = GEMINI_MODEL,
+                 max_output_tokens: int = GEMINI_MAX_OUTPUT_TOKENS, embedding_function=None, llm=None,
+                 expansion_llm=None, vector_index: str = VECTOR_INDEX):
+        if LLM_PROVIDER == "gemini" and not os.environ.get("GOOGLE_API_KEY") and (llm is None or expansion_llm is None):
+            raise ValueError("GOOGLE_API_KEY is not set in the .env file.")
+        if vector_index not in VECTOR_INDEXES:
+            raise ValueError(f"Unknown vector index '{vector_index}', expected one of {VECTOR_INDEXES}")
+
+        self.chroma_path = chroma_path
+        self.model = model
+        self.embedding_function = embedding_function or get_embedding_function()
+        self.executor = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+        # Per-corpus searches get their own pool: they are submitted from tasks
+        # already running on `executor`, which could otherwise wait on themselves.
+        self.corpus_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="corpus")
+        try:
+            self.db = CorpusCollections(chroma_path, self.embedding_function, executor=self.corpus_executor)
+        except Exception as e:
+            raise ValueError(f"Error loading Chroma database: {e}")
+        self.index_version = read_index_version(chroma_path)
+        if vector_index == "quantized":
+            try:
+                self.db.vector_index = (
+                    _shared.get(("vector_index", chroma_path)) or QuantizedIndex(quantized_index_path(chroma_path))
+                )
+            except FileNotFoundError:
+                raise ValueError("VECTOR_INDEX=quantized but no quantized index exists; run build_quantized_index.py.")
+            self.db.vector_index.check(self.db)
+        # LLM requests run on their own pool so deadlines hold even when a call stalls
+        self.llm_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+        self.llm = ResilientLLM(llm_providers(model, max_output_tokens, llm), self.llm_executor)
+        self.keyword_index = KeywordIndex(keyword_index_path(chroma_path))
+        # Expansion only improves recall, so it gets a short deadline and no retries
+        expansion_client = expansion_llm or create_client(EXPANSION_MODEL, 256, timeout=EXPANSION_TIMEOUT)
+        self.expansion_llm = ResilientLLM(
+            [Provider(EXPANSION_MODEL, expansion_client)], self.llm_executor, timeout=EXPANSION_TIMEOUT, retries=0,
+        )
+        self.expander = QueryExpander(self.expansion_llm, self.executor)
+        self.retriever = Retriever(
+            self.db, self.embedding_function, self.keyword_index, self.executor, expander=self.expander
+        )
+        self.relevance_gate = RelevanceGate(chroma_path, model_id=self.db.model_id)
+        self.response_cache = ResponseCache()
+        self.contract_validator = ContractValidator()
+        self.single_flight = SingleFlight()
+        self.warmed_up = False
+
+    def warm_up(self):
+        """
+        Run one embedding and one vector search so the index is loaded and the
+        Bedrock connection is open before the first real request arrives.
+
+        Returns:
+            float: Seconds spent warming up.
+        """
+        start = time.perf_counter()
+        self.retriever.search("Clarity smart contract", k=1, mode="vector")
+        self.warmed_up = True
+        return time.perf_counter() - start
+
+    def readiness(self):
+        """
+        Whether this engine should be sent traffic: warmed up and able to reach
+        the vector store. Cheaper than health_check, for frequent probes.
+
+        Returns:
+            dict: {"ready": bool, "index_version": int | None, "error": str | None}
+        """
+        status = {"ready": self.warmed_up, "index_version": self.index_version, "error": None}
+        if not self.warmed_up:
+            status["error"] = "warming up"
+            return status
+        try:
+            self.db.count()
+        except Exception as e:
+            status["ready"] = False
+            status["error"] = str(e)
+        return status
+
+    def health_check(self):
+        """
+        Report whether the vector store is reachable and how many chunks it holds.
+
+        Returns:
+            dict: {"ok": bool, "warmed_up": bool, "index_version": int | None, "documents": int | None, "collections": dict | None,
+                   "error": str | None, "embedding": dict, "embedding_cache": dict, "response_cache": dict, "retrieval": dict,
+                   "relevance_gate": dict, "contract_validation": dict, "llm": dict, "coalescing": dict}
+        """
+        status = {"ok": True, "warmed_up": self.warmed_up, "index_version": self.index_version, "documents": None,
+                  "collections": None, "error": None}
+        try:
+            status["collections"] = self.db.counts()
+            status["documents"] = sum(status["collections"].values())
+        except Exception as e:
+            status["ok"] = False
+            status["error"] = str(e)
+        status["embedding"] = {"model": self.db.model_id, "dimensions": self.db.dimensions}
+        batcher = getattr(getattr(self.embedding_function, "embeddings", None), "batcher", None)
+        if batcher is not None:
+            status["embedding"]["micro_batching"] = batcher.stats()
+        status["embedding_cache"] = get_embedding_cache().stats()
+        status["response_cache"] = self.response_cache.stats()
+        status["retrieval"] = {
+            "mode": self.retriever.mode,
+            "keyword_chunks": self.keyword_index.count(),
+            "short_circuits": self.retriever.short_circuits,
+            "legacy_collection": self.db.legacy,
+            "expansion_cache": self.expander.stats(),
+            "vector_index": self.vector_index_stats(),
+        }
+        status["relevance_gate"] = self.relevance_gate.stats()
+        status["contract_validation"] = self.contract_validator.stats()
+        status["llm"] = {"answer": self.llm.stats(), "expansion": self.expansion_llm.stats()}
+        # "coalesced" counts requests that reused an in-flight answer, i.e. LLM calls saved
+        status["coalescing"] = self.single_flight.stats()
+        return status
+
+    def vector_index_stats(self):
+        if self.db.vector_index is None:
+            return {"type": "chroma"}
+        return {
+            "type": "quantized",
+            **self.db.vector_index.stats(),
+            "stale": self.db.vector_index.is_stale(self.db.counts()),
+        }
+
+
+def preload_shared(chroma_path: str = CHROMA_PATH):
+    """
+    Load read-only state in a launcher process before it forks workers, so the
+    workers share it copy-on-write instead of each building a copy: imported
+    modules and prompts, the embedding client configuration and, with
+    VECTOR_INDEX=quantized, the memory-mapped vector index.
+
+    Nothing here opens a connection or starts a thread, neither of which
+    survives a fork; each worker still builds its own RagEngine. Call again
+    after a new index is published so later workers pick it up.
+    """
+    preload_embedding_config()
+    _shared.clear()
+    path = quantized_index_path(chroma_path)
+    if VECTOR_INDEX == "quantized" and os.path.exists(path):
+        _shared[("vector_index", chroma_path)] = QuantizedIndex(path)
+
+
+def get_rag_engine():
+    """
+    Return the process-wide RagEngine, creating it on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RagEngine()
+    return _engine
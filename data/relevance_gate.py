@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    from data.quantized_index import kmeans
+    from data.telemetry import record_gate_decision
+except ImportError:
+    from quantized_index import kmeans
+    from telemetry import record_gate_decision
+
+
+RELEVANCE_GATE = os.environ.get("RELEVANCE_GATE", "1") != "0"
+# Override the calibrated thresholds; either signal can be used on its own
+RELEVANCE_MAX_DISTANCE = os.environ.get("RELEVANCE_MAX_DISTANCE")
+RELEVANCE_MIN_SIMILARITY = os.environ.get("RELEVANCE_MIN_SIMILARITY")
+RELEVANCE_GATE_FILE = "relevance_gate.json"
+RELEVANCE_CENTROIDS_FILE = "relevance_centroids.npy"
+CENTROIDS_PER_CORPUS = 8
+CENTROID_SAMPLE = 5000
+CENTROID_ITERATIONS = 15
+
+
+def relevance_gate_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, RELEVANCE_GATE_FILE)
+
+
+def relevance_centroids_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, RELEVANCE_CENTROIDS_FILE)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+def build_centroids(db, path: str, per_corpus: int = CENTROIDS_PER_CORPUS, sample: int = CENTROID_SAMPLE,
+                    seed: int = 0, page_size: int = 1000):
+    """
+    Cluster a sample of each corpus's chunk embeddings into `per_corpus`
+    centroids and save them to `path`. A question far from every centroid is
+    unlike anything in the documentation.
+
+    Returns:
+        int: Number of centroids saved.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = []
+    for collection in db.collections.values():
+        total = collection._collection.count()
+        if not total:
+            continue
+        # Sample whole pages spread over the collection rather than reading all of it
+        pages = np.arange(0, total, page_size)
+        offsets = np.sort(rng.choice(pages, -(-min(total, sample) // page_size), replace=False))
+        vectors = normalize(np.concatenate([
+            np.asarray(collection.get(include=["embeddings"], limit=page_size, offset=int(offset))["embeddings"])
+            for offset in offsets
+        ]))
+        centroids.append(normalize(kmeans(vectors, min(per_corpus, len(vectors)), CENTROID_ITERATIONS, rng)))
+    if not centroids:
+        return 0
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, np.concatenate(centroids))
+    os.replace(tmp_path, path)
+    return sum(len(group) for group in centroids)
+
+
+def load_calibration(chroma_path: str) -> dict:
+    try:
+        with open(relevance_gate_path(chroma_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_calibration(chroma_path: str, calibration: dict):
+    path = relevance_gate_path(chroma_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class RelevanceGate:
+    """
+    Decides before the LLM call whether a question is clearly unrelated to the
+    Stacks documentation, so it can be answered with the supported-message
+    refusal instead of a full generation.
+
+    Two signals are available: the vector distance of the nearest retrieved
+    chunk (above `max_distance` means far from every chunk) and the cosine
+    similarity to the nearest ingest-time centroid (below `min_similarity`).
+    A question is gated only when every configured signal says it is off-topic.
+
+    Thresholds come from relevance_gate.json, written by
+    calibrate_relevance_gate.py for one embedding model, or from
+    RELEVANCE_MAX_DISTANCE / RELEVANCE_MIN_SIMILARITY. Without either the gate
+    lets everything through. Questions continuing a session's contract history
+    are never gated, since follow-ups such as "make it cheaper" only make sense
+    in context.
+    """
+
+    def __init__(self, chroma_path: str, model_id: str = None, enabled: bool = RELEVANCE_GATE):
+        calibration = load_calibration(chroma_path)
+        if calibration.get("model_id") not in (None, model_id):
+            # Calibrated for another embedding model; its distances mean nothing here
+            calibration = {}
+        self.max_distance = _threshold(RELEVANCE_MAX_DISTANCE, calibration.get("max_distance"))
+        self.min_similarity = _threshold(RELEVANCE_MIN_SIMILARITY, calibration.get("min_similarity"))
+        self.centroids = None
+        if self.min_similarity is not None and os.path.exists(relevance_centroids_path(chroma_path)):
+            self.centroids = np.load(relevance_centroids_path(chroma_path))
+        self.enabled = enabled
+        self.checked = 0
+        self.gated = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and (self.max_distance is not None or self.centroids is not None)
+
+    def centroid_similarity(self, query_embedding) -> float:
+        return float((self.centroids @ normalize(query_embedding)).max())
+
+    def signals(self, query_embedding, nearest_distance) -> dict:
+        """
+        Off-topic verdict of each configured signal; a signal without its
+        input is left out.
+        """
+        verdicts = {}
+        if self.max_distance is not None and nearest_distance is not None:
+            verdicts["distance"] = nearest_distance > self.max_distance
+        if self.centroids is not None and query_embedding is not None:
+            verdicts["centroid"] = self.centroid_similarity(query_embedding) < self.min_similarity
+        return verdicts
+
+    def check(self, search, current_contracts: list) -> bool:
+        """
+        Whether the question behind `search` (a retrieval.Retrieval) should be
+        answered with the supported message without calling the LLM.
+        """
+        if not self.active or current_contracts or search.query_embedding is None:
+            # A keyword short-circuit means the question named documented identifiers
+            with self._lock:
+                self.skipped += 1
+            record_gate_decision("skipped")
+            return False
+        verdicts = self.signals(search.query_embedding, search.nearest_distance)
+        gated = bool(verdicts) and all(verdicts.values())
+        with self._lock:
+            self.checked += 1
+            self.gated += gated
+        record_gate_decision("gated" if gated else "passed")
+        return gated
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_distance": self.max_distance,
+                "min_similarity": self.min_similarity,
+                "checked": self.checked,
+                "gated": self.gated,
+                "skipped": self.skipped,
+                "gated_rate": round(self.gated / self.checked, 4) if self.checked else 0.0,
+            }
+
+
+def _threshold(override, calibrated):
+    if override not in (None, ""):
+        return float(override)
+    return calibrated
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.97"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(60 * 60)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+
+def hash_contracts(current_contracts: list) -> str:
+    """
+    Stable digest of the session's contract history.
+    """
+    digest = hashlib.sha256()
+    for contract in current_contracts or []:
+        digest.update(contract.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Semantic cache of LLM answers.
+
+    An answer is reused when a new request retrieved exactly the same chunks,
+    carries the same contract history and its query embedding has a cosine
+    similarity of at least `threshold` with a cached query. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted past `max_entries`.
+    """
+
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def _bucket_key(chunk_ids, contracts_hash: str):
+        return tuple(chunk_ids), contracts_hash
+
+    def lookup(self, query_embedding, chunk_ids, contracts_hash: str):
+        """
+        Return the cached (response_text, sources, is_contract) tuple for the most
+        similar matching query, or None.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._buckets.get(self._bucket_key(chunk_ids, contracts_hash), ())):
+                embedding, norm, _, created, _, _ = self._entries[entry_id]
+                if now - created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query, embedding) / (query_norm * norm)) if query_norm and norm else 0.0
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            _, _, result, _, latency, _ = self._entries[best_id]
+            self.hits += 1
+            self.saved_seconds += latency
+            return result
+
+    def store(self, query_embedding, chunk_ids, contracts_hash: str, result: tuple, latency: float):
+        """
+        Cache `result`, remembering how long it took to generate so hits can
+        report the latency they saved.
+        """
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        bucket_key = self._bucket_key(chunk_ids, contracts_hash)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (embedding, np.linalg.norm(embedding), result, time.time(), latency, bucket_key)
+            self._buckets.setdefault(bucket_key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _remove(self, entry_id):
+        bucket_key = self._entries.pop(entry_id)[-1]
+        bucket = self._buckets[bucket_key]
+        bucket.discard(entry_id)
+        if not bucket:
+            del self._buckets[bucket_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,239 @@
+import os
+import time
+
+from langchain_core.documents import Document
+
+from data.multi_query import MULTI_QUERY_MAX_TERMS, MULTI_QUERY_TOKEN_BUDGET, trim_to_budget
+from data.telemetry import in_context, stage
+
+
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid", "multi")
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+RRF_K = 60
+# Short queries made of code identifiers are answered from the keyword index
+# alone when its best hit contains every identifier, skipping the embedding call.
+SHORT_CIRCUIT_MAX_WORDS = 6
+
+
+class Retrieval:
+    """
+    Outcome of a search.
+
+    Attributes:
+        results (list): (Document, score) pairs, best first. Scores are vector
+            distances in "vector" mode, BM25 scores in "keyword" mode and
+            reciprocal-rank-fusion scores in "hybrid" and "multi" modes.
+        query_embedding (list | None): Embedding of the query, or None when the
+            search never needed one.
+        mode (str): Mode that actually produced the results.
+        timings (dict): Seconds spent per stage, where the mode records them.
+        corpora (list): Corpora the query was routed to.
+        nearest_distance (float | None): Vector distance of the closest chunk to
+            the query itself, whatever the mode, or None when no vector search ran.
+    """
+
+    def __init__(self, results: list, query_embedding=None, mode: str = "vector", timings: dict = None,
+                 corpora: list = None, nearest_distance: float = None):
+        self.results = results
+        self.query_embedding = query_embedding
+        self.mode = mode
+        self.timings = timings or {}
+        self.corpora = corpora or []
+        self.nearest_distance = nearest_distance
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """
+    Fuse several rankings of ids into one using reciprocal rank fusion.
+
+    Returns:
+        list: (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def nearest_distance(vector_results):
+    return vector_results[0][1] if vector_results else None
+
+
+class Retriever:
+    """
+    Vector, keyword (BM25), hybrid or multi-query search over the chunk collection.
+
+    In hybrid mode the keyword lookup runs on `executor` while the query is
+    embedded and searched on the calling thread, and the two rankings are merged
+    with reciprocal rank fusion.
+
+    In multi mode the question is expanded into search terms by `expander`, all
+    terms are embedded in one batch and searched in parallel on `executor`, and
+    the merged results are trimmed to a token budget.
+
+    Every mode only searches the corpora `db` routes the question to.
+    """
+
+    def __init__(self, db, embedding_function, keyword_index, executor, mode: str = RETRIEVAL_MODE,
+                 expander=None):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        self.db = db
+        self.embedding_function = embedding_function
+        self.keyword_index = keyword_index
+        self.executor = executor
+        self.mode = mode
+        self.expander = expander
+        self.short_circuits = 0
+
+    def search(self, query_text: str, k: int = 7, mode: str = None, query_embedding=None,
+               chunks: dict = None) -> Retrieval:
+        """
+        Search for `query_text`. `chunks` ({chunk_id: Document}) lets searches
+        share loaded chunks, e.g. across the questions of a batch: hits already
+        in it are not read from Chroma again, and new ones are added to it.
+        """
+        mode = mode or self.mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        corpora = self.db.route(query_text)
+        if mode == "multi":
+            if self.expander is not None:
+                return self.multi_query_search(query_text, k, query_embedding=query_embedding, corpora=corpora)
+            mode = "hybrid"
+        if mode != "vector" and not self.keyword_index.count():
+            # The keyword index has not been built yet
+            mode = "vector"
+
+        if mode == "keyword":
+            return Retrieval(self.keyword_search(query_text, k, corpora, chunks), mode="keyword", corpora=corpora)
+        if mode == "vector":
+            if query_embedding is None:
+                query_embedding = self.embed_query(query_text)
+            results = self.vector_search(query_embedding, k, corpora)
+            return Retrieval(results, query_embedding, "vector", corpora=corpora,
+                             nearest_distance=nearest_distance(results))
+
+        keyword_future = self.executor.submit(in_context(self.keyword_hits), query_text, k * 2, corpora)
+        query_identifiers = self.keyword_index.identifiers(query_text)
+        if query_embedding is None and query_identifiers and len(query_text.split()) <= SHORT_CIRCUIT_MAX_WORDS:
+            keyword_hits = keyword_future.result()
+            if keyword_hits and self.keyword_index.contains_all(keyword_hits[0][0], query_identifiers):
+                self.short_circuits += 1
+                return Retrieval(self.fetch(keyword_hits[:k], chunks), mode="keyword", corpora=corpora)
+
+        if query_embedding is None:
+            query_embedding = self.embed_query(query_text)
+        vector_results = self.vector_search(query_embedding, k * 2, corpora)
+        keyword_hits = keyword_future.result()
+
+        documents = {doc.metadata.get("id"): doc for doc, _score in vector_results}
+        if chunks is not None:
+            chunks.update(documents)
+        fused = reciprocal_rank_fusion([
+            [doc.metadata.get("id") for doc, _score in vector_results],
+            [chunk_id for chunk_id, _score in keyword_hits],
+        ])[:k]
+        missing = [(chunk_id, score) for chunk_id, score in fused if chunk_id not in documents]
+        for doc, _score in self.fetch(missing, chunks):
+            documents[doc.metadata.get("id")] = doc
+        results = [(documents[chunk_id], score) for chunk_id, score in fused if chunk_id in documents]
+        return Retrieval(results, query_embedding, "hybrid", corpora=corpora,
+                         nearest_distance=nearest_distance(vector_results))
+
+    def multi_query_search(self, query_text: str, k: int, query_embedding=None, corpora: list = None,
+                           max_terms: int = MULTI_QUERY_MAX_TERMS, token_budget: int = MULTI_QUERY_TOKEN_BUDGET):
+        """
+        Expand the question into search terms and search for all of them at once.
+
+        The timings record the wall-clock time of the parallel searches next to
+        the sum of their individual durations, i.e. what running them one after
+        the other would have cost.
+        """
+        timings = {}
+        start = time.perf_counter()
+        with stage("expand") as span:
+            terms = self.expander.expand(query_text)[:max_terms]
+            span.set_attribute("terms", len(terms))
+        timings["expand"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if query_embedding is None:
+            query_embedding = self.embed_query(query_text)
+        if terms:
+            with stage("embed", texts=len(terms)):
+                term_embeddings = self.embedding_function.embed_documents(terms)
+        else:
+            term_embeddings = []
+        timings["embed"] = time.perf_counter() - start
+
+        def timed_search(embedding):
+            search_start = time.perf_counter()
+            return self.vector_search(embedding, k, corpora), time.perf_counter() - search_start
+
+        start = time.perf_counter()
+        futures = [
+            self.executor.submit(in_context(timed_search), embedding)
+            for embedding in [query_embedding, *term_embeddings]
+        ]
+        searches = [future.result() for future in futures]
+        timings["search"] = time.perf_counter() - start
+        timings["search_serial"] = sum(duration for _, duration in searches)
+
+        documents = {}
+        rankings = []
+        for results, _ in searches:
+            ranking = []
+            for doc, _score in results:
+                chunk_id = doc.metadata.get("id")
+                documents.setdefault(chunk_id, doc)
+                ranking.append(chunk_id)
+            rankings.append(ranking)
+        fused = [(documents[chunk_id], score) for chunk_id, score in reciprocal_rank_fusion(rankings)]
+        # The first search is for the question itself, the rest for expanded terms
+        return Retrieval(trim_to_budget(fused, token_budget), query_embedding, "multi", timings, corpora,
+                         nearest_distance(searches[0][0]))
+
+    def embed_query(self, query_text: str):
+        with stage("embed", texts=1):
+            return self.embedding_function.embed_query(query_text)
+
+    def vector_search(self, query_embedding, k: int, corpora: list = None):
+        with stage("vector_search", k=k, corpora=",".join(corpora or self.db.corpora)):
+            return self.db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k, corpora=corpora)
+
+    def keyword_hits(self, query_text: str, k: int, corpora: list = None):
+        """
+        BM25 hits for `query_text`, keeping only chunks from the given corpora.
+        """
+        with stage("keyword_search", k=k):
+            return self._keyword_hits(query_text, k, corpora)
+
+    def _keyword_hits(self, query_text: str, k: int, corpora: list = None):
+        if not corpora or set(corpora) >= set(self.db.corpora):
+            return self.keyword_index.search(query_text, k)
+        # The keyword index spans every corpus, so over-fetch before filtering
+        hits = self.keyword_index.search(query_text, k * 3)
+        return [(chunk_id, score) for chunk_id, score in hits if self.db.corpus_of(chunk_id) in corpora][:k]
+
+    def keyword_search(self, query_text: str, k: int, corpora: list = None, chunks: dict = None):
+        return self.fetch(self.keyword_hits(query_text, k, corpora), chunks)
+
+    def fetch(self, hits, chunks: dict = None):
+        """
+        Load the chunks for (chunk_id, score) hits from Chroma, keeping hit order.
+        Chunks already in `chunks` are reused and loaded ones are added to it.
+        """
+        if not hits:
+            return []
+        by_id = chunks if chunks is not None else {}
+        missing = [chunk_id for chunk_id, _ in hits if chunk_id not in by_id]
+        if missing:
+            with stage("fetch", chunks=len(missing)):
+                items = self.db.get(ids=missing, include=["documents", "metadatas"])
+            by_id.update({
+                chunk_id: Document(page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(items["ids"], items["documents"], items["metadatas"])
+            })
+        return [(by_id[chunk_id], score) for chunk_id, score in hits if chunk_id in by_id]
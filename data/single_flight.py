@@ -0,0 +1,269 @@
+import asyncio
+import contextvars
+import os
+import threading
+
+from data.embedding_cache import normalize_text
+
+
+COALESCE_REQUESTS = os.environ.get("COALESCE_REQUESTS", "1") != "0"
+
+
+class FlightAbandoned(ValueError):
+    """
+    Raised to requests waiting on a computation that stopped before finishing
+    because every request sharing it went away.
+    """
+
+
+class Flight:
+    """
+    One in-progress computation whose events are shared with every request
+    asking the same question.
+
+    The computation runs on a thread or task of its own that publishes each
+    (event, payload) pair as it is produced; every request subscribed to the
+    flight replays the events published so far and then waits for new ones. A
+    "done" event completes the flight. Subscribers may be threads or coroutines
+    on any event loop, and any of them can go away without affecting the rest;
+    the computation is only stopped once none are left.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cancelled = False
+        self._cancel = None
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def subscribe(self) -> bool:
+        """
+        Returns:
+            bool: False if the flight already finished or was cancelled and
+            cannot be joined.
+        """
+        with self._condition:
+            if self.done or self.cancelled:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._condition:
+            self.subscribers -= 1
+            if self.subscribers > 0 or self.done:
+                return
+            self.cancelled = True
+            cancel = self._cancel
+        if cancel is not None:
+            cancel()
+
+    def publish(self, event):
+        with self._condition:
+            self.events.append(event)
+            if event[0] == "done":
+                self.done = True
+            self._notify()
+
+    def finish(self, error: Exception = None):
+        with self._condition:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def _notify(self):
+        self._condition.notify_all()
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(waiter.set)
+        self._async_waiters = []
+
+    def pump(self, events):
+        """
+        Run `events` to completion, publishing each one; stops early only if
+        the flight is cancelled.
+        """
+        error = FlightAbandoned("The shared request was cancelled before it finished; please retry.")
+        try:
+            for event in events:
+                if self.cancelled:
+                    return
+                self.publish(event)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self.finish(error)
+            events.close()
+
+    async def apump(self, events):
+        """
+        Asynchronous variant of pump for an async iterator of events; stopped
+        by cancelling its task.
+        """
+        error = FlightAbandoned("The shared request was cancelled before it finished; please retry.")
+        try:
+            async for event in events:
+                self.publish(event)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self.finish(error)
+            await events.aclose()
+
+    def follow(self):
+        """
+        Yield every event of the flight, blocking the calling thread while
+        waiting for the next one.
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.events) and not self.done:
+                    self._condition.wait()
+                pending = self.events[index:]
+                done, error = self.done, self.error
+            for event in pending:
+                yield event
+            index += len(pending)
+            if done and index >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+    async def afollow(self):
+        """
+        Asynchronous variant of follow that never blocks the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            waiter = None
+            with self._condition:
+                pending = self.events[index:]
+                done, error = self.done, self.error
+                if not pending and not done:
+                    waiter = asyncio.Event()
+                    self._async_waiters.append((loop, waiter))
+            if waiter is not None:
+                await waiter.wait()
+                continue
+            for event in pending:
+                yield event
+            index += len(pending)
+            if done and index >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent requests for the same computation.
+
+    The first request for a key becomes the leader and starts the pipeline on a
+    thread (or task) of its own; any request for the same key arriving before it
+    finishes joins its Flight and receives the same events instead of embedding,
+    searching and calling the LLM again. Since the leader only consumes the
+    flight like everyone else, its client disconnecting does not fail the
+    others. A finished key is forgotten, so later requests go through the
+    response cache as usual.
+    """
+
+    def __init__(self, enabled: bool = COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(query_text: str, contracts_hash: str, *options):
+        return (normalize_text(query_text), contracts_hash, *options)
+
+    def join(self, key):
+        """
+        Returns:
+            tuple: (Flight, is_leader), already subscribed to.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.subscribe():
+                self.coalesced += 1
+                return flight, False
+            flight = Flight()
+            flight.subscribe()
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def leave(self, key, flight: Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _pump(self, key, flight: Flight, make_events):
+        try:
+            flight.pump(make_events())
+        finally:
+            self.leave(key, flight)
+
+    async def _apump(self, key, flight: Flight, make_events):
+        try:
+            await flight.apump(make_events())
+        finally:
+            self.leave(key, flight)
+
+    def run(self, key, make_events):
+        """
+        Yield the events for `key`, computing them with `make_events()` only if no
+        identical request is already in flight.
+        """
+        if not self.enabled:
+            yield from make_events()
+            return
+        flight, is_leader = self.join(key)
+        if is_leader:
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, key, flight, make_events),
+                name="single-flight", daemon=True,
+            ).start()
+        try:
+            yield from flight.follow()
+        finally:
+            flight.unsubscribe()
+
+    async def arun(self, key, make_events):
+        """
+        Asynchronous variant of run; `make_events()` returns an async iterator.
+        """
+        if not self.enabled:
+            async for event in make_events():
+                yield event
+            return
+        flight, is_leader = self.join(key)
+        if is_leader:
+            loop = asyncio.get_running_loop()
+            task = loop.create_task(self._apump(key, flight, make_events))
+            # Holding the task keeps it alive; the last subscriber to leave cancels it
+            flight._cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+        try:
+            async for event in flight.afollow():
+                yield event
+        finally:
+            flight.unsubscribe()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,226 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics, trace
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    ConsoleMetricExporter, InMemoryMetricReader, PeriodicExportingMetricReader,
+)
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+
+# "none", "console", "file" or "otlp"; console and file work offline
+TELEMETRY_EXPORTER = os.environ.get("TELEMETRY_EXPORTER", "none")
+TELEMETRY_FILE = os.environ.get("TELEMETRY_FILE", "telemetry.log")
+TELEMETRY_EXPORT_INTERVAL_MS = int(os.environ.get("TELEMETRY_EXPORT_INTERVAL_MS", "60000"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+tracer = trace.get_tracer("stacks_ai.rag")
+meter = metrics.get_meter("stacks_ai.rag")
+
+STAGE_DURATION = meter.create_histogram(
+    "rag_stage_duration_seconds", unit="s", description="Time spent in each stage of a RAG request or ingestion run"
+)
+LLM_TOKENS = meter.create_histogram(
+    "rag_llm_tokens", unit="{token}", description="Estimated tokens sent to and generated by the LLM per call"
+)
+LLM_TIME_TO_FIRST_TOKEN = meter.create_histogram(
+    "rag_llm_time_to_first_token_seconds", unit="s", description="Time until the LLM streamed its first token"
+)
+RELEVANCE_GATE_DECISIONS = meter.create_counter(
+    "rag_relevance_gate_decisions", unit="{request}",
+    description="Requests checked by the relevance gate, by decision (gated, passed or skipped)"
+)
+
+_metric_reader = None
+_providers = []
+_setup_lock = threading.Lock()
+
+
+def setup_telemetry(service_name: str, exporter: str = TELEMETRY_EXPORTER):
+    """
+    Install the tracer and meter providers for this process. Safe to call more
+    than once; only the first call has an effect.
+
+    Metrics are always kept in memory for render_prometheus. Spans and metrics
+    are additionally exported to stdout ("console"), appended to TELEMETRY_FILE
+    ("file") or sent to an OTLP collector ("otlp").
+    """
+    global _metric_reader
+    with _setup_lock:
+        if _metric_reader is not None:
+            return
+        resource = Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", service_name)})
+
+        readers = [InMemoryMetricReader()]
+        span_exporter = None
+        if exporter in ("console", "file"):
+            out = open(TELEMETRY_FILE, "a") if exporter == "file" else None
+            kwargs = {"out": out} if out is not None else {}
+            span_exporter = ConsoleSpanExporter(**kwargs)
+            readers.append(PeriodicExportingMetricReader(
+                ConsoleMetricExporter(**kwargs), export_interval_millis=TELEMETRY_EXPORT_INTERVAL_MS
+            ))
+        elif exporter == "otlp":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+            span_exporter = OTLPSpanExporter()
+
+        tracer_provider = TracerProvider(resource=resource)
+        if span_exporter is not None:
+            tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(tracer_provider)
+
+        meter_provider = MeterProvider(
+            resource=resource,
+            metric_readers=readers,
+            views=[
+                View(instrument_name="*_seconds", aggregation=ExplicitBucketHistogramAggregation(DURATION_BUCKETS)),
+                View(instrument_name="rag_llm_tokens", aggregation=ExplicitBucketHistogramAggregation(TOKEN_BUCKETS)),
+            ],
+        )
+        metrics.set_meter_provider(meter_provider)
+        _providers.extend([tracer_provider, meter_provider])
+        _metric_reader = readers[0]
+
+
+def shutdown_telemetry():
+    """
+    Export whatever is still buffered. Short-lived processes such as
+    populate_database call this before exiting.
+    """
+    for provider in _providers:
+        provider.shutdown()
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """
+    Trace a block as the span "rag.<name>" and record its duration under
+    stage=<name>. The span is yielded so callers can attach attributes.
+    """
+    start = time.perf_counter()
+    with tracer.start_as_current_span(f"rag.{name}", attributes=attributes) as span:
+        try:
+            yield span
+        finally:
+            STAGE_DURATION.record(time.perf_counter() - start, {"stage": name})
+
+
+def in_context(fn):
+    """
+    Bind `fn` to a copy of the caller's context, so spans it starts on an
+    executor thread are children of the caller's current span.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class StageTimer:
+    """
+    Same as stage() for work that is spread over a generator's yields, where a
+    span cannot stay attached to the current context.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.span = tracer.start_span(f"rag.{name}", attributes=attributes)
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+            LLM_TIME_TO_FIRST_TOKEN.record(self.first_token, {"stage": self.name})
+            self.span.add_event("first_token")
+
+    def end(self, error: Exception = None, **attributes):
+        elapsed = time.perf_counter() - self.start
+        self.span.set_attributes(attributes)
+        if error is not None:
+            self.span.record_exception(error)
+            self.span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+        self.span.end()
+        STAGE_DURATION.record(elapsed, {"stage": self.name})
+        return elapsed
+
+
+def record_llm_tokens(prompt_tokens: int, completion_tokens: int):
+    LLM_TOKENS.record(prompt_tokens, {"kind": "prompt"})
+    LLM_TOKENS.record(completion_tokens, {"kind": "completion"})
+
+
+def record_gate_decision(decision: str):
+    RELEVANCE_GATE_DECISIONS.add(1, {"decision": decision})
+
+
+def stage_totals() -> dict:
+    """
+    Calls and total seconds recorded so far per stage, e.g. for benchmark reports.
+
+    Returns:
+        dict: {stage: {"count": int, "seconds": float}}
+    """
+    totals = {}
+    data = _metric_reader.get_metrics_data() if _metric_reader is not None else None
+    for resource_metrics in (data.resource_metrics if data else []):
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                if metric.name != "rag_stage_duration_seconds":
+                    continue
+                for point in metric.data.data_points:
+                    totals[point.attributes.get("stage")] = {"count": point.count, "seconds": point.sum}
+    return totals
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(attributes: dict, **extra) -> str:
+    items = {**dict(attributes or {}), **extra}
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(items.items())) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    Current metrics in the Prometheus text exposition format, for /metrics.
+    """
+    if _metric_reader is None:
+        return ""
+    data = _metric_reader.get_metrics_data()
+    lines = []
+    for resource_metrics in (data.resource_metrics if data else []):
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                name = metric.name.replace(".", "_")
+                points = metric.data.data_points
+                if hasattr(points[0] if points else None, "bucket_counts"):
+                    kind = "histogram"
+                elif getattr(metric.data, "is_monotonic", False):
+                    kind = "counter"
+                else:
+                    kind = "gauge"
+                lines.append(f"# HELP {name} {metric.description}")
+                lines.append(f"# TYPE {name} {kind}")
+                for point in points:
+                    if kind != "histogram":
+                        lines.append(f"{name}{_labels(point.attributes)} {point.value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*point.explicit_bounds, "+Inf"], point.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(point.attributes, le=str(bound))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(point.attributes)} {point.sum}")
+                    lines.append(f"{name}_count{_labels(point.attributes)} {point.count}")
+    return "\n".join(lines) + "\n"
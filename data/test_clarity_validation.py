@@ -0,0 +1,129 @@
+try:
+    from data.clarity_validation import ContractValidator, check_clarity, extract_clarity
+except ImportError:
+    from clarity_validation import ContractValidator, check_clarity, extract_clarity
+
+
+COUNTER = """\
+;; counter.clar
+(define-data-var counter uint u0)
+(define-constant err-underflow (err u100))
+
+(define-read-only (get-counter)
+  (ok (var-get counter)))
+
+(define-public (increment)
+  (begin
+    (var-set counter (+ (var-get counter) u1))
+    (print { event: "increment", value: (var-get counter) })
+    (ok (var-get counter))))
+
+(define-public (decrement)
+  (let ((current (var-get counter)))
+    (asserts! (> current u0) err-underflow)
+    (ok (var-set counter (- current u1)))))
+"""
+
+FUNGIBLE_TOKEN = """\
+(impl-trait 'SP3FBR2AGK5H9QBDH3EEN6DF8EK8JY7RX8QJ5SVTE.sip-010-trait-ft-standard.sip-010-trait)
+
+(define-fungible-token clarity-coin u1000000)
+(define-constant contract-owner tx-sender)
+(define-constant err-owner-only (err u100))
+(define-constant err-not-token-owner (err u101))
+
+(define-public (transfer (amount uint) (sender principal) (recipient principal) (memo (optional (buff 34))))
+  (begin
+    (asserts! (is-eq tx-sender sender) err-not-token-owner)
+    (try! (ft-transfer? clarity-coin amount sender recipient))
+    (match memo to-print (print to-print) 0x)
+    (ok true)))
+
+(define-read-only (get-name) (ok "Clarity Coin"))
+(define-read-only (get-symbol) (ok "CC"))
+(define-read-only (get-decimals) (ok u6))
+(define-read-only (get-balance (who principal)) (ok (ft-get-balance clarity-coin who)))
+(define-read-only (get-total-supply) (ok (ft-get-supply clarity-coin)))
+(define-read-only (get-token-uri) (ok none))
+
+(define-public (mint (amount uint) (recipient principal))
+  (begin
+    (asserts! (is-eq tx-sender contract-owner) err-owner-only)
+    (ft-mint? clarity-coin amount recipient)))
+"""
+
+# Top-level expressions other than definitions run when the contract is deployed
+REGISTRY = """\
+(define-map names principal (string-ascii 32))
+(define-non-fungible-token badge uint)
+
+(map-set names tx-sender "deployer")
+(begin
+  (try! (nft-mint? badge u1 tx-sender))
+  (print "registry deployed"))
+(print { deployed-at: block-height })
+"""
+
+
+def test_check_clarity_accepts_contracts():
+    assert check_clarity(COUNTER) == []
+    assert check_clarity(FUNGIBLE_TOKEN) == []
+
+
+def test_check_clarity_accepts_top_level_expressions():
+    assert check_clarity(REGISTRY) == []
+
+
+def test_check_clarity_rejects_top_level_atoms():
+    assert check_clarity(COUNTER + "\ncounter\n") == ["line 19: 'counter' outside a definition"]
+    assert check_clarity(COUNTER + '\n"done"\n') == ["line 19: string outside a definition"]
+    assert check_clarity("{ a: u1 }") == ["line 1: tuple outside a definition"]
+
+
+def test_check_clarity_rejects_unbalanced_code():
+    assert check_clarity(COUNTER.rstrip()[:-1]) == ["line 14: '(' is never closed"]
+    assert check_clarity("(define-data-var x uint u0))") == ["line 1: unexpected ')'"]
+    assert check_clarity('(print "unterminated)') == ["line 1: unterminated string", "line 1: '(' is never closed"]
+
+
+def test_check_clarity_requires_named_definitions():
+    assert check_clarity("(define-public (increment) (ok true))") == []
+    assert check_clarity("(define-public (ok true))") == ["line 1: define-public parameter 'true' is not a (name type) pair"]
+    assert check_clarity("(define-read-only (get-counter))") == ["line 1: define-read-only without a body"]
+    assert check_clarity("(define-public ((x uint)) (ok x))") == ["line 1: define-public without a name"]
+    assert check_clarity("(define-constant)") == ["line 1: define-constant without a name"]
+    assert check_clarity("()") == ["line 1: top-level form does not start with a function name"]
+    assert check_clarity(";; nothing here") == ["no top-level forms"]
+
+
+def test_check_clarity_ignores_brackets_in_strings_and_comments():
+    code = '(define-constant greeting "(hello")\n;; unbalanced ) in a comment\n(print greeting)'
+    assert check_clarity(code) == []
+
+
+def test_extract_clarity_from_fenced_blocks():
+    response = (
+        "Here is the contract:\n\n```clarity\n" + COUNTER + "```\n\n"
+        "Call it from your frontend:\n\n```javascript\nawait openContractCall({ functionName: 'increment' });\n```\n"
+    )
+    assert extract_clarity(response) == COUNTER.strip()
+
+
+def test_extract_clarity_from_untagged_blocks():
+    response = "```\n" + COUNTER + "```\n\nand the token:\n\n```\n" + FUNGIBLE_TOKEN + "```"
+    assert extract_clarity(response) == COUNTER.strip() + "\n\n" + FUNGIBLE_TOKEN.strip()
+
+
+def test_extract_clarity_from_unfenced_code():
+    assert extract_clarity(COUNTER) == COUNTER.strip()
+    assert extract_clarity("Clarity is a decidable language for smart contracts.") == ""
+    assert extract_clarity("```js\nconst x = (1 + 2);\n```") == ""
+    assert extract_clarity(None) == ""
+
+
+def test_contract_validator_history_keeps_valid_contracts():
+    validator = ContractValidator()
+    history = ["```clarity\n" + COUNTER + "```", "I can only help with Stacks questions.", "(define-public (oops)"]
+    assert validator.history(history) == [COUNTER.strip()]
+    assert validator.history(history) == [COUNTER.strip()]
+    assert validator.stats() == {"hits": 2, "misses": 2, "rejected": 1, "entries": 2}
@@ -1,6 +1,6 @@
 import os
-from query_data import query_rag
-from langchain_google_genai import GoogleGenerativeAI
+from query_data import query_rag, get_rag_engine
+from evaluation import EVAL_PROMPT, parse_verdict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,11 +11,14 @@ if not google_api_key:
 
 
 
-EVAL_PROMPT = """
-Expected Response: {expected_response}
-Actual Response: {actual_response}
----
-(Answer with 'true' or 'false') Does the actual response match the expected response? 
-"""
-
-
+def query_and_validate(question: str, expected_response: str):
+    """
+    Run a question through the RAG pipeline and ask the shared Gemini client
+    whether the answer matches the expected response.
+    """
+    engine = get_rag_engine()
+    response_text, _, _ = query_rag(question, [], engine=engine)
+    prompt = EVAL_PROMPT.format(
+        expected_response=expected_response, actual_response=response_text
+    )
+    return parse_verdict(engine.llm.invoke(prompt))